@@ -0,0 +1,98 @@
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+# Bump when the on-disk layout of index artifacts changes incompatibly
+ARTIFACT_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+# Files written by RAGEngine for one processed document
+ARTIFACT_FILES = [
+    "large_context_index.faiss",
+    "chunks.json",
+    "embeddings.npy",
+    "page_index.npz",
+    "chunk_tokens.npz",
+    "pdf_hash.txt",
+]
+
+
+def write_manifest(artifact_dir: str, **fields) -> Dict:
+    """
+    Write a self-describing manifest for an artifact directory.
+
+    The manifest is written last (via an atomic rename), so its presence marks the
+    artifacts as complete.
+    """
+    manifest = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'files': [name for name in ARTIFACT_FILES if os.path.exists(os.path.join(artifact_dir, name))],
+    }
+    manifest.update(fields)
+    tmp_path = os.path.join(artifact_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(artifact_dir, MANIFEST_NAME))
+    return manifest
+
+
+def invalidate_artifacts(artifact_dir: str):
+    """
+    Mark an artifact directory as incomplete before rebuilding it in place.
+
+    The manifest goes first, so a crash mid-rebuild leaves no manifest vouching for
+    half-written files; pdf_hash.txt goes too, so processing does not skip the document.
+    """
+    for name in (MANIFEST_NAME, "pdf_hash.txt"):
+        path = os.path.join(artifact_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def read_manifest(artifact_dir: str) -> Optional[Dict]:
+    """Read an artifact manifest, or None if the directory has none."""
+    manifest_path = os.path.join(artifact_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def check_compatible(manifest: Dict, embedding_model: str, embedding_dim: int, index_encoding: Optional[str] = None):
+    """
+    Raise ValueError if artifacts were built with a different format or embedding model.
+
+    With index_encoding, the index must also use that encoding: distances from flat,
+    fp16, sq8 and PQ indexes are not comparable, so shards merged by distance must match.
+    """
+    if manifest.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Artifact format {manifest.get('format_version')} is not supported "
+                         f"(expected {ARTIFACT_FORMAT_VERSION})")
+    if manifest.get('embedding_model') != embedding_model:
+        raise ValueError(f"Artifacts were embedded with {manifest.get('embedding_model')}, "
+                         f"but the engine uses {embedding_model}")
+    if manifest.get('embedding_dim') != embedding_dim:
+        raise ValueError(f"Artifact dimension {manifest.get('embedding_dim')} does not match "
+                         f"the engine's {embedding_dim}")
+    # Manifests written before index encodings existed describe flat indexes
+    if index_encoding is not None and manifest.get('index_encoding', 'flat') != index_encoding:
+        raise ValueError(f"Artifacts use the {manifest.get('index_encoding', 'flat')} index encoding, "
+                         f"but the engine uses {index_encoding}")
+
+
+def scan_library(library_dir: str) -> List[Dict]:
+    """Return manifests (with their 'path') for every complete artifact directory in a library."""
+    entries = []
+    if not os.path.isdir(library_dir):
+        return entries
+    for name in sorted(os.listdir(library_dir)):
+        artifact_dir = os.path.join(library_dir, name)
+        if not os.path.isdir(artifact_dir):
+            continue
+        manifest = read_manifest(artifact_dir)
+        if manifest is not None:
+            manifest['path'] = artifact_dir
+            entries.append(manifest)
+    return entries
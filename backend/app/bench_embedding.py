@@ -0,0 +1,79 @@
+"""
+Measure embedding throughput of the fixed 64-item batches versus the token-budgeted scheduler.
+
+Usage (from the backend directory):
+    python -m app.bench_embedding textbook1.pdf [textbook2.pdf ...] [--token-budget 16384]
+"""
+import argparse
+import time
+import numpy as np
+from .rag import RAGEngine
+from .embedding_scheduler import count_and_truncate, encode_scheduled, plan_batches, padding_efficiency
+
+
+def _encode_fixed(embedder, texts, batch_size=64):
+    """The previous strategy: document order, fixed item count per batch."""
+    batches = []
+    for i in range(0, len(texts), batch_size):
+        batches.append(embedder.encode(texts[i:i + batch_size], convert_to_numpy=True,
+                                       show_progress_bar=False, batch_size=batch_size))
+    return np.vstack(batches)
+
+
+def bench_pdf(engine: RAGEngine, pdf_path: str, token_budget: int):
+    """Chunk one PDF the way process_pdf does and time both batching strategies."""
+    text, page_numbers = engine._load_pdf_text(pdf_path)
+    chunks = engine._chunk_text_with_pages(text, page_numbers, max_tokens=300)
+
+    start = time.perf_counter()
+    texts, lengths = count_and_truncate(engine.tokenizer, [c['text'] for c in chunks], engine.embedder.max_seq_length)
+    count_seconds = time.perf_counter() - start
+
+    # Warm up so the first timed strategy does not pay one-off initialization costs
+    engine.embedder.encode(texts[:8], convert_to_numpy=True, show_progress_bar=False)
+
+    start = time.perf_counter()
+    fixed = _encode_fixed(engine.embedder, texts)
+    fixed_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scheduled = encode_scheduled(engine.embedder, texts, lengths, token_budget)
+    scheduled_seconds = time.perf_counter() - start
+
+    fixed_batches = [list(range(i, min(i + 64, len(lengths)))) for i in range(0, len(lengths), 64)]
+    return {
+        'pdf': pdf_path,
+        'chunks': len(texts),
+        'tokens': sum(lengths),
+        'count_seconds': count_seconds,
+        'fixed_seconds': fixed_seconds,
+        'scheduled_seconds': scheduled_seconds,
+        'fixed_padding_efficiency': padding_efficiency(fixed_batches, lengths),
+        'scheduled_padding_efficiency': padding_efficiency(plan_batches(lengths, token_budget), lengths),
+        'max_abs_diff': float(np.abs(fixed - scheduled).max()) if len(texts) else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding batch scheduling on real PDFs")
+    parser.add_argument("pdfs", nargs="+", help="PDF files to chunk and embed")
+    parser.add_argument("--token-budget", type=int, default=16384, help="Padded tokens per forward pass")
+    args = parser.parse_args()
+
+    engine = RAGEngine(load_llm=False, load_existing_index=False)
+    for pdf_path in args.pdfs:
+        result = bench_pdf(engine, pdf_path, args.token_budget)
+        speedup = result['fixed_seconds'] / result['scheduled_seconds'] if result['scheduled_seconds'] else float('nan')
+        print(f"\n📊 {result['pdf']}: {result['chunks']} chunks, {result['tokens']} tokens "
+              f"(counted in {result['count_seconds']:.2f}s)")
+        print(f"   fixed 64:  {result['fixed_seconds']:.2f}s "
+              f"({result['chunks'] / result['fixed_seconds']:.1f} chunks/s, "
+              f"padding efficiency {result['fixed_padding_efficiency']:.0%})")
+        print(f"   scheduled: {result['scheduled_seconds']:.2f}s "
+              f"({result['chunks'] / result['scheduled_seconds']:.1f} chunks/s, "
+              f"padding efficiency {result['scheduled_padding_efficiency']:.0%})")
+        print(f"   speedup {speedup:.2f}x, max embedding difference {result['max_abs_diff']:.2e}")
+
+
+if __name__ == "__main__":
+    main()
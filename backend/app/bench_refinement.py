@@ -0,0 +1,96 @@
+"""
+Compare query refinement modes on retrieval quality and latency.
+
+Usage (from the backend directory, after a PDF has been processed):
+    python -m app.bench_refinement questions.txt [--modes none,llm,rocchio,rocchio_terms] [--qrels qrels.json]
+
+questions.txt holds one question per line. qrels.json optionally maps each question to
+the pages that answer it; without it, quality is judged by the base reranker's mean score
+for the top-k dense hits against the original question. The llm mode needs GOOGLE_API_KEY
+(or GEMINI_API_ENDPOINT pointing at app.fake_gemini). The engine's query caches are
+disabled, so no mode benefits from work an earlier mode did for the same question.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from .rag import RAGEngine
+from .query_expansion import REFINEMENT_MODES
+from .prewarm import LRUCache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query refinement modes")
+    parser.add_argument("questions", help="Text file with one question per line")
+    parser.add_argument("--modes", default="none," + ",".join(REFINEMENT_MODES),
+                        help="Comma-separated modes; none searches with the raw question")
+    parser.add_argument("--qrels", help="JSON file mapping questions to lists of relevant page numbers")
+    parser.add_argument("--k", type=int, default=10, help="Dense hits evaluated per question")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode != "none" and mode not in REFINEMENT_MODES]
+    if unknown:
+        raise SystemExit(f"Unknown modes: {', '.join(unknown)}")
+    with open(args.questions) as f:
+        questions = [line.strip() for line in f if line.strip()]
+    qrels = {}
+    if args.qrels:
+        with open(args.qrels) as f:
+            qrels = {question: set(pages) for question, pages in json.load(f).items()}
+
+    engine = RAGEngine(load_llm="llm" in modes)
+    if engine.index is None:
+        raise SystemExit("No processed index found in the current directory")
+    # Every mode must pay for its own embeddings and searches, not reuse what an earlier mode cached
+    engine.embedding_cache = LRUCache(0)
+    engine.retrieval_cache = LRUCache(0)
+    # One-off costs (lazy model initialization, term statistics) must not land on whichever mode runs first
+    engine._warm_models()
+    if "rocchio_terms" in modes:
+        engine._term_frequencies()
+
+    results = {mode: {'latency': [], 'rerank_score': [], 'page_recall': [], 'mrr': [], 'hits': []} for mode in modes}
+    for question in questions:
+        for mode in modes:
+            start = time.perf_counter()
+            if mode == "none":
+                query_text, query_vector = question, None
+            else:
+                engine.refinement_mode = mode
+                query_text, query_vector = engine._refine_query(question, [])
+            if query_vector is None:
+                query_vector = engine._embed_query(query_text)
+            results[mode]['latency'].append(time.perf_counter() - start)
+
+            D, I = engine._search_index(query_vector, args.k)
+            hits = [int(idx) for idx in I[0] if 0 <= idx < len(engine.chunks)]
+            results[mode]['hits'].append(hits)
+            # Judge every mode against the original question, not its own rewrite
+            results[mode]['rerank_score'].append(float(np.mean(engine._score_candidates(question, hits))) if hits else 0.0)
+
+            relevant = qrels.get(question)
+            if relevant:
+                pages = [set(engine.chunks[idx]['pages']) for idx in hits]
+                found = set().union(*pages) & relevant if pages else set()
+                results[mode]['page_recall'].append(len(found) / len(relevant))
+                rank = next((rank for rank, chunk_pages in enumerate(pages, 1) if chunk_pages & relevant), None)
+                results[mode]['mrr'].append(1 / rank if rank else 0.0)
+
+    print(f"\n📊 {len(questions)} questions, top-{args.k} dense hits")
+    baseline = results.get("llm") or results.get("none")
+    for mode in modes:
+        r = results[mode]
+        line = (f"   {mode:<14} refine mean {np.mean(r['latency']) * 1000:7.1f} ms, "
+                f"p95 {np.percentile(r['latency'], 95) * 1000:7.1f} ms, "
+                f"reranker score {np.mean(r['rerank_score']):.3f}")
+        if r['page_recall']:
+            line += f", page recall {np.mean(r['page_recall']):.3f}, MRR {np.mean(r['mrr']):.3f}"
+        if baseline is not None and r is not baseline:
+            overlap = [len(set(a) & set(b)) / max(1, len(b)) for a, b in zip(r['hits'], baseline['hits'])]
+            line += f", overlap with {'llm' if 'llm' in results else 'none'} {np.mean(overlap):.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare cascade reranking against scoring every FAISS candidate with the base reranker.
+
+Usage (from the backend directory, after a PDF has been processed):
+    python -m app.bench_rerank questions.txt [--k 10]
+
+questions.txt holds one question per line.
+"""
+import argparse
+import time
+import numpy as np
+from .rag import RAGEngine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cascade reranking against full reranking")
+    parser.add_argument("questions", help="Text file with one question per line")
+    parser.add_argument("--k", type=int, default=10, help="Chunks kept after reranking")
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    engine = RAGEngine(load_llm=False)
+    if engine.index is None:
+        raise SystemExit("No processed index found in the current directory")
+
+    full_times, cascade_times, scored, overlaps = [], [], [], []
+    pruned, skipped = [], []
+    for question in questions:
+        q_emb = engine.embedder.encode([question], convert_to_numpy=True, batch_size=1)
+        D, I = engine._search_index(q_emb, min(args.k * 3, 30))
+        indices = [int(idx) for idx in I[0] if idx >= 0]
+        distances = [float(dist) for idx, dist in zip(I[0], D[0]) if idx >= 0]
+
+        engine.cascade_enabled = False
+        start = time.perf_counter()
+        full = engine._rerank_chunks(question, indices, top_k=args.k, distances=distances)
+        full_times.append(time.perf_counter() - start)
+
+        engine.cascade_enabled = True
+        stats = {}
+        start = time.perf_counter()
+        cascade = engine._rerank_chunks(question, indices, top_k=args.k, distances=distances, stats=stats)
+        cascade_times.append(time.perf_counter() - start)
+
+        scored.append(stats.get('scored', len(indices)) / max(1, len(indices)))
+        pruned.append(stats.get('stage1_pruned', 0))
+        skipped.append(stats.get('stage2_skipped', 0))
+        overlaps.append(len(set(full) & set(cascade)) / max(1, len(full)))
+
+    print(f"\n📊 {len(questions)} questions, top-{args.k}")
+    print(f"   full reranking:    mean {np.mean(full_times) * 1000:.1f} ms")
+    print(f"   cascade reranking: mean {np.mean(cascade_times) * 1000:.1f} ms, "
+          f"{np.mean(scored):.0%} of candidates scored")
+    print(f"   stage 1 pruned {np.mean(pruned):.1f}, stage 2 early stop skipped {np.mean(skipped):.1f} candidates per question "
+          f"(skipped on {sum(1 for n in skipped if n > 0)}/{len(skipped)} questions)")
+    print(f"   top-{args.k} overlap with full reranking: {np.mean(overlaps):.3f}")
+
+
+if __name__ == "__main__":
+    main()
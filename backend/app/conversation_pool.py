@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def drift(a: np.ndarray, b: np.ndarray) -> float:
+    """Cosine distance between two query embeddings (0 = same direction)."""
+    a = np.asarray(a, dtype='float32').reshape(-1)
+    b = np.asarray(b, dtype='float32').reshape(-1)
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    if denom == 0.0:
+        return 1.0
+    return 1.0 - float(np.dot(a, b)) / denom
+
+
+class WarmPool:
+    """Candidates and reranker scores of a conversation's last retrieval."""
+
+    def __init__(self, document_id: str, vector: np.ndarray, query: str, candidates: List[int], scores: Dict[int, float]):
+        self.document_id = document_id
+        self.vector = vector
+        self.query = query
+        self.candidates = candidates
+        self.scores = scores
+        self.updated = time.time()
+        self.hits = 0
+
+
+class ConversationPools:
+    """
+    Warm candidate pools keyed by conversation id, bounded in count and age (LRU).
+
+    A follow-up whose query embedding stays within max_drift of the previous turn's
+    gets that turn's pool back, so only a small fresh search has to be added to it.
+    """
+
+    def __init__(self, max_drift: float = 0.15, max_conversations: int = 1000, ttl: float = 1800.0):
+        self.max_drift = max_drift
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.pools: "OrderedDict[str, WarmPool]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.missed = 0
+
+    def __len__(self) -> int:
+        return len(self.pools)
+
+    def lookup(self, conversation_id: str, document_id: str, vector: np.ndarray) -> Tuple[Optional[WarmPool], Optional[float]]:
+        """The conversation's pool and the query drift, or (None, drift) when it cannot be reused."""
+        with self.lock:
+            pool = self.pools.get(conversation_id)
+            if pool is None or pool.document_id != document_id or time.time() - pool.updated > self.ttl:
+                self.missed += 1
+                return None, None
+            self.pools.move_to_end(conversation_id)
+        distance = drift(vector, pool.vector)
+        with self.lock:
+            if distance > self.max_drift:
+                self.missed += 1
+                return None, distance
+            self.reused += 1
+            pool.hits += 1
+        return pool, distance
+
+    def store(self, conversation_id: str, pool: WarmPool):
+        with self.lock:
+            self.pools[conversation_id] = pool
+            self.pools.move_to_end(conversation_id)
+            while len(self.pools) > self.max_conversations:
+                self.pools.popitem(last=False)
+
+    def clear(self):
+        """Drop every pool (the indexed document changed)."""
+        with self.lock:
+            self.pools.clear()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'conversations': len(self.pools), 'reused': self.reused, 'missed': self.missed,
+                    'max_drift': self.max_drift}
@@ -0,0 +1,42 @@
+import time
+from typing import List, Optional
+
+
+class Deadline:
+    """
+    Overall time budget for one request, passed through every pipeline stage.
+
+    Stages ask how much time is left and record any degradation they applied, so the
+    response can report what was skipped or shrunk to stay within the budget.
+    """
+
+    def __init__(self, budget_seconds: float):
+        self.budget = budget_seconds
+        self.start = time.monotonic()
+        self.expires = self.start + budget_seconds
+        self.degradations: List[dict] = []
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative)."""
+        return max(0.0, self.expires - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def degrade(self, stage: str, action: str, detail: Optional[str] = None):
+        """Record a degradation applied to meet the deadline."""
+        entry = {'stage': stage, 'action': action, 'remaining_ms': int(self.remaining() * 1000)}
+        if detail:
+            entry['detail'] = detail
+        self.degradations.append(entry)
+        print(f"⏳ Deadline: {action} {stage} ({entry['remaining_ms']} ms left{', ' + detail if detail else ''})")
+
+    def to_dict(self) -> dict:
+        return {
+            'budget_ms': int(self.budget * 1000),
+            'elapsed_ms': int(self.elapsed() * 1000),
+            'degradations': self.degradations,
+        }
@@ -0,0 +1,174 @@
+import hashlib
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_SPACES = re.compile(r"\s+")
+_WORDS = re.compile(r"\w+")
+_LETTER_WORD = re.compile(r"[^\W\d_]{3,}")
+# A bare page number: "12", "- 12 -", "Page 12", "12 of 300"
+_PAGE_NUMBER = re.compile(r"^(page\s*)?[-\u2013\u2014(\[]?\s*\d{1,4}\s*[-\u2013\u2014)\]]?(\s*(of|/)\s*\d{1,4})?$")
+# A running header or footer carries its page number as a leading or trailing integer
+_EDGE_PAGE_NUMBER = re.compile(r"^\d{1,4}(?=\s+\S)|(?<=\S\s)\d{1,4}$")
+
+
+def normalize_line(line: str) -> str:
+    """Comparison key for a line: case-folded with whitespace collapsed."""
+    return _SPACES.sub(" ", line.lower()).strip()
+
+
+def _is_text_line(key: str, min_chars: int) -> bool:
+    """Long enough and wordy enough to be a header or copyright line rather than a math fragment."""
+    return len(key) >= min_chars and _LETTER_WORD.search(key) is not None
+
+
+def _edge_key(line: str, min_chars: int = 8) -> Optional[str]:
+    """
+    Key for header/footer lines, or None for lines never treated as boilerplate.
+
+    Only the page number is masked, so "Page 12" matches "Page 13" and "Mechanics 45" matches
+    "Mechanics 46", while "Example 3.2" or "(2.13)" must repeat verbatim.
+    """
+    key = normalize_line(line)
+    if _PAGE_NUMBER.match(key):
+        return "#page#"
+    if not _is_text_line(key, min_chars):
+        return None
+    return _EDGE_PAGE_NUMBER.sub("#", key)
+
+
+def _anywhere_key(line: str, min_chars: int = 8) -> Optional[str]:
+    key = normalize_line(line)
+    return key if _is_text_line(key, min_chars) else None
+
+
+def _page_lines(page: str, edge_lines: int) -> List[Tuple[str, bool]]:
+    """Lines of a page, each flagged with whether it is among the first or last non-empty lines."""
+    lines = page.splitlines()
+    text_positions = [i for i, line in enumerate(lines) if line.strip()]
+    edges = set(text_positions[:edge_lines] + text_positions[-edge_lines:])
+    return [(line, i in edges) for i, line in enumerate(lines)]
+
+
+def find_boilerplate(pages: List[str], min_pages: int = 4, min_fraction: float = 0.5,
+                     edge_lines: int = 2, min_chars: int = 8) -> Tuple[set, set]:
+    """
+    Lines that repeat across pages: running headers, footers, page numbers, copyright lines.
+
+    Returns (edge patterns, anywhere patterns). A line at the top or bottom edge of a page
+    is boilerplate when it recurs, numbers aside, at the edge of at least min_pages pages
+    (chapter titles in running headers only span one chapter). A line anywhere on the page
+    is boilerplate when it recurs verbatim on at least min_fraction of all pages. Lines shorter
+    than min_chars or without a word of letters (math fragments like "x", "=" or "2") are never
+    boilerplate, except bare page numbers at the edges.
+    """
+    edge_counts = Counter()
+    anywhere_counts = Counter()
+    for page in pages:
+        lines = _page_lines(page, edge_lines)
+        edge_counts.update({_edge_key(line, min_chars) for line, at_edge in lines if at_edge} - {None})
+        anywhere_counts.update({_anywhere_key(line, min_chars) for line, _ in lines if line.strip()} - {None})
+
+    anywhere_threshold = max(min_pages, int(np.ceil(min_fraction * len(pages))))
+    edge = {line for line, count in edge_counts.items() if count >= min_pages}
+    anywhere = {line for line, count in anywhere_counts.items() if count >= anywhere_threshold}
+    return edge, anywhere
+
+
+def strip_boilerplate(pages: List[str], min_pages: int = 4, min_fraction: float = 0.5,
+                      edge_lines: int = 2, min_chars: int = 8) -> Tuple[List[str], Dict]:
+    """Remove boilerplate lines from every page. Returns the cleaned pages and removal stats."""
+    edge, anywhere = find_boilerplate(pages, min_pages=min_pages, min_fraction=min_fraction,
+                                      edge_lines=edge_lines, min_chars=min_chars)
+    cleaned, removed = [], Counter()
+    for page in pages:
+        kept = []
+        for line, at_edge in _page_lines(page, edge_lines):
+            if not line.strip():
+                kept.append(line)
+            elif _anywhere_key(line, min_chars) in anywhere:
+                removed[normalize_line(line)] += 1
+            elif at_edge and _edge_key(line, min_chars) in edge:
+                removed[_edge_key(line, min_chars)] += 1
+            else:
+                kept.append(line)
+        cleaned.append("\n".join(kept))
+    chars_before = sum(len(page) for page in pages)
+    chars_after = sum(len(page) for page in cleaned)
+    stats = {
+        'boilerplate_patterns': len(edge | anywhere),
+        'boilerplate_lines_removed': sum(removed.values()),
+        'boilerplate_chars_removed': chars_before - chars_after,
+        'text_chars_before': chars_before,
+        'text_chars_after': chars_after,
+        'top_boilerplate': [line for line, _ in removed.most_common(5)],
+    }
+    return cleaned, stats
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """64-bit SimHash over word shingles; similar texts get signatures a few bits apart."""
+    words = _WORDS.findall(text.lower())
+    if len(words) < shingle_size:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    # Each bit is set when most shingles vote for it
+    votes = bits.sum(axis=0) * 2 > len(shingles)
+    return int(np.packbits(votes[::-1]).view(">u8")[0])
+
+
+def near_duplicates(signatures: List[int], max_distance: int = 3) -> Dict[int, int]:
+    """
+    Map each near-duplicate position to the earliest position it duplicates.
+
+    Pairs within max_distance bits must agree exactly on at least one of max_distance + 1
+    bands of the signature, so only signatures sharing a band are compared.
+    """
+    bands = max_distance + 1
+    band_bits = 64 // bands
+    mask = (1 << band_bits) - 1
+    buckets = defaultdict(list)
+    duplicate_of = {}
+    for position, signature in enumerate(signatures):
+        candidates = set()
+        keys = [(band, (signature >> (band * band_bits)) & mask) for band in range(bands)]
+        for key in keys:
+            candidates.update(buckets[key])
+        for earlier in sorted(candidates):
+            if bin(signature ^ signatures[earlier]).count("1") <= max_distance:
+                duplicate_of[position] = earlier
+                break
+        if position not in duplicate_of:
+            # Only original chunks are indexed, so every duplicate points at a kept chunk
+            for key in keys:
+                buckets[key].append(position)
+    return duplicate_of
+
+
+def drop_near_duplicates(chunks: List[Dict], max_distance: int = 3) -> Tuple[List[Dict], Dict]:
+    """
+    Drop chunks that nearly duplicate an earlier chunk, merging their pages into the kept one
+    so citations still cover every page the text appeared on.
+    """
+    duplicate_of = near_duplicates([simhash(chunk['text']) for chunk in chunks], max_distance=max_distance)
+    pages = [set(chunk['pages']) for chunk in chunks]
+    for position, original in duplicate_of.items():
+        pages[original].update(pages[position])
+    kept = []
+    for position, chunk in enumerate(chunks):
+        if position not in duplicate_of:
+            kept.append({**chunk, 'pages': sorted(pages[position])})
+    stats = {
+        'chunks_before_dedup': len(chunks),
+        'near_duplicate_chunks_removed': len(duplicate_of),
+        'chunk_chars_removed': sum(len(chunks[position]['text']) for position in duplicate_of),
+    }
+    return kept, stats
@@ -0,0 +1,101 @@
+import numpy as np
+from typing import Callable, List, Optional, Tuple
+
+
+def count_and_truncate(tokenizer, texts: List[str], max_seq_length: int) -> Tuple[List[str], List[int]]:
+    """
+    Count tokens exactly with a single batched tokenizer pass and truncate texts that overflow.
+
+    Args:
+        tokenizer: A fast Hugging Face tokenizer (offset mappings are used to cut at token boundaries)
+        texts: Texts to embed
+        max_seq_length: The embedder's maximum sequence length, including special tokens
+
+    Returns:
+        The texts to embed (truncated at the last token that fits) and their token counts
+    """
+    if not texts:
+        return [], []
+
+    encoded = tokenizer(texts, add_special_tokens=True, truncation=False, return_offsets_mapping=True)
+    # Number of special tokens ([CLS]/[SEP]) added around a single sequence
+    num_special = tokenizer.num_special_tokens_to_add(pair=False)
+    max_content_tokens = max_seq_length - num_special
+
+    truncated_texts = []
+    lengths = []
+    for text, input_ids, offsets in zip(texts, encoded['input_ids'], encoded['offset_mapping']):
+        if len(input_ids) <= max_seq_length:
+            truncated_texts.append(text)
+            lengths.append(len(input_ids))
+            continue
+        # Special tokens have (0, 0) offsets; keep only content tokens that fit
+        content_offsets = [span for span in offsets if span[1] > span[0]]
+        cut = content_offsets[max_content_tokens - 1][1]
+        truncated_texts.append(text[:cut])
+        lengths.append(max_seq_length)
+    return truncated_texts, lengths
+
+
+def plan_batches(lengths: List[int], token_budget: int, max_batch_size: int = 256) -> List[List[int]]:
+    """
+    Group item indices into length-bucketed batches whose padded size fits a token budget.
+
+    Items are sorted longest first, so each batch pads to its first item's length and
+    short chunks are never padded up to the length of long ones.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    current = []
+    current_max = 0
+    for idx in order:
+        padded_len = max(current_max, lengths[idx])
+        if current and (padded_len * (len(current) + 1) > token_budget or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+            padded_len = lengths[idx]
+        current.append(idx)
+        current_max = padded_len
+    if current:
+        batches.append(current)
+    return batches
+
+
+def encode_scheduled(embedder, texts: List[str], lengths: List[int], token_budget: int,
+                     max_batch_size: int = 256, on_batch: Optional[Callable[[int, int, int], None]] = None) -> np.ndarray:
+    """
+    Embed texts in token-budgeted, length-bucketed batches and return embeddings in the original order.
+
+    Args:
+        embedder: SentenceTransformer model
+        texts: Texts to embed (already truncated to the model's max sequence length)
+        lengths: Exact token counts for each text
+        token_budget: Maximum padded tokens (batch size x longest item) per forward pass
+        max_batch_size: Upper bound on items per batch
+        on_batch: Optional callback(batch_number, total_batches, items_done)
+    """
+    batches = plan_batches(lengths, token_budget, max_batch_size)
+    embeddings = None
+    done = 0
+    for batch_number, batch in enumerate(batches, 1):
+        batch_embeddings = embedder.encode(
+            [texts[i] for i in batch],
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            batch_size=len(batch)
+        )
+        if embeddings is None:
+            embeddings = np.zeros((len(texts), batch_embeddings.shape[1]), dtype='float32')
+        # Scatter back to the original document order
+        embeddings[batch] = batch_embeddings
+        done += len(batch)
+        if on_batch:
+            on_batch(batch_number, len(batches), done)
+    return embeddings
+
+
+def padding_efficiency(batches: List[List[int]], lengths: List[int]) -> float:
+    """Fraction of computed (padded) tokens that are real tokens."""
+    real = sum(lengths)
+    padded = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    return real / padded if padded else 1.0
@@ -0,0 +1,107 @@
+"""
+Local stand-in for the Gemini REST API, for exercising the LLM client without using quota.
+
+Usage (from the backend directory):
+    python -m app.fake_gemini --port 8001 --latency-ms 500
+    python -m app.fake_gemini --latency-dist lognormal --latency-ms 800 --latency-sigma 0.5 --output-words 300
+
+Then start the backend with GEMINI_API_ENDPOINT=http://127.0.0.1:8001 and any GOOGLE_API_KEY.
+"""
+import argparse
+import asyncio
+import os
+import random
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+app = FastAPI(title="Fake Gemini API")
+
+# Configured from the command line / environment
+settings = {
+    'latency_ms': float(os.getenv("FAKE_GEMINI_LATENCY_MS", "200")),
+    # fixed, uniform (latency_ms +/- spread), exponential (mean latency_ms) or lognormal (median latency_ms)
+    'latency_dist': os.getenv("FAKE_GEMINI_LATENCY_DIST", "fixed"),
+    'latency_spread_ms': float(os.getenv("FAKE_GEMINI_LATENCY_SPREAD_MS", "100")),
+    'latency_sigma': float(os.getenv("FAKE_GEMINI_LATENCY_SIGMA", "0.5")),
+    'output_words': int(os.getenv("FAKE_GEMINI_OUTPUT_WORDS", "0")),
+    'error_rate': float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0")),
+}
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+FILLER = ("The retrieved passage explains this step with a worked example and the formula "
+          "$E = mc^2$ before moving on to the next section of the chapter.").split()
+
+
+def sample_latency() -> float:
+    """Response delay in seconds drawn from the configured distribution."""
+    latency, dist = settings['latency_ms'], settings['latency_dist']
+    if dist == "uniform":
+        latency = random.uniform(latency - settings['latency_spread_ms'], latency + settings['latency_spread_ms'])
+    elif dist == "exponential":
+        latency = random.expovariate(1 / latency) if latency > 0 else 0
+    elif dist == "lognormal":
+        latency = random.lognormvariate(0, settings['latency_sigma']) * latency
+    return max(0.0, latency) / 1000
+
+
+def _answer_text(model: str, prompt: str) -> str:
+    text = f"## Answer\n**This is a stub answer from {model}.** The prompt had {len(prompt)} characters."
+    if settings['output_words'] > 0:
+        words = [FILLER[i % len(FILLER)] for i in range(settings['output_words'])]
+        text += "\n\n" + " ".join(words)
+    return text
+
+
+def _response_body(text: str) -> dict:
+    """Minimal generateContent response in the shape the Gemini REST API returns."""
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {"promptTokenCount": 0, "candidatesTokenCount": len(text.split()), "totalTokenCount": len(text.split())},
+    }
+
+
+@app.post("/v1beta/models/{model}:generateContent")
+async def generate_content(model: str, request: Request):
+    body = await request.json()
+    prompt = "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+    await asyncio.sleep(sample_latency())
+    if random.random() < settings['error_rate']:
+        # Transient overload, retried by the LLM client
+        return JSONResponse(status_code=503, content={"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}})
+    if prompt.rstrip().endswith("Reformulated question:"):
+        return _response_body("What is the reformulated question about the retrieved content?")
+    return _response_body(_answer_text(model, prompt))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Gemini API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=settings['latency_ms'],
+                        help="Delay before every response (median for lognormal, mean otherwise)")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default=settings['latency_dist'])
+    parser.add_argument("--latency-spread-ms", type=float, default=settings['latency_spread_ms'],
+                        help="Half-width of the uniform distribution")
+    parser.add_argument("--latency-sigma", type=float, default=settings['latency_sigma'],
+                        help="Shape of the lognormal distribution (larger means a longer tail)")
+    parser.add_argument("--output-words", type=int, default=settings['output_words'],
+                        help="Filler words appended to every answer")
+    parser.add_argument("--error-rate", type=float, default=settings['error_rate'],
+                        help="Fraction of calls answered with 503")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    for key in ('latency_ms', 'latency_dist', 'latency_spread_ms', 'latency_sigma', 'output_words', 'error_rate'):
+        settings[key] = getattr(args, key)
+    if args.seed is not None:
+        random.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare compressed index encodings against the exact flat index.
+
+Usage (from the backend directory, after a PDF has been processed):
+    python -m app.index_report [--embeddings embeddings.npy] [--queries 200] [--k 30]
+"""
+import argparse
+import time
+import numpy as np
+from .vector_store import INDEX_ENCODINGS, build_index, bytes_per_vector, search_index
+
+
+def _recall(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """Average fraction of the reference top-k ids found in the candidate top-k ids."""
+    hits = [len(set(ref[ref >= 0]) & set(cand[cand >= 0])) / max(1, (ref >= 0).sum())
+            for ref, cand in zip(reference, candidate)]
+    return float(np.mean(hits))
+
+
+def _timed_search(index, queries, k, full_vectors=None, rescore_factor=4):
+    """Search one query at a time (like the live engine) and return ids plus per-query latencies in ms."""
+    ids = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        _, I = search_index(index, query.reshape(1, -1), k, full_vectors=full_vectors, rescore_factor=rescore_factor)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append(I[0])
+    return np.vstack(ids), np.array(latencies)
+
+
+def run_report(embeddings: np.ndarray, num_queries: int = 200, k: int = 30, rescore_factor: int = 4, seed: int = 0):
+    """Build every encoding over the embeddings and measure size, latency and recall against the flat index."""
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    # Perturb stored vectors slightly so queries are not exact copies of indexed vectors
+    queries = np.asarray(embeddings[sample], dtype='float32')
+    queries = queries + rng.normal(scale=0.02, size=queries.shape).astype('float32')
+
+    flat = build_index(embeddings, "flat")
+    reference, _ = _timed_search(flat, queries, k)
+
+    rows = []
+    for encoding in INDEX_ENCODINGS:
+        index = build_index(embeddings, encoding)
+        ids, latencies = _timed_search(index, queries, k)
+        row = {
+            'encoding': encoding,
+            'bytes_per_vector': bytes_per_vector(index),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'recall': _recall(reference, ids),
+        }
+        if encoding != "flat":
+            rescored_ids, rescored_latencies = _timed_search(index, queries, k, full_vectors=embeddings,
+                                                             rescore_factor=rescore_factor)
+            row['rescored_p50_ms'] = float(np.percentile(rescored_latencies, 50))
+            row['rescored_recall'] = _recall(reference, rescored_ids)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report bytes/vector, latency and recall for index encodings")
+    parser.add_argument("--embeddings", default="embeddings.npy", help="Full-precision embeddings saved by _build_index")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    parser.add_argument("--k", type=int, default=30, help="Top-k used for recall (the engine fetches 30 candidates)")
+    parser.add_argument("--rescore-factor", type=int, default=4, help="Candidate multiplier for exact re-scoring")
+    args = parser.parse_args()
+
+    embeddings = np.load(args.embeddings, mmap_mode='r')
+    print(f"📊 Index report over {embeddings.shape[0]} vectors (d={embeddings.shape[1]}), k={args.k}")
+    rows = run_report(np.asarray(embeddings, dtype='float32'), args.queries, args.k, args.rescore_factor)
+
+    print(f"{'encoding':<8} {'bytes/vec':>10} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7} {'rescored p50':>13} {'rescored recall':>16}")
+    for row in rows:
+        rescored_p50 = f"{row['rescored_p50_ms']:.3f}" if 'rescored_p50_ms' in row else "-"
+        rescored_recall = f"{row['rescored_recall']:.3f}" if 'rescored_recall' in row else "-"
+        print(f"{row['encoding']:<8} {row['bytes_per_vector']:>10.0f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} "
+              f"{row['recall']:>7.3f} {rescored_p50:>13} {rescored_recall:>16}")
+
+
+if __name__ == "__main__":
+    main()
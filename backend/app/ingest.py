@@ -0,0 +1,114 @@
+"""
+Bulk-ingest a directory of PDFs into a library of pre-built index artifacts.
+
+Usage (from the backend directory):
+    python -m app.ingest /path/to/pdfs --out library --workers 4
+
+Each PDF is written to <out>/<content hash>/ with a manifest.json describing the
+embedding model, dimension, chunk parameters and content hash. Start the server
+with RAG_LIBRARY_DIR=<out> to load the artifacts without re-embedding anything.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .artifacts import read_manifest, check_compatible, invalidate_artifacts
+from .threading_config import available_cpus
+
+# One engine (and one copy of the models) per worker process
+_engine = None
+
+
+def _init_worker(library_dir: str, threads_per_worker: int):
+    """Load the models once per worker process."""
+    global _engine
+    os.environ["RAG_LIBRARY_DIR"] = library_dir
+    # Split the cores between workers instead of every worker using all of them
+    os.environ.setdefault("RAG_INGEST_THREADS", str(threads_per_worker))
+    from .rag import RAGEngine
+    _engine = RAGEngine(load_llm=False, load_existing_index=False)
+
+
+def _ingest_one(pdf_path: str, force: bool = False) -> dict:
+    """Build artifacts for one PDF, skipping it if up-to-date artifacts already exist."""
+    start = time.time()
+    pdf_hash = _engine._get_pdf_hash(pdf_path)
+    artifact_dir = os.path.join(_engine.library_dir, pdf_hash)
+
+    manifest = read_manifest(artifact_dir)
+    if manifest is not None and not force:
+        try:
+            check_compatible(manifest, _engine.embedding_model_name, _engine.embedder.get_sentence_embedding_dimension(),
+                             index_encoding=_engine.index_encoding)
+            return {'pdf': pdf_path, 'status': 'skipped', 'content_hash': pdf_hash,
+                    'num_chunks': manifest.get('num_chunks'), 'seconds': time.time() - start}
+        except ValueError as e:
+            print(f"⚠️ Rebuilding {pdf_path}: {e}")
+
+    # Forced or incompatible: rebuild even though the hash matches, and stop trusting the old manifest
+    invalidate_artifacts(artifact_dir)
+
+    _engine.process_pdf(pdf_path)
+    return {'pdf': pdf_path, 'status': 'built', 'content_hash': pdf_hash,
+            'num_chunks': len(_engine.chunks), 'seconds': time.time() - start}
+
+
+def find_pdfs(pdf_dir: str) -> list:
+    """Recursively list PDF files under a directory."""
+    pdfs = []
+    for root, _, files in os.walk(pdf_dir):
+        for name in files:
+            if name.lower().endswith('.pdf'):
+                pdfs.append(os.path.join(root, name))
+    return sorted(pdfs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-build index artifacts for a directory of PDFs")
+    parser.add_argument("pdf_dir", help="Directory containing PDF files (searched recursively)")
+    parser.add_argument("--out", default="library", help="Library directory to write artifacts into")
+    parser.add_argument("--workers", type=int, default=max(1, available_cpus() // 4),
+                        help="Worker processes, each with its own model load")
+    parser.add_argument("--force", action="store_true", help="Rebuild artifacts that already exist")
+    args = parser.parse_args()
+
+    pdfs = find_pdfs(args.pdf_dir)
+    if not pdfs:
+        raise SystemExit(f"No PDF files found in {args.pdf_dir}")
+    os.makedirs(args.out, exist_ok=True)
+    library_dir = os.path.abspath(args.out)
+    threads_per_worker = max(1, available_cpus() // args.workers)
+    print(f"📚 Ingesting {len(pdfs)} PDFs into {library_dir} with {args.workers} workers "
+          f"x {threads_per_worker} threads")
+
+    start = time.time()
+    results = []
+    # Spawn (not fork) so every worker gets a clean torch / tokenizer runtime
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context,
+                             initializer=_init_worker, initargs=(library_dir, threads_per_worker)) as executor:
+        futures = {executor.submit(_ingest_one, pdf, args.force): pdf for pdf in pdfs}
+        for future in as_completed(futures):
+            pdf = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'pdf': pdf, 'status': 'failed', 'error': str(e)}
+            results.append(result)
+            if result['status'] == 'failed':
+                print(f"❌ [{len(results)}/{len(pdfs)}] {pdf}: {result['error']}")
+            else:
+                print(f"✅ [{len(results)}/{len(pdfs)}] {pdf}: {result['status']} "
+                      f"({result['num_chunks']} chunks, {result['seconds']:.1f}s) -> {result['content_hash']}")
+
+    failed = [r for r in results if r['status'] == 'failed']
+    built = [r for r in results if r['status'] == 'built']
+    print(f"\n🎉 Done in {time.time() - start:.1f}s: {len(built)} built, "
+          f"{len(results) - len(built) - len(failed)} skipped, {len(failed)} failed")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
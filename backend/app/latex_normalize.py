@@ -0,0 +1,220 @@
+import re
+from typing import List, Optional
+
+# Bumped whenever the output of the normalizer changes; clients that know this version skip their own preprocessing
+FORMAT_VERSION = 2
+
+# Every rewrite is one alternative of a single compiled pattern, so the text is scanned once.
+# Alternatives are tried left to right at each position: longer or more specific tokens come first.
+_TOKEN = re.compile(r"""
+    (?P<fence>```)
+  | (?P<escaped_dollar>\\\$)
+  | (?P<double_escaped>\\\\(?P<command>[a-zA-Z]+))
+  | (?P<line_break>\\\\)
+  | (?P<display_open>\\\[)
+  | (?P<display_close>\\\])
+  | (?P<inline_delim>\\[()])
+  | (?P<matrix_begin>\\begin\{(?P<begin_env>[pb]matrix)\})
+  | (?P<matrix_end>\\end\{(?P<end_env>[pb]matrix)\}(?P<end_dollars>\$\$?)?)
+  | (?P<display_dollars>\$\$)
+  | (?P<dollar>\$)
+  | (?P<escaped_amp>\\&)
+  | (?P<angle>\\angle(?![a-zA-Z]))
+  | (?P<corruption>-3eEa_0|3ea_0|3ea|eEa_0|eEz)
+  | (?P<perturbation>E_n\^\{(?P<order>[^}\s(][^}\s]{0,19})\})
+  | (?P<blank_lines>\n{3,})
+  | (?P<control>[\x80-\x9f])
+""", re.VERBOSE)
+
+# Garbled sequences the model produces inside matrices, and what they were meant to be
+_CORRUPTIONS = {'-3eEa_0': '-3E_0', '3ea_0': '3E_0', '3ea': '3E', 'eEa_0': 'E_0', 'eEz': ''}
+
+# Text held back while streaming when no space arrives to cut at
+_MAX_PENDING = 4096
+
+# Inline math held back until it closes, in case a matrix inside promotes it to display math
+_MAX_HELD = 4096
+
+
+class LatexNormalizer:
+    """
+    Incremental markdown/LaTeX normalizer for Gemini answers.
+
+    Rewrites in one scan what the renderer used to do with chained regex passes:
+    double-escaped commands, \\( \\) and \\[ \\] delimiters, matrices outside display
+    math, escaped ampersands, \\angle, known garbled matrix entries, perturbation orders
+    E_n^{(k)}, runs of blank lines and C1 control characters. Inline math is held back
+    until it closes and is emitted as display math if it holds a matrix. Math state
+    carries over between feed() calls; fenced code is left untouched.
+    """
+
+    def __init__(self):
+        self.math: Optional[str] = None  # None, '$' or '$$'
+        self.upgraded = False  # inline math holding a matrix, emitted as display math
+        self.held: Optional[List[str]] = None  # output of the open inline math, until it closes
+        self.held_raw: List[str] = []  # the same text as it came in, rescanned if the $ turns out literal
+        self.held_chars = 0
+        self.held_in_code = False
+        self.out: List[str] = []  # output of the scan in progress
+        self.wrapped: List[str] = []  # matrix environments wrapped in $$ by the normalizer
+        self.in_code = False
+        self.pending = ""
+
+    def feed(self, delta: str) -> str:
+        """Normalize streamed text; returns what is safe to emit, holding back a possibly incomplete token."""
+        self.pending += delta
+        # No token spans a space, so everything up to the last space is final
+        cut = max(self.pending.rfind(" "), self.pending.rfind("\t")) + 1
+        if cut == 0 and len(self.pending) > _MAX_PENDING:
+            cut = len(self.pending) - 64
+        if cut == 0:
+            return ""
+        ready, self.pending = self.pending[:cut], self.pending[cut:]
+        return self._scan(ready)
+
+    def finish(self) -> str:
+        """Flush the held-back tail and close any display math the normalizer opened."""
+        out = self._scan(self.pending)
+        self.pending = ""
+        if self.held is not None:
+            # Inline math that never closed goes out as it came
+            out += self._open_delimiter() + "".join(self.held)
+            self.held = None
+        if self.wrapped:
+            out += "$$"
+            self.wrapped = []
+            self.math = None
+        return out
+
+    def _scan(self, text: str) -> str:
+        out, outer = [], self.out
+        self.out = out
+        position = 0
+        for match in _TOKEN.finditer(text):
+            segment = text[position:match.start()]
+            self._emit(segment, segment)
+            holding = self.held is not None
+            piece = self._rewrite(match)
+            # A token that opened or closed inline math is not part of the held text
+            self._emit(piece, match.group(0) if holding and self.held is not None else "")
+            position = match.end()
+        self._emit(text[position:], text[position:])
+        self.out = outer
+        return "".join(out)
+
+    def _emit(self, piece: str, raw: str):
+        if self.held is None:
+            self.out.append(piece)
+            return
+        self.held.append(piece)
+        self.held_raw.append(raw)
+        self.held_chars += len(piece)
+        if "\n\n" in piece:
+            # Inline math does not span paragraphs: the $ was a literal one (a price, say).
+            # Emit it as is and rescan what followed it outside math.
+            rescan = "".join(self.held_raw)
+            self.math, self.upgraded, self.held = None, False, None
+            self.in_code = self.held_in_code
+            self.out.append("$" + self._scan(rescan))
+        elif self.held_chars > _MAX_HELD:
+            # Too long to hold back while streaming; later matrices can no longer promote it
+            self.out.append(self._open_delimiter() + "".join(self.held))
+            self.held = None
+
+    def _open_delimiter(self) -> str:
+        return "$$" if self.upgraded else "$"
+
+    def _hold(self) -> str:
+        """Open inline math; its output is held until it closes."""
+        self.math = "$"
+        self.held, self.held_raw, self.held_chars = [], [], 0
+        self.held_in_code = self.in_code
+        return ""
+
+    def _close_inline(self, tail: str = "") -> str:
+        """Close inline math (as display math if a matrix was found inside), emitting everything held."""
+        closing = self._open_delimiter()
+        opening = "" if self.held is None else closing + "".join(self.held)
+        self.math, self.upgraded, self.held = None, False, None
+        self.out.append(opening + tail + closing)
+        return ""
+
+    def _rewrite(self, match) -> str:
+        token = match.group(0)
+        kind = match.lastgroup  # the outer (token) group closes last
+        if kind == "fence":
+            self.in_code = not self.in_code
+            return token
+        if self.in_code:
+            return token
+
+        if kind == "double_escaped":
+            return "\\" + match.group("command")
+        if kind == "display_open":
+            self.math = "$$"
+            return "$$"
+        if kind == "display_close":
+            self.math = None
+            return "$$"
+        if kind == "inline_delim":
+            if token == "\\(":
+                return self._hold() if self.math is None else "$"
+            return self._close_inline() if self.math == "$" else "$"
+        if kind == "matrix_begin":
+            if self.math is None:
+                # A bare matrix renders as display math
+                self.wrapped.append(match.group("begin_env"))
+                self.math = "$$"
+                return "$$" + token
+            if self.math == "$" and self.held is not None:
+                # Inline math holding a matrix is promoted to display math, both delimiters
+                self.upgraded = True
+            return token
+        if kind == "matrix_end":
+            env, dollars = match.group("end_env"), match.group("end_dollars")
+            closing = "\\end{" + env + "}"
+            if self.wrapped and self.wrapped[-1] == env:
+                self.wrapped.pop()
+                self.math = None
+                return closing + "$$"
+            if dollars and self.math == "$":
+                return self._close_inline(closing)
+            if dollars and self.math == "$$":
+                self.math = None
+                return closing + "$$"
+            if dollars:
+                self.math = "$"
+            return closing + (dollars or "")
+        if kind == "display_dollars":
+            if self.math == "$":
+                # $a$$b$: one inline formula closes and the next opens
+                self._close_inline()
+                return self._hold()
+            self.math = None if self.math else "$$"
+            return token
+        if kind == "dollar":
+            if self.math is None:
+                return self._hold()
+            if self.math == "$":
+                return self._close_inline()
+            self.math = None
+            return token
+        if kind == "escaped_amp":
+            return "&"
+        if kind == "angle":
+            return "\\langle"
+        if kind == "corruption":
+            return _CORRUPTIONS[token] if self.math else token
+        if kind == "perturbation":
+            return "E_n^{(" + match.group("order") + ")}" if self.math else token
+        if kind == "blank_lines":
+            return "\n\n"
+        if kind == "control":
+            return ""
+        return token
+
+
+def normalize_latex(text: str) -> str:
+    """Normalize a complete answer in one pass."""
+    normalizer = LatexNormalizer()
+    return normalizer.feed(text) + normalizer.finish()
@@ -0,0 +1,199 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Optional
+
+# Exception class names (from google.api_core and the stdlib) worth retrying
+RETRYABLE_ERRORS = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError',
+    'DeadlineExceeded', 'GatewayTimeout', 'BadGateway', 'ConnectionError', 'TimeoutError',
+}
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The call's overall deadline passed; never retried, unlike transport timeouts."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transient transport / quota errors are retried; bad requests and safety blocks are not."""
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+class RateLimiter:
+    """Token bucket shared by every LLM call in the process."""
+
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate = rate_per_second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout: float) -> bool:
+        """Take one token, waiting at most timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_time = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait_time > deadline:
+                return False
+            time.sleep(wait_time)
+
+
+class LLMClient:
+    """
+    Long-lived client that every LLM call goes through.
+
+    Provides a shared executor, per-call deadlines that release the caller even if the
+    underlying request is still running, retries with jittered backoff, optional hedged
+    duplicate requests and a global concurrency / rate limit.
+    """
+
+    def __init__(self, generate_fn: Callable[[str, float], object], max_workers: int = 16, max_concurrency: int = 8,
+                 rate_per_second: float = 0, max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedge_percentile: float = 0, hedge_min_samples: int = 20):
+        """
+        Args:
+            generate_fn: Performs one request: generate_fn(prompt, timeout_seconds) -> response
+            max_workers: Threads in the shared executor (abandoned calls keep a thread until they return)
+            max_concurrency: Maximum requests in flight across the process, including hedges
+            rate_per_second: Request rate limit (0 disables it)
+            max_retries: Retries after the first attempt for retryable errors
+            backoff_base / backoff_max: Full-jitter exponential backoff parameters in seconds
+            hedge_percentile: Send a duplicate request once the first has been running longer than this
+                latency percentile (0 disables hedging)
+            hedge_min_samples: Latency samples needed before hedging kicks in
+        """
+        self.generate_fn = generate_fn
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(rate_per_second, burst=max_concurrency) if rate_per_second > 0 else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = deque(maxlen=500)
+        self.counters = {'calls': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'timeouts': 0, 'errors': 0}
+        self.lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self) -> dict:
+        """Counters plus recent latency percentiles, for health / debugging endpoints."""
+        with self.lock:
+            stats = dict(self.counters)
+            samples = sorted(self.latencies)
+        if samples:
+            stats['p50_seconds'] = samples[len(samples) // 2]
+            stats['p95_seconds'] = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return stats
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Latency percentile after which a duplicate request is sent, or None if hedging is off."""
+        if self.hedge_percentile <= 0:
+            return None
+        with self.lock:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            samples = sorted(self.latencies)
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))]
+
+    def _submit(self, prompt: str, deadline: float, blocking: bool = True):
+        """Start one request once a concurrency slot (and rate token) is available."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        acquired = self.slots.acquire(timeout=remaining) if blocking else self.slots.acquire(blocking=False)
+        if not acquired:
+            return None
+        if self.rate_limiter and not self.rate_limiter.acquire(max(0.0, deadline - time.monotonic())):
+            self.slots.release()
+            return None
+
+        def run():
+            start = time.monotonic()
+            try:
+                response = self.generate_fn(prompt, max(0.1, deadline - start))
+                with self.lock:
+                    self.latencies.append(time.monotonic() - start)
+                return response
+            finally:
+                # The slot is held until the request really finishes, even if the caller gave up
+                self.slots.release()
+
+        return self.executor.submit(run)
+
+    def _attempt(self, prompt: str, deadline: float):
+        """One attempt, possibly hedged. Returns the first successful response or raises."""
+        primary = self._submit(prompt, deadline)
+        if primary is None:
+            raise LLMDeadlineExceeded("Timed out waiting for an LLM request slot")
+        pending = {primary}
+
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None:
+            done, _ = wait(pending, timeout=min(hedge_delay, max(0.0, deadline - time.monotonic())))
+            if not done:
+                # Never wait for a slot for the hedge - it is only worth sending if capacity is free
+                hedge = self._submit(prompt, deadline, blocking=False)
+                if hedge is not None:
+                    self._count('hedges')
+                    pending.add(hedge)
+
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        raise LLMDeadlineExceeded("LLM request exceeded its deadline")
+
+    def generate(self, prompt: str, timeout: float = 40.0):
+        """
+        Generate a response, returning or raising within timeout seconds.
+
+        Raises:
+            LLMDeadlineExceeded: If no response arrived before the deadline (a TimeoutError)
+            Exception: The last error if all attempts failed; transport timeouts are retried like other transient errors
+        """
+        self._count('calls')
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(prompt, deadline)
+            except LLMDeadlineExceeded:
+                self._count('timeouts')
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count('errors')
+                    raise
+                # Full jitter backoff, never sleeping past the deadline
+                sleep_for = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                if time.monotonic() + sleep_for >= deadline:
+                    self._count('errors')
+                    raise
+                attempt += 1
+                self._count('retries')
+                print(f"🔁 Retrying LLM call ({attempt}/{self.max_retries}) after {type(e).__name__}: {e}")
+                time.sleep(sleep_for)
@@ -0,0 +1,423 @@
+"""
+Asyncio load generator driving mixed traffic against a running backend.
+
+Usage (from the backend directory):
+    # Terminal 1: fake Gemini, so no quota is used
+    python -m app.fake_gemini --port 8001 --latency-dist lognormal --latency-ms 800
+    # Terminal 2: the real app pointed at it
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8001 GOOGLE_API_KEY=fake ./start.sh
+    # Terminal 3: the load test
+    python -m app.loadtest run --pdf book.pdf --questions questions.txt --concurrency 16 \
+        --duration 120 --server-pid $(pgrep -f "uvicorn app.main") --out results/build-a.json
+    python -m app.loadtest compare results/build-a.json results/build-b.json
+
+Each worker loops: pick a request type by weight (--mix), send it, record the outcome.
+/ask-stream also records time to first event (TTFE). Server RSS is sampled from
+/proc/<pid>/status every --rss-interval seconds when --server-pid is given.
+
+A few repeated questions are mostly served from the server's caches and single-flight.
+--unique-questions and --vary-uploads make every request do the full work. Either way,
+the saved results report the fraction of requests answered from caches or coalesced.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+OPERATIONS = ("ask", "ask_stream", "upload")
+
+DEFAULT_QUESTIONS = [
+    "What is the main topic of the first chapter?",
+    "Summarize the key definitions introduced in the book.",
+    "Explain the most important formula with an example.",
+    "What are the assumptions behind the main theorem?",
+    "How does the author motivate the second chapter?",
+]
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse "ask=0.6,ask_stream=0.35,upload=0.05" into normalized weights."""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}', expected one of {', '.join(OPERATIONS)}")
+        weights[name] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("The traffic mix needs at least one positive weight")
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process in MiB, or None if it cannot be read."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def unique_question(question: str, number: int) -> str:
+    """A variant of a question that no cache or in-flight request can share."""
+    return f"{question} (load test request {number})"
+
+
+def vary_pdf(pdf_bytes: bytes, number: int) -> bytes:
+    """The same PDF with a trailing comment, so its content hash differs and it is processed again."""
+    return pdf_bytes + f"\n% load test upload {number}\n".encode()
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/max in milliseconds."""
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    arr = np.array(values) * 1000
+    return {
+        'p50': round(float(np.percentile(arr, 50)), 1),
+        'p95': round(float(np.percentile(arr, 95)), 1),
+        'p99': round(float(np.percentile(arr, 99)), 1),
+        'max': round(float(arr.max()), 1),
+    }
+
+
+async def _read_events(response: httpx.Response, start: float, record: dict):
+    """Consume an SSE-style stream, recording time to the first event and the final status."""
+    async for line in response.aiter_lines():
+        if not line.startswith("data: "):
+            continue
+        if 'ttfe' not in record:
+            record['ttfe'] = time.perf_counter() - start
+        event = json.loads(line[len("data: "):])
+        if event.get('status') == 'error':
+            record['error'] = event.get('message', 'error event')
+        elif event.get('status') == 'complete':
+            record['completed'] = True
+            if event.get('cached'):
+                record['cached'] = True
+    if 'error' not in record and not record.get('completed'):
+        record['error'] = "stream ended without a complete event"
+
+
+async def run_operation(client: httpx.AsyncClient, operation: str, question: str, pdf_bytes: Optional[bytes],
+                        pdf_name: str) -> dict:
+    """Send one request and return its outcome."""
+    record = {'op': operation, 'start': time.time()}
+    start = time.perf_counter()
+    try:
+        if operation == "ask":
+            response = await client.post("/ask", json={'question': question, 'history': []})
+            if response.status_code != 200:
+                record['error'] = f"HTTP {response.status_code}"
+        elif operation == "ask_stream":
+            async with client.stream("POST", "/ask-stream", json={'question': question, 'history': []}) as response:
+                if response.status_code != 200:
+                    record['error'] = f"HTTP {response.status_code}"
+                else:
+                    await _read_events(response, start, record)
+        else:
+            files = {'file': (pdf_name, pdf_bytes, 'application/pdf')}
+            async with client.stream("POST", "/upload-stream", files=files) as response:
+                if response.status_code != 200:
+                    record['error'] = f"HTTP {response.status_code}"
+                else:
+                    await _read_events(response, start, record)
+    except httpx.HTTPError as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+    record['latency'] = time.perf_counter() - start
+    record.pop('completed', None)
+    return record
+
+
+async def _worker(client, rng: random.Random, mix: Dict[str, float], questions: List[str], pdf_bytes, pdf_name,
+                  stop_at: float, think_time: float, records: List[dict], counter=None, unique_questions: bool = False,
+                  vary_uploads: bool = False):
+    names, weights = list(mix), list(mix.values())
+    counter = counter or itertools.count(1)
+    while time.time() < stop_at:
+        operation = rng.choices(names, weights)[0]
+        question, upload = rng.choice(questions), pdf_bytes
+        number = next(counter)
+        if unique_questions:
+            question = unique_question(question, number)
+        if vary_uploads and operation == "upload":
+            upload = vary_pdf(pdf_bytes, number)
+        records.append(await run_operation(client, operation, question, upload, pdf_name))
+        if think_time > 0:
+            await asyncio.sleep(rng.expovariate(1 / think_time))
+
+
+async def _sample_rss(pid: int, interval: float, started: float, samples: List[dict], stop: asyncio.Event):
+    while not stop.is_set():
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            samples.append({'t': round(time.time() - started, 2), 'rss_mb': round(rss, 1)})
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def server_counters(client: httpx.AsyncClient) -> Optional[dict]:
+    """Cache and coalescing counters reported by /health, or None if unavailable."""
+    try:
+        response = await client.get("/health")
+        health = response.json()
+    except (httpx.HTTPError, ValueError):
+        return None
+    return {'caches': health.get('caches', {}), 'coalescing': health.get('coalescing', {})}
+
+
+def cache_effects(before: Optional[dict], after: Optional[dict], records: List[dict]) -> dict:
+    """Fractions of the run's work served from caches or shared with an identical in-flight request."""
+    effects = {}
+    streams = [r for r in records if r['op'] == "ask_stream" and 'error' not in r]
+    if streams:
+        effects['ask_stream_cached_fraction'] = round(sum(1 for r in streams if r.get('cached')) / len(streams), 4)
+    if before is None or after is None:
+        return effects
+    for name, stats in after['caches'].items():
+        old = before['caches'].get(name, {})
+        hits = stats.get('hits', 0) - old.get('hits', 0)
+        lookups = hits + stats.get('misses', 0) - old.get('misses', 0)
+        if lookups > 0:
+            effects[f'{name}_cache_hit_rate'] = round(hits / lookups, 4)
+    for name, stats in after['coalescing'].items():
+        old = before['coalescing'].get(name, {})
+        coalesced = stats.get('coalesced', 0) - old.get('coalesced', 0)
+        total = coalesced + stats.get('executions', 0) - old.get('executions', 0)
+        if total > 0:
+            effects[f'{name}_coalesced_fraction'] = round(coalesced / total, 4)
+    return effects
+
+
+def summarize(records: List[dict], duration: float) -> dict:
+    """Throughput, latency percentiles, TTFE and error rate, overall and per operation."""
+    def stats(subset: List[dict]) -> dict:
+        ok = [r for r in subset if 'error' not in r]
+        result = {
+            'requests': len(subset),
+            'errors': len(subset) - len(ok),
+            'error_rate': round((len(subset) - len(ok)) / len(subset), 4) if subset else 0.0,
+            'throughput_rps': round(len(ok) / duration, 3) if duration > 0 else 0.0,
+            'latency_ms': percentiles([r['latency'] for r in ok]),
+        }
+        ttfe = [r['ttfe'] for r in subset if 'ttfe' in r]
+        if ttfe:
+            result['ttfe_ms'] = percentiles(ttfe)
+        return result
+
+    summary = {'overall': stats(records)}
+    for operation in OPERATIONS:
+        subset = [r for r in records if r['op'] == operation]
+        if subset:
+            summary[operation] = stats(subset)
+    errors = {}
+    for r in records:
+        if 'error' in r:
+            errors[r['error']] = errors.get(r['error'], 0) + 1
+    summary['error_messages'] = dict(sorted(errors.items(), key=lambda item: -item[1])[:10])
+    return summary
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_load(args) -> dict:
+    mix = parse_mix(args.mix)
+    if mix.get('upload') and not args.pdf:
+        raise SystemExit("--pdf is required when the mix includes uploads")
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+    pdf_bytes = open(args.pdf, "rb").read() if args.pdf else None
+    pdf_name = os.path.basename(args.pdf) if args.pdf else "loadtest.pdf"
+    rng = random.Random(args.seed)
+    timeout = httpx.Timeout(args.timeout, connect=10.0)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        if args.pdf and not args.skip_initial_upload:
+            # Make sure a document is loaded before the questions start
+            print(f"📤 Uploading {pdf_name} before the run...")
+            record = await run_operation(client, "upload", "", pdf_bytes, pdf_name)
+            if 'error' in record:
+                raise SystemExit(f"Initial upload failed: {record['error']}")
+            print(f"✅ Initial upload took {record['latency']:.1f}s")
+
+        counters_before = await server_counters(client)
+        records: List[dict] = []
+        rss_samples: List[dict] = []
+        started = time.time()
+        stop = asyncio.Event()
+        sampler = None
+        if args.server_pid:
+            sampler = asyncio.create_task(_sample_rss(args.server_pid, args.rss_interval, started, rss_samples, stop))
+        counter = itertools.count(1)
+        print(f"🚀 {args.concurrency} workers for {args.duration}s against {args.base_url} (mix {args.mix})")
+        workers = [
+            _worker(client, random.Random(rng.random()), mix, questions, pdf_bytes, pdf_name,
+                    started + args.duration, args.think_time, records, counter, args.unique_questions,
+                    args.vary_uploads)
+            for _ in range(args.concurrency)
+        ]
+        await asyncio.gather(*workers)
+        duration = time.time() - started
+        stop.set()
+        if sampler is not None:
+            await sampler
+        counters_after = await server_counters(client)
+
+    summary = summarize(records, duration)
+    summary['cache_effects'] = cache_effects(counters_before, counters_after, records)
+    if rss_samples:
+        summary['rss_mb'] = {
+            'start': rss_samples[0]['rss_mb'],
+            'peak': max(s['rss_mb'] for s in rss_samples),
+            'end': rss_samples[-1]['rss_mb'],
+        }
+    return {
+        'label': args.label or _git_commit(),
+        'git_commit': _git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'config': {
+            'base_url': args.base_url, 'concurrency': args.concurrency, 'duration': args.duration,
+            'mix': mix, 'think_time': args.think_time, 'seed': args.seed, 'pdf': pdf_name if args.pdf else None,
+            'questions': len(questions), 'unique_questions': args.unique_questions,
+            'vary_uploads': args.vary_uploads,
+        },
+        'duration_seconds': round(duration, 2),
+        'summary': summary,
+        'rss_timeline': rss_samples,
+        'requests': records if args.keep_requests else [],
+    }
+
+
+def print_summary(result: dict):
+    summary = result['summary']
+    print(f"\n📊 {result['label'] or 'run'}: {summary['overall']['requests']} requests in {result['duration_seconds']}s")
+    for name in ("overall",) + OPERATIONS:
+        if name not in summary:
+            continue
+        s = summary[name]
+        line = (f"   {name:<10} {s['throughput_rps']:>7.2f} req/s  errors {s['error_rate']:.1%}  "
+                f"p50 {s['latency_ms']['p50']} / p95 {s['latency_ms']['p95']} / p99 {s['latency_ms']['p99']} ms")
+        if 'ttfe_ms' in s:
+            line += f"  TTFE p50 {s['ttfe_ms']['p50']} / p95 {s['ttfe_ms']['p95']} ms"
+        print(line)
+    effects = summary.get('cache_effects')
+    if effects:
+        print("   served from caches / coalesced: " + ", ".join(f"{key} {value:.1%}" for key, value in effects.items()))
+        if not result['config'].get('unique_questions'):
+            print("   ℹ️ Latencies include cache hits; use --unique-questions to measure the full pipeline")
+    if 'rss_mb' in summary:
+        rss = summary['rss_mb']
+        print(f"   RSS: start {rss['start']} MiB, peak {rss['peak']} MiB, end {rss['end']} MiB")
+    for message, count in summary['error_messages'].items():
+        print(f"   ❌ {count} x {message}")
+
+
+def _flatten(summary: dict) -> Dict[str, float]:
+    """Comparable metrics as "operation.metric" -> value."""
+    metrics = {}
+    for name in ("overall",) + OPERATIONS:
+        s = summary.get(name)
+        if not s:
+            continue
+        metrics[f"{name}.throughput_rps"] = s['throughput_rps']
+        metrics[f"{name}.error_rate"] = s['error_rate']
+        for key in ('latency_ms', 'ttfe_ms'):
+            for p, value in s.get(key, {}).items():
+                if value is not None:
+                    metrics[f"{name}.{key}.{p}"] = value
+    for key, value in summary.get('rss_mb', {}).items():
+        metrics[f"rss_mb.{key}"] = value
+    for key, value in summary.get('cache_effects', {}).items():
+        metrics[f"cache.{key}"] = value
+    return metrics
+
+
+def compare(baseline_path: str, candidate_path: str):
+    """Print every metric of two saved runs side by side with the relative change."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    base_metrics, cand_metrics = _flatten(baseline['summary']), _flatten(candidate['summary'])
+    print(f"📊 {baseline.get('label') or baseline_path} -> {candidate.get('label') or candidate_path}")
+    if baseline['config'] != candidate['config']:
+        print("⚠️ The runs used different configurations; differences may not come from the build")
+    for key in sorted(set(base_metrics) | set(cand_metrics)):
+        before, after = base_metrics.get(key), cand_metrics.get(key)
+        change = ""
+        if before not in (None, 0) and after is not None:
+            change = f"{(after - before) / before:+.1%}"
+        print(f"   {key:<32} {str(before):>10} -> {str(after):>10}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the backend with mixed traffic")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Drive traffic against a running server and save the results")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="Concurrent workers (closed loop)")
+    run_parser.add_argument("--duration", type=float, default=60, help="Seconds to generate load for")
+    run_parser.add_argument("--mix", default="ask=0.6,ask_stream=0.35,upload=0.05",
+                            help="Weights of the request types (ask, ask_stream, upload)")
+    run_parser.add_argument("--questions", help="Text file with one question per line")
+    run_parser.add_argument("--pdf", help="PDF uploaded before the run and by upload requests")
+    run_parser.add_argument("--skip-initial-upload", action="store_true",
+                            help="Do not upload --pdf before the run (a document is already loaded)")
+    run_parser.add_argument("--unique-questions", action="store_true",
+                            help="Make every question unique, so no cache or single-flight can serve it")
+    run_parser.add_argument("--vary-uploads", action="store_true",
+                            help="Change every uploaded copy of --pdf, so each upload is processed in full "
+                                 "(each one adds an artifact directory in a library setup)")
+    run_parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause in seconds between requests")
+    run_parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    run_parser.add_argument("--server-pid", type=int, help="Backend process to sample RSS from")
+    run_parser.add_argument("--rss-interval", type=float, default=1.0, help="Seconds between RSS samples")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--label", help="Name of this run in reports (default: git commit)")
+    run_parser.add_argument("--keep-requests", action="store_true", help="Save every request record")
+    run_parser.add_argument("--out", help="Write the results to this JSON file")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        compare(args.baseline, args.candidate)
+        return
+
+    result = asyncio.run(run_load(args))
+    print_summary(result)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
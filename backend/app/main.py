@@ -1,15 +1,21 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import os
-from typing import List
+from typing import List, Optional
 import json
 import asyncio
 import traceback
 import logging
 import threading
+import secrets
 from .rag import RAGEngine
+from .singleflight import SingleFlight, StreamFlight, question_key
+from .profiling import CaptureRegistry, ProfileSession, current_session
+from .latex_normalize import FORMAT_VERSION
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -39,6 +45,58 @@ app.add_middleware(
 # Initialize RAG engine
 rag_engine = RAGEngine()
 
+# Re-ask yesterday's popular questions in the background so the first users hit warm caches
+if os.getenv("RAG_PREWARM", "true").lower() == "true":
+    rag_engine.enable_prewarm()
+
+@app.on_event("shutdown")
+def save_query_log():
+    """Persist questions logged since the last periodic save."""
+    rag_engine.save_query_log()
+
+# Identical questions arriving together share one pipeline run
+ask_flights = SingleFlight()
+stream_flights = StreamFlight()
+
+# Admin-only profiling; disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+profile_captures = CaptureRegistry(max_finished=int(os.getenv("PROFILE_KEEP_CAPTURES", "20")))
+
+def flight_key(question: "Question") -> str:
+    """
+    Key under which concurrent identical questions share one pipeline run.
+
+    Follow-ups also key on conversation_id, since each conversation reuses and stores its
+    own warm candidate pool. First turns still coalesce across conversations; only the
+    leader's conversation then gets a warm pool stored for its follow-ups.
+    """
+    extra = sorted(question.documents or [])
+    if question.history and question.conversation_id:
+        extra.append(f"conversation={question.conversation_id}")
+    return question_key(rag_engine.document_id(), question.question, question.history, *extra)
+
+def require_admin(token: Optional[str]):
+    """Reject the request unless it carries the admin token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+async def run_engine(fn, *args, **kwargs):
+    """Run a blocking engine call in the threadpool, profiled if the request is being profiled."""
+    session = current_session.get()
+    # Live calls make background prewarming back off
+    def live():
+        with rag_engine.live_request():
+            return fn(*args, **kwargs)
+    if session is None:
+        return await run_in_threadpool(live)
+    # Attach the worker thread to the session so the sampler follows the request
+    def attached():
+        with session.attach():
+            return live()
+    return await run_in_threadpool(attached)
+
 class Message(BaseModel):
     role: str  # 'user' or 'assistant'
     content: str
@@ -46,6 +104,10 @@ class Message(BaseModel):
 class Question(BaseModel):
     question: str
     history: List[Message] = []
+    # Multi-book mode: restrict the search to these documents (content hashes or file names)
+    documents: Optional[List[str]] = None
+    # Follow-ups in the same conversation may reuse the previous turn's retrieval candidates
+    conversation_id: Optional[str] = None
 
 @app.get("/health")
 async def health_check():
@@ -62,6 +124,36 @@ async def health_check():
         # Check if uploads directory exists
         health_status["uploads_dir_exists"] = os.path.exists("uploads")
         
+        # How many identical in-flight questions were coalesced
+        health_status["coalescing"] = {
+            "ask": {"executions": ask_flights.leaders, "coalesced": ask_flights.coalesced},
+            "ask_stream": {"executions": stream_flights.leaders, "coalesced": stream_flights.coalesced},
+        }
+        
+        # Cache occupancy and hit rates, and progress of background prewarming
+        health_status["caches"] = {
+            "embedding": rag_engine.embedding_cache.stats(),
+            "retrieval": rag_engine.retrieval_cache.stats(),
+            "answer": rag_engine.answer_cache.stats(),
+        }
+        if rag_engine.prewarmer is not None:
+            health_status["prewarm"] = rag_engine.prewarmer.stats()
+        
+        # Follow-up questions served from a conversation's warm candidate pool
+        if rag_engine.conversation_pools is not None:
+            health_status["conversation_pools"] = rag_engine.conversation_pools.stats()
+        
+        # LLM client counters and latency percentiles
+        if rag_engine.llm:
+            health_status["llm"] = rag_engine.llm.stats()
+        
+        # Report which pre-built artifacts are loaded
+        if rag_engine.manifest:
+            health_status["active_document"] = rag_engine.manifest.get("document")
+            health_status["active_content_hash"] = rag_engine.manifest.get("content_hash")
+        if rag_engine.shard_set is not None:
+            health_status["documents"] = rag_engine.shard_set.names()
+        
         return health_status
     except Exception as e:
         logger.error(f"Health check failed: {e}")
@@ -219,7 +311,8 @@ async def upload_pdf_stream(file: UploadFile = File(...)):
     )
 
 @app.post("/ask")
-async def ask_question(question: Question):
+async def ask_question(question: Question, x_profile: Optional[str] = Header(None),
+                       x_admin_token: Optional[str] = Header(None)):
     """Ask a question and get an answer with citations."""
     print(f"Received question: {question.question}")  # Debug log
     
@@ -229,11 +322,42 @@ async def ask_question(question: Question):
             detail="Question cannot be empty"
         )
     
-    try:
-        answer = rag_engine.answer_question(question.question, history=question.history)
+    # Recording may rewrite the log file, so keep it off the event loop
+    await run_in_threadpool(rag_engine.record_query, question.question, question.history, question.documents)
+    
+    async def run_pipeline():
+        # The whole request shares one time budget; stages degrade when it runs low
+        deadline = rag_engine.new_deadline()
+        answer = await run_engine(rag_engine.answer_question, question.question, history=question.history, deadline=deadline,
+                                  documents=question.documents, conversation_id=question.conversation_id)
         return {
-            "answer": answer
+            "answer": answer,
+            # Answers are pre-normalized markdown/LaTeX; clients knowing this version skip their own preprocessing
+            "format_version": FORMAT_VERSION,
+            "deadline": deadline.to_dict()
         }
+    
+    # X-Profile: sample (or cprofile) returns a profile of this execution alone
+    request_session = None
+    if x_profile:
+        require_admin(x_admin_token)
+        mode = "cprofile" if x_profile.lower() == "cprofile" else "sample"
+        request_session = ProfileSession(mode=mode).start()
+    capture = None if request_session else profile_captures.claim("/ask")
+    session = request_session or (capture['session'] if capture else None)
+    
+    try:
+        if session is not None:
+            # A profiled request runs on its own rather than joining someone else's execution
+            current_session.set(session)
+            result = await run_pipeline()
+            if request_session is not None:
+                request_session.stop()
+                result["profile"] = request_session.summary()
+            return result
+        # Concurrent identical questions (same document, question and history) attach to one execution
+        key = flight_key(question)
+        return await ask_flights.do(key, run_pipeline)
     except ValueError as e:
         # Handle specific error for when no PDF is processed
         print(f"ValueError: {str(e)}")  # Debug log
@@ -249,6 +373,11 @@ async def ask_question(question: Question):
             status_code=500,
             detail=error_msg
         )
+    finally:
+        if request_session is not None and request_session.finished is None:
+            request_session.stop()
+        if capture is not None:
+            profile_captures.release(capture)
 
 @app.post("/ask-stream")
 async def ask_question_stream(question: Question):
@@ -261,8 +390,34 @@ async def ask_question_stream(question: Question):
             detail="Question cannot be empty"
         )
 
+    # Recording may rewrite the log file, so keep it off the event loop
+    await run_in_threadpool(rag_engine.record_query, question.question, question.history, question.documents)
+    capture = profile_captures.claim("/ask-stream")
+    release_lock = threading.Lock()
+    released = []
+
+    def release_capture():
+        """Release the profile capture exactly once, whichever path gets here first."""
+        with release_lock:
+            if capture is None or released:
+                return
+            released.append(True)
+        profile_captures.release(capture)
+    
     async def generate_progress():
+        # The whole request shares one time budget; stages degrade when it runs low
+        deadline = rag_engine.new_deadline()
+        if capture is not None:
+            current_session.set(capture['session'])
         try:
+            rag_engine._check_documents(question.documents)
+            
+            # Popular first-turn questions are answered straight from the answer cache
+            cached = rag_engine.cached_answer(question.question, question.history, question.documents)
+            if cached is not None:
+                yield f"data: {json.dumps({'status': 'complete', 'answer': cached, 'format_version': FORMAT_VERSION, 'cached': True, 'deadline': deadline.to_dict()})}\n\n"
+                return
+            
             # Step 1: Processing question
             progress_data = {
                 'status': 'processing_question', 
@@ -278,7 +433,7 @@ async def ask_question_stream(question: Question):
             }
             yield f"data: {json.dumps(progress_data)}\n\n"
             await asyncio.sleep(0.2)  # Allow UI to update
-            refined_question = rag_engine._refine_question(question.question, question.history or [])
+            refined_question, query_vector = await run_engine(rag_engine._refine_query, question.question, question.history or [], deadline=deadline, documents=question.documents)
             
             # Step 3: Retrieving chunks
             progress_data = {
@@ -287,7 +442,7 @@ async def ask_question_stream(question: Question):
             }
             yield f"data: {json.dumps(progress_data)}\n\n"
             await asyncio.sleep(0.2)  # Allow UI to update
-            contexts, window_indices, pages_used = rag_engine._get_contexts(refined_question, k=20, window_size=5)
+            contexts, window_indices, pages_used = await run_engine(rag_engine._get_contexts, refined_question, k=20, window_size=5, deadline=deadline, query_vector=query_vector, documents=question.documents, trace=rag_engine._start_trace(question.question, question.documents), conversation_id=question.conversation_id)
             
             # Step 4: Processing chunks
             progress_data = {
@@ -304,12 +459,15 @@ async def ask_question_stream(question: Question):
             }
             yield f"data: {json.dumps(progress_data)}\n\n"
             await asyncio.sleep(0.2)  # Allow UI to update
-            answer = rag_engine._generate_answer(question.question, refined_question, contexts, question.history or [], pages_used)
+            answer = await run_engine(rag_engine._generate_answer, question.question, refined_question, contexts, question.history or [], pages_used, deadline=deadline)
+            rag_engine.store_answer(question.question, question.history, question.documents, answer, deadline)
             
             # Step 6: Complete
             final_data = {
                 'status': 'complete', 
-                'answer': answer
+                'answer': answer,
+                'format_version': FORMAT_VERSION,
+                'deadline': deadline.to_dict()
             }
             yield f"data: {json.dumps(final_data)}\n\n"
             
@@ -329,15 +487,88 @@ async def ask_question_stream(question: Question):
                 'message': error_msg
             }
             yield f"data: {json.dumps(error_data)}\n\n"
+        finally:
+            release_capture()
 
-    return StreamingResponse(
-        generate_progress(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-            "Access-Control-Allow-Headers": "*",
-        }
-    )
\ No newline at end of file
+    if capture is None:
+        # Concurrent identical questions subscribe to one running pipeline and receive every event
+        key = flight_key(question)
+        events = stream_flights.subscribe(key, generate_progress)
+        background = None
+    else:
+        # A profiled request runs on its own rather than joining someone else's stream. The capture
+        # is also released by a background task, since the generator's finally never runs when
+        # the stream is not iterated
+        events = generate_progress()
+        background = BackgroundTask(release_capture)
+    try:
+        return StreamingResponse(
+            events,
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
+                "Access-Control-Allow-Headers": "*",
+            },
+            background=background,
+        )
+    except Exception:
+        release_capture()
+        raise
+
+@app.post("/admin/profile")
+async def start_profile(seconds: Optional[float] = None, requests: Optional[int] = None,
+                        route: Optional[str] = None, mode: str = "sample", interval_ms: float = 5.0,
+                        x_admin_token: Optional[str] = Header(None)):
+    """
+    Arm a profile capture: for a time window (seconds) or the next N requests (requests).
+
+    With route set, only requests to that route (/ask or /ask-stream) are profiled.
+    Fetch the result from GET /admin/profile/{id} once it completes.
+    """
+    require_admin(x_admin_token)
+    if seconds is not None and not 0 < seconds <= 300:
+        raise HTTPException(status_code=400, detail="seconds must be between 0 and 300")
+    if requests is not None and not 0 < requests <= 1000:
+        raise HTTPException(status_code=400, detail="requests must be between 1 and 1000")
+    try:
+        capture = profile_captures.arm(route=route, count=requests, seconds=seconds,
+                                       mode=mode, interval=interval_ms / 1000)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"🔬 Profile capture {capture['id']} armed ({mode}, "
+          f"{f'{seconds}s' if seconds is not None else f'{requests} requests'}, route={route or 'any'})")
+    return profile_captures.status(capture)
+
+@app.get("/admin/profile/{capture_id}")
+async def get_profile(capture_id: int, format: str = "json", x_admin_token: Optional[str] = Header(None)):
+    """
+    Result of a profile capture.
+
+    format=json: category totals plus collapsed stacks (or pstats text for cProfile)
+    format=collapsed: collapsed stacks file for flamegraph.pl / speedscope (sampling mode)
+    format=prof: binary .prof file for snakeviz / flameprof (cProfile mode)
+    """
+    require_admin(x_admin_token)
+    capture = profile_captures.get(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Unknown profile capture")
+    status = profile_captures.status(capture)
+    if not status["complete"]:
+        return JSONResponse(status_code=202, content=status)
+
+    session = capture['session']
+    if format == "collapsed":
+        if session.mode != "sample":
+            raise HTTPException(status_code=400, detail="Collapsed stacks need a sampling capture")
+        return PlainTextResponse(session.collapsed(), headers={
+            "Content-Disposition": f'attachment; filename="profile-{capture_id}.folded"'})
+    if format == "prof":
+        if session.mode != "cprofile":
+            raise HTTPException(status_code=400, detail="A .prof file needs a cprofile capture")
+        return Response(session.pstats_dump(), media_type="application/octet-stream", headers={
+            "Content-Disposition": f'attachment; filename="profile-{capture_id}.prof"'})
+    status["profile"] = session.summary()
+    return status
@@ -0,0 +1,79 @@
+import faiss
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+class PageIndex:
+    """Page-level centroid vectors with a page -> chunk id mapping for coarse-to-fine search."""
+
+    def __init__(self, pages: np.ndarray, centroids: np.ndarray, offsets: np.ndarray, chunk_ids: np.ndarray):
+        self.pages = pages          # page number for each centroid row
+        self.centroids = centroids  # normalized centroid per page, shape (n_pages, d)
+        self.offsets = offsets      # CSR offsets into chunk_ids, shape (n_pages + 1,)
+        self.chunk_ids = chunk_ids  # chunk ids grouped by page
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, chunks: List[Dict]) -> "PageIndex":
+        """Average the (normalized) vectors of every chunk touching a page into one centroid per page."""
+        page_to_chunks = {}
+        for chunk_id, chunk_data in enumerate(chunks):
+            pages = chunk_data.get('pages', []) if isinstance(chunk_data, dict) else []
+            for page in pages:
+                page_to_chunks.setdefault(page, []).append(chunk_id)
+
+        pages = np.array(sorted(page_to_chunks), dtype='int32')
+        centroids = np.zeros((len(pages), embeddings.shape[1]), dtype='float32')
+        offsets = np.zeros(len(pages) + 1, dtype='int64')
+        chunk_ids = []
+        for row, page in enumerate(pages):
+            ids = page_to_chunks[int(page)]
+            centroids[row] = np.asarray(embeddings[ids], dtype='float32').mean(axis=0)
+            chunk_ids.extend(ids)
+            offsets[row + 1] = len(chunk_ids)
+        if len(centroids):
+            faiss.normalize_L2(centroids)
+        return cls(pages, centroids, offsets, np.array(chunk_ids, dtype='int64'))
+
+    @classmethod
+    def load(cls, path: str) -> "PageIndex":
+        data = np.load(path)
+        return cls(data['pages'], data['centroids'], data['offsets'], data['chunk_ids'])
+
+    def save(self, path: str):
+        np.savez(path, pages=self.pages, centroids=self.centroids, offsets=self.offsets, chunk_ids=self.chunk_ids)
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def candidate_chunks(self, query: np.ndarray, num_pages: int) -> np.ndarray:
+        """Coarse search: pick the closest pages and return the sorted ids of the chunks on them."""
+        num_pages = min(num_pages, len(self.pages))
+        similarities = self.centroids @ np.asarray(query, dtype='float32').reshape(-1)
+        top_rows = np.argpartition(-similarities, num_pages - 1)[:num_pages]
+        ids = np.concatenate([self.chunk_ids[self.offsets[row]:self.offsets[row + 1]] for row in top_rows])
+        return np.unique(ids)
+
+
+def fine_search(index: faiss.Index, query: np.ndarray, candidate_ids: np.ndarray, k: int,
+                full_vectors: Optional[np.ndarray] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Fine search restricted to candidate chunk ids.
+
+    Distances are computed only over the candidate rows, so the cost is proportional
+    to the number of candidates: from the full-precision vectors when available,
+    otherwise from vectors reconstructed out of the index. Returns None when the
+    index cannot reconstruct vectors, so the caller falls back to a plain search.
+    """
+    query = np.ascontiguousarray(query, dtype='float32').reshape(1, -1)
+    k = min(k, len(candidate_ids))
+    if full_vectors is not None:
+        vectors = np.asarray(full_vectors[candidate_ids], dtype='float32')
+    else:
+        try:
+            vectors = index.reconstruct_batch(np.ascontiguousarray(candidate_ids, dtype='int64'))
+        except RuntimeError:
+            return None
+    exact = ((vectors - query) ** 2).sum(axis=1)
+    order = np.argpartition(exact, k - 1)[:k]
+    order = order[np.argsort(exact[order])]
+    return exact[order].reshape(1, -1), candidate_ids[order].reshape(1, -1)
@@ -0,0 +1,75 @@
+from functools import lru_cache
+
+import numpy as np
+from typing import List, Optional, Tuple
+
+
+class PassageStore:
+    """Token ids for every chunk, stored as one flat array plus offsets."""
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, tokenizer_name: str = ""):
+        self.ids = ids
+        self.offsets = offsets
+        self.tokenizer_name = tokenizer_name
+
+    @classmethod
+    def build(cls, tokenizer, texts: List[str]) -> "PassageStore":
+        """Tokenize all chunk texts in a single batched pass (no special tokens)."""
+        encoded = tokenizer(texts, add_special_tokens=False, truncation=False)['input_ids'] if texts else []
+        lengths = np.array([len(ids) for ids in encoded], dtype='int64')
+        offsets = np.zeros(len(encoded) + 1, dtype='int64')
+        np.cumsum(lengths, out=offsets[1:])
+        ids = np.fromiter((token for ids in encoded for token in ids), dtype='int32', count=int(offsets[-1]))
+        return cls(ids, offsets, getattr(tokenizer, 'name_or_path', ''))
+
+    @classmethod
+    def load(cls, path: str) -> "PassageStore":
+        data = np.load(path)
+        return cls(data['ids'], data['offsets'], str(data['tokenizer_name']))
+
+    def save(self, path: str):
+        np.savez(path, ids=self.ids, offsets=self.offsets, tokenizer_name=np.array(self.tokenizer_name))
+
+    def matches(self, tokenizer, num_chunks: int) -> bool:
+        """True if the ids were produced by this tokenizer for exactly num_chunks chunks."""
+        name = getattr(tokenizer, 'name_or_path', '')
+        return len(self) == num_chunks and bool(name) and self.tokenizer_name == name
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self.ids[self.offsets[idx]:self.offsets[idx + 1]]
+
+
+@lru_cache(maxsize=8)
+def pair_template(tokenizer) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Derive the special tokens a tokenizer places before, between and after a text pair.
+
+    e.g. XLM-RoBERTa: <s> query </s></s> passage </s>
+
+    Computed once per tokenizer; the returned lists are shared, so callers must not modify them.
+    """
+    first = tokenizer.encode("a", add_special_tokens=False)
+    second = tokenizer.encode("b", add_special_tokens=False)
+    full = tokenizer("a", "b")['input_ids']
+    i = next(pos for pos in range(len(full)) if full[pos:pos + len(first)] == first)
+    j = next(pos for pos in range(i + len(first), len(full)) if full[pos:pos + len(second)] == second)
+    return full[:i], full[i + len(first):j], full[j + len(second):]
+
+
+def build_pair_inputs(tokenizer, query_ids: List[int], passages: List[np.ndarray], max_length: int = 512,
+                      max_query_tokens: Optional[int] = None) -> List[List[int]]:
+    """
+    Assemble cross-encoder inputs (query + passage with special tokens) directly from token ids.
+
+    Passages are truncated to exactly the tokens left after the query and special tokens.
+    """
+    prefix, middle, suffix = pair_template(tokenizer)
+    num_special = len(prefix) + len(middle) + len(suffix)
+    max_query_tokens = max_query_tokens or (max_length - num_special) // 2
+    query_ids = list(query_ids[:max_query_tokens])
+    passage_budget = max_length - num_special - len(query_ids)
+    head = prefix + query_ids + middle
+    return [head + passage[:passage_budget].tolist() + suffix for passage in passages]
@@ -0,0 +1,237 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Hashable, List
+
+from .singleflight import normalize_question
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss counters."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: Hashable, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'entries': len(self.entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
+
+
+class QueryLog:
+    """
+    Bounded per-document log of frequently asked first-turn questions, persisted as JSON.
+
+    Each document keeps at most max_questions entries; when full, the least asked (then least
+    recently asked) question is dropped. record() rewrites the file at most every save_interval
+    seconds and blocks on disk while doing so, so call it off the event loop; call save() on
+    shutdown to keep the questions recorded since.
+    """
+
+    def __init__(self, path: str, max_questions: int = 500, max_documents: int = 100, save_interval: float = 30.0):
+        self.path = path
+        self.max_questions = max_questions
+        self.max_documents = max_documents
+        self.save_interval = save_interval
+        self.documents: Dict[str, Dict[str, Dict]] = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_save = 0.0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.documents = json.load(f)
+            print(f"📒 Loaded query log with {sum(len(q) for q in self.documents.values())} questions from {self.path}")
+        except Exception as e:
+            print(f"⚠️ Warning: Could not read query log {self.path}: {str(e)}")
+            self.documents = {}
+
+    def record(self, document_id: str, question: str):
+        now = time.time()
+        key = normalize_question(question)
+        if not key:
+            return
+        with self.lock:
+            questions = self.documents.setdefault(document_id, {})
+            entry = questions.get(key)
+            if entry is None:
+                if len(questions) >= self.max_questions:
+                    evict = min(questions, key=lambda q: (questions[q]['count'], questions[q]['last']))
+                    del questions[evict]
+                entry = questions[key] = {'question': question, 'count': 0}
+            entry['count'] += 1
+            entry['last'] = now
+            if len(self.documents) > self.max_documents:
+                # Forget the document asked about least recently
+                stale = min(self.documents, key=lambda d: max((q['last'] for q in self.documents[d].values()), default=0))
+                del self.documents[stale]
+            self.dirty = True
+            due = now - self.last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def top(self, document_id: str, n: int) -> List[str]:
+        """The n most frequently asked questions for a document."""
+        with self.lock:
+            entries = list(self.documents.get(document_id, {}).values())
+        entries.sort(key=lambda e: (e['count'], e['last']), reverse=True)
+        return [e['question'] for e in entries[:n]]
+
+    def save(self):
+        """Write the log atomically (temp file, then rename)."""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.documents)
+            self.dirty = False
+            self.last_save = time.time()
+        tmp_path = None
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            # A private temp file per save, so concurrent workers never write into each other's file
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".query_log.", suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"⚠️ Warning: Could not save query log {self.path}: {str(e)}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class Prewarmer:
+    """
+    Re-asks a document's most frequent questions on a background thread to refill caches.
+
+    Only runs while no live request has been served for idle_seconds, sleeping interval
+    seconds between questions; that idle wait is what keeps it out of the way of live traffic.
+    The worker thread is also niced, but torch/OpenMP threads it hands work to are not. Starting it again (for
+    example after an index swap) cancels a run that is still in progress.
+    """
+
+    def __init__(self, warm_fn, query_log: QueryLog, top_n: int = 50, interval: float = 1.0, idle_seconds: float = 2.0):
+        self.warm_fn = warm_fn
+        self.query_log = query_log
+        self.top_n = top_n
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.live = 0
+        self.last_live = 0.0
+        self.progress = {'status': 'idle'}
+
+    @contextmanager
+    def live_request(self):
+        """Mark live traffic; the prewarm worker waits until it has been quiet for a while."""
+        with self.lock:
+            self.live += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.live -= 1
+                self.last_live = time.time()
+
+    def start(self, document_id: str, warmup_fn=None):
+        """Cancel any running prewarm and start one for this document."""
+        questions = self.query_log.top(document_id, self.top_n)
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.progress = {'status': 'waiting', 'document_id': document_id, 'total': len(questions), 'done': 0,
+                             'failed': 0, 'started': time.time(), 'finished': None}
+        thread = threading.Thread(target=self._run, args=(generation, questions, warmup_fn), name="prewarm", daemon=True)
+        thread.start()
+
+    def _update(self, generation: int, **fields):
+        with self.lock:
+            if generation == self.generation:
+                self.progress.update(fields)
+
+    def _cancelled(self, generation: int) -> bool:
+        return generation != self.generation
+
+    def _wait_for_idle(self, generation: int) -> bool:
+        """Block while live requests run or ran recently; False if this run was cancelled meanwhile."""
+        while not self._cancelled(generation):
+            with self.lock:
+                quiet = self.live == 0 and time.time() - self.last_live >= self.idle_seconds
+            if quiet:
+                return True
+            time.sleep(0.2)
+        return False
+
+    def _run(self, generation: int, questions: List[str], warmup_fn=None):
+        try:
+            # Lower this thread's own priority (Linux: niceness is per thread; pool threads keep theirs)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        if warmup_fn is not None and self._wait_for_idle(generation):
+            try:
+                warmup_fn()
+            except Exception as e:
+                print(f"⚠️ Warning: Model warm-up failed: {str(e)}")
+        if questions:
+            print(f"🔥 Prewarming caches with {len(questions)} frequent questions")
+        done = failed = 0
+        for question in questions:
+            if not self._wait_for_idle(generation):
+                print(f"⏹️ Prewarm cancelled after {done}/{len(questions)} questions")
+                return
+            self._update(generation, status='running', current=question[:80])
+            try:
+                self.warm_fn(question)
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"⚠️ Warning: Prewarm failed for '{question[:60]}': {str(e)}")
+            self._update(generation, done=done, failed=failed)
+            if (done + failed) % 10 == 0:
+                print(f"🔥 Prewarmed {done + failed}/{len(questions)} questions")
+            time.sleep(self.interval)
+        self._update(generation, status='complete', current=None, finished=time.time())
+        if questions:
+            print(f"✅ Prewarm complete: {done} questions warmed, {failed} failed")
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return dict(self.progress)
@@ -0,0 +1,252 @@
+import cProfile
+import io
+import itertools
+import marshal
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# Where sampled time went, checked leaf-most frame first.
+# Native code (tokenizers, FAISS, torch) keeps its Python caller on the stack, so matching
+# on the calling modules attributes time spent inside the extension as well.
+CATEGORIES = [
+    ('tokenizer', ('transformers.tokenization', 'tokenizers')),
+    ('faiss_search', ('faiss', 'app.vector_store', 'app.page_index', 'app.shards')),
+    ('reranker_forward', ('app.rag:_score_pretokenized', 'FlagEmbedding')),
+    ('embedder', ('sentence_transformers',)),
+    ('llm_wait', ('app.llm_client', 'google.generativeai')),
+]
+
+# Profile session of the request being handled
+current_session: ContextVar[Optional["ProfileSession"]] = ContextVar("current_profile_session", default=None)
+
+
+def _frame_label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def _stack(frame) -> tuple:
+    """Labels from the outermost frame to the innermost."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+
+def _category(stack: tuple) -> str:
+    for label in reversed(stack):
+        for name, prefixes in CATEGORIES:
+            if label.startswith(prefixes):
+                return name
+    return 'other'
+
+
+class ProfileSession:
+    """
+    Low-overhead sampling (or cProfile) capture.
+
+    Sampling mode records the stacks of attached threads (or every thread) every
+    interval; results are returned as collapsed stacks ("a;b;c count" lines), the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, mode: str = "sample", interval: float = 0.005, all_threads: bool = False):
+        if mode not in ("sample", "cprofile"):
+            raise ValueError("mode must be 'sample' or 'cprofile'")
+        self.mode = mode
+        self.interval = interval
+        self.all_threads = all_threads
+        self.stacks = Counter()
+        self.threads = set()
+        self.stats = None
+        self.lock = threading.Lock()
+        self.started = None
+        self.finished = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self.started = time.time()
+        if self.mode == "sample":
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.finished = time.time()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                targets = [tid for tid in frames if tid != own_id] if self.all_threads else list(self.threads)
+                for tid in targets:
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        self.stacks[_stack(frame)] += 1
+
+    @contextmanager
+    def attach(self):
+        """Profile the calling thread for the duration of the block."""
+        if self.mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                with self.lock:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profiler)
+                    else:
+                        self.stats.add(profiler)
+            return
+        tid = threading.get_ident()
+        with self.lock:
+            self.threads.add(tid)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.threads.discard(tid)
+
+    def collapsed(self) -> str:
+        """Collapsed stacks, one "frame;frame;frame count" line per unique stack."""
+        with self.lock:
+            return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def pstats_dump(self) -> bytes:
+        """cProfile results in the .prof format read by snakeviz, flameprof and pstats."""
+        with self.lock:
+            return marshal.dumps(self.stats.stats if self.stats is not None else {})
+
+    def summary(self) -> Dict:
+        """Per-category time (samples x interval) plus the raw capture."""
+        result = {'mode': self.mode}
+        if self.mode == "cprofile":
+            buffer = io.StringIO()
+            if self.stats is not None:
+                self.stats.stream = buffer
+                self.stats.sort_stats("cumulative").print_stats(40)
+            result['pstats'] = buffer.getvalue()
+            return result
+        with self.lock:
+            totals = Counter()
+            for stack, count in self.stacks.items():
+                totals[_category(stack)] += count
+            samples = sum(self.stacks.values())
+        result.update({
+            'samples': samples,
+            'interval_ms': self.interval * 1000,
+            'categories_ms': {name: round(count * self.interval * 1000, 1) for name, count in totals.most_common()},
+            'collapsed': self.collapsed(),
+        })
+        return result
+
+
+class CaptureRegistry:
+    """
+    Armed captures: a time window or the next N requests, optionally limited to one route.
+
+    A window capture in sampling mode with no route samples every thread in the process;
+    the others profile only the worker threads of the requests they claim. Only the
+    max_finished most recent finished captures (and their profiles) are kept.
+    """
+
+    def __init__(self, max_finished: int = 20):
+        self.max_finished = max_finished
+        self.captures: Dict[int, dict] = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def arm(self, route: Optional[str] = None, count: Optional[int] = None, seconds: Optional[float] = None,
+            mode: str = "sample", interval: float = 0.005) -> dict:
+        if (count is None) == (seconds is None):
+            raise ValueError("Give exactly one of count or seconds")
+        session = ProfileSession(mode=mode, interval=interval,
+                                 all_threads=seconds is not None and route is None and mode == "sample")
+        capture = {
+            'id': next(self.ids),
+            'route': route,
+            'mode': mode,
+            'requested': count,
+            'remaining': count,
+            'seconds': seconds,
+            'ends_at': time.time() + seconds if seconds is not None else None,
+            'active': 0,
+            'captured_requests': 0,
+            'session': session.start(),
+        }
+        with self.lock:
+            self.captures[capture['id']] = capture
+            self._evict()
+        if seconds is not None:
+            timer = threading.Timer(seconds, self._finish_if_done, args=(capture,))
+            timer.daemon = True
+            timer.start()
+        return capture
+
+    def _evict(self):
+        """Drop the oldest finished captures beyond max_finished (call with the lock held)."""
+        finished = [capture_id for capture_id, capture in self.captures.items()
+                    if capture['session'].finished is not None]
+        for capture_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.captures[capture_id]
+
+    def _accepting(self, capture: dict) -> bool:
+        if capture['ends_at'] is not None:
+            return time.time() < capture['ends_at']
+        return capture['remaining'] > 0
+
+    def _complete(self, capture: dict) -> bool:
+        return not self._accepting(capture) and capture['active'] == 0
+
+    def claim(self, route: str) -> Optional[dict]:
+        """Take a request into an armed capture matching the route, if any."""
+        with self.lock:
+            for capture in self.captures.values():
+                if capture['session'].all_threads or capture['route'] not in (None, route):
+                    continue
+                if self._accepting(capture):
+                    if capture['remaining'] is not None:
+                        capture['remaining'] -= 1
+                    capture['active'] += 1
+                    capture['captured_requests'] += 1
+                    return capture
+        return None
+
+    def release(self, capture: dict):
+        """Mark one captured request as finished."""
+        with self.lock:
+            capture['active'] -= 1
+        self._finish_if_done(capture)
+
+    def _finish_if_done(self, capture: dict):
+        with self.lock:
+            done = self._complete(capture) and capture['session'].finished is None
+        if done:
+            capture['session'].stop()
+            with self.lock:
+                self._evict()
+
+    def get(self, capture_id: int) -> Optional[dict]:
+        with self.lock:
+            return self.captures.get(capture_id)
+
+    def status(self, capture: dict) -> dict:
+        with self.lock:
+            complete = self._complete(capture)
+        status = {key: capture[key] for key in ('id', 'route', 'mode', 'requested', 'remaining', 'seconds',
+                                                'active', 'captured_requests')}
+        status['complete'] = complete
+        return status
@@ -0,0 +1,77 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+REFINEMENT_MODES = ("llm", "rocchio", "rocchio_terms")
+
+_TERM = re.compile(r"[a-z][a-z\-]{2,}")
+
+# Function words never worth adding to a query
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her here
+hers herself him himself his how i if in into is it its itself just let me more most my myself no nor not now
+of off on once only or other our ours ourselves out over own same she should so some such than that the their
+theirs them themselves then there these they this those through to too under until up very was we were what
+when where which while who whom why will with would you your yours yourself yourselves one two may might must
+shall use used using thus hence therefore however since given get gets eq fig figure see chapter section
+page example problem equation
+""".split())
+
+
+def rocchio(query: np.ndarray, feedback: np.ndarray, alpha: float = 1.0, beta: float = 0.5,
+            weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Move a query vector toward the (weighted) centroid of its top hits and re-normalize.
+
+    query: (dim,) or (1, dim); feedback: (n, dim) vectors of the pseudo-relevant documents.
+    """
+    query = np.asarray(query, dtype='float32').reshape(-1)
+    feedback = np.asarray(feedback, dtype='float32')
+    if feedback.size == 0:
+        return query.reshape(1, -1)
+    if weights is None:
+        weights = np.ones(len(feedback), dtype='float32')
+    weights = np.asarray(weights, dtype='float32') / max(float(np.sum(weights)), 1e-12)
+    centroid = weights @ feedback
+    expanded = alpha * query + beta * centroid
+    norm = np.linalg.norm(expanded)
+    if norm > 0:
+        expanded = expanded / norm
+    return expanded.reshape(1, -1).astype('float32')
+
+
+def terms(text: str) -> List[str]:
+    """Lower-cased word terms of a text without stopwords."""
+    return [t for t in _TERM.findall(text.lower()) if t not in STOPWORDS]
+
+
+def document_frequencies(texts: List[str]) -> Counter:
+    """Number of texts each term occurs in."""
+    df = Counter()
+    for text in texts:
+        df.update(set(terms(text)))
+    return df
+
+
+def key_terms(query: str, feedback_texts: List[str], df: Dict[str, int], num_docs: int, n_terms: int = 5) -> List[str]:
+    """
+    Terms that characterise the feedback passages: TF-IDF summed over the passages,
+    skipping terms already in the query and terms confined to a single passage.
+    """
+    query_terms = set(terms(query))
+    scores = Counter()
+    seen_in = Counter()
+    for text in feedback_texts:
+        counts = Counter(terms(text))
+        for term, tf in counts.items():
+            idf = math.log((1 + num_docs) / (1 + df.get(term, 0))) + 1
+            scores[term] += (1 + math.log(tf)) * idf
+            seen_in[term] += 1
+    candidates = [(term, score) for term, score in scores.items()
+                  if term not in query_terms and (seen_in[term] > 1 or len(feedback_texts) == 1)]
+    candidates.sort(key=lambda item: -item[1])
+    return [term for term, _ in candidates[:n_terms]]
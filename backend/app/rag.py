@@ -1,24 +1,36 @@
 import os
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["OPENBLAS_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
 from PyPDF2 import PdfReader
 from sentence_transformers import SentenceTransformer
 from FlagEmbedding import FlagReranker
 import faiss
 import numpy as np
+import torch
 from transformers import AutoTokenizer
 import fitz
 import google.generativeai as genai
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 import json
 from dotenv import load_dotenv
 import nltk
 import hashlib
-import re
 import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager, nullcontext
+from .vector_store import build_index, search_index, bytes_per_vector
+from .embedding_scheduler import count_and_truncate, encode_scheduled
+from .passage_store import PassageStore, build_pair_inputs
+from .page_index import PageIndex, fine_search
+from .dedup import strip_boilerplate, drop_near_duplicates
+from .query_expansion import REFINEMENT_MODES, rocchio, key_terms, document_frequencies
+from .shards import Shard, ShardSet, MergedCandidates, check_same_metric, stored_vectors
+from .traces import TraceWriter
+from .conversation_pool import ConversationPools, WarmPool
+from .prewarm import LRUCache, QueryLog, Prewarmer
+from .singleflight import normalize_question
+from .latex_normalize import normalize_latex
+from .artifacts import write_manifest, read_manifest, check_compatible, scan_library
+from .llm_client import LLMClient
+from .threading_config import apply_workload, use_thread_workload, workload
+from .deadline import Deadline
 # Download required NLTK data with better error handling
 import nltk
 nltk.download('punkt', quiet=True)
@@ -27,13 +39,19 @@ print("✅ NLTK data downloaded successfully")
 
 from nltk.tokenize import sent_tokenize
 
+# Start of the answer returned when Gemini fails; such answers are never cached
+FALLBACK_ANSWER = "I apologize, but I encountered an issue generating a response."
+
 class RAGEngine:
-    def __init__(self):
+    def __init__(self, load_llm: bool = True, load_existing_index: bool = True, data_dir: str = None):
         print("\n🚀 Initializing RAG Engine...")
         load_dotenv()
+        # Narrow intra-op threading for online serving; ingestion widens it per call
+        apply_workload("query")
         
         # Use BGE-small-en-v1.5 for faster deployment with optimized settings
         model_name = "BAAI/bge-small-en-v1.5"
+        self.embedding_model_name = model_name
         try:
             self.embedder = SentenceTransformer(model_name)
             # Optimize model settings for faster processing
@@ -48,17 +66,124 @@ class RAGEngine:
         # Initialize reranker
         try:
             print("🔄 Loading BGE reranker...")
-            self.reranker = FlagReranker('BAAI/bge-reranker-base', use_fp16=True)
+            self.reranker_model_name = 'BAAI/bge-reranker-base'
+            self.reranker = FlagReranker(self.reranker_model_name, use_fp16=True)
             print("✅ Loaded BGE reranker")
         except Exception as e:
             raise RuntimeError(f"Failed to load reranker: {str(e)}")
         
+        # Vector index encoding (flat, fp16, sq8, pq) and optional exact re-scoring
+        self.index_encoding = os.getenv("RAG_INDEX_ENCODING", "flat").lower()
+        self.exact_rescore = os.getenv("RAG_EXACT_RESCORE", "false").lower() == "true"
+        self.rescore_factor = int(os.getenv("RAG_RESCORE_FACTOR", "4"))
+        print(f"🗜️ Index encoding: {self.index_encoding} (exact re-scoring: {self.exact_rescore})")
+        
+        # Padded tokens (batch size x longest chunk) per embedding forward pass during ingestion
+        self.embed_token_budget = int(os.getenv("RAG_EMBED_TOKEN_BUDGET", "16384"))
+        
+        # Maximum cross-encoder input length (query + passage + special tokens)
+        self.reranker_max_length = 512
+        
+        # Dense candidates fetched for reranking: 3x the chunks kept, capped at this many
+        self.max_rerank_candidates = int(os.getenv("RAG_MAX_RERANK_CANDIDATES", "30"))
+        
+        # Reranking cascade: dense-margin pruning, then base reranker with early stopping
+        self.cascade_enabled = os.getenv("RAG_RERANK_CASCADE", "true").lower() == "true"
+        self.cascade_distance_margin = float(os.getenv("RAG_CASCADE_DISTANCE_MARGIN", "0.3"))
+        self.cascade_max_survivors = int(os.getenv("RAG_CASCADE_MAX_SURVIVORS", "20"))
+        self.cascade_batch_size = int(os.getenv("RAG_CASCADE_BATCH_SIZE", "4"))
+        self.cascade_patience = int(os.getenv("RAG_CASCADE_PATIENCE", "1"))
+        
+        # Coarse-to-fine retrieval: search page centroids first once a document has this many chunks
+        self.hierarchical_min_chunks = int(os.getenv("RAG_HIERARCHICAL_MIN_CHUNKS", "5000"))
+        self.coarse_pages = int(os.getenv("RAG_COARSE_PAGES", "50"))
+        
+        # Query refinement: llm (Gemini rewrite) or local pseudo-relevance feedback (rocchio, rocchio_terms)
+        self.refinement_mode = os.getenv("RAG_REFINEMENT_MODE", "llm").lower()
+        if self.refinement_mode not in REFINEMENT_MODES:
+            raise ValueError(f"RAG_REFINEMENT_MODE must be one of {', '.join(REFINEMENT_MODES)}")
+        self.rocchio_docs = int(os.getenv("RAG_ROCCHIO_DOCS", "5"))
+        self.rocchio_beta = float(os.getenv("RAG_ROCCHIO_BETA", "0.5"))
+        self.expansion_terms = int(os.getenv("RAG_EXPANSION_TERMS", "5"))
+        self._term_stats = None  # (document id, term document frequencies) for key-term expansion
+        print(f"🎯 Query refinement mode: {self.refinement_mode}")
+        
+        # Chunking parameters (recorded in artifact manifests)
+        self.chunk_max_tokens = int(os.getenv("RAG_CHUNK_MAX_TOKENS", "300"))  # Increased for BGE-small
+        self.chunk_overlap_ratio = 0.2
+        
+        # Ingestion clean-up: repeated header/footer lines, then near-duplicate chunks (SimHash bit distance, -1 disables)
+        self.boilerplate_enabled = os.getenv("RAG_STRIP_BOILERPLATE", "true").lower() == "true"
+        self.boilerplate_min_pages = int(os.getenv("RAG_BOILERPLATE_MIN_PAGES", "4"))
+        self.boilerplate_min_fraction = float(os.getenv("RAG_BOILERPLATE_MIN_FRACTION", "0.5"))
+        self.dedup_max_distance = int(os.getenv("RAG_DEDUP_MAX_DISTANCE", "3"))
+        self.ingest_stats = {}
+        
+        # Per-request time budget and the reserves each stage needs; stages degrade when the budget runs low
+        self.request_budget = float(os.getenv("RAG_REQUEST_BUDGET", "45"))
+        self.answer_reserve = float(os.getenv("RAG_DEADLINE_ANSWER_RESERVE", "10"))
+        self.refine_reserve = float(os.getenv("RAG_DEADLINE_REFINE_RESERVE", "5"))
+        self.rerank_reserve = float(os.getenv("RAG_DEADLINE_RERANK_RESERVE", "2"))
+        self.reduced_context_chars = int(os.getenv("RAG_DEADLINE_REDUCED_CONTEXT_CHARS", "12000"))
+        
+        # Where index artifacts live: a single artifact directory, or a library of them built by app.ingest
+        self.data_dir = data_dir or os.getenv("RAG_DATA_DIR", ".")
+        self.library_dir = os.getenv("RAG_LIBRARY_DIR")
+        self.manifest = None
+        
+        # Sampled retrieval traces, replayed offline with app.trace_replay
+        trace_sample_rate = float(os.getenv("RAG_TRACE_SAMPLE_RATE", "0"))
+        self.tracer = None
+        if trace_sample_rate > 0:
+            self.tracer = TraceWriter(os.getenv("RAG_TRACE_PATH", "traces/retrieval.trace"), trace_sample_rate)
+            print(f"🧾 Capturing {trace_sample_rate:.1%} of retrieval traces to {self.tracer.path}")
+        
+        # Conversation candidate reuse: a follow-up close to the previous turn reranks that turn's
+        # best candidates plus a small fresh search instead of a full candidate set (0 disables)
+        self.conversation_pool_size = int(os.getenv("RAG_CONVERSATION_POOL_SIZE", "15"))
+        self.conversation_delta_k = int(os.getenv("RAG_CONVERSATION_DELTA_K", "5"))
+        self.conversation_pools = None
+        if self.conversation_pool_size > 0:
+            self.conversation_pools = ConversationPools(
+                max_drift=float(os.getenv("RAG_CONVERSATION_MAX_DRIFT", "0.15")),
+                max_conversations=int(os.getenv("RAG_CONVERSATION_MAX", "1000")),
+                ttl=float(os.getenv("RAG_CONVERSATION_TTL", "1800")),
+            )
+        
+        # Caches refilled by prewarming: query embeddings, retrieval results and first-turn answers
+        self.embedding_cache = LRUCache(int(os.getenv("RAG_EMBEDDING_CACHE_SIZE", "1024")))
+        self.retrieval_cache = LRUCache(int(os.getenv("RAG_RETRIEVAL_CACHE_SIZE", "512")))
+        self.answer_cache = LRUCache(int(os.getenv("RAG_ANSWER_CACHE_SIZE", "256")))
+        # Frequent-question log and background prewarming, enabled by the server with enable_prewarm()
+        self.prewarm_answers = os.getenv("RAG_PREWARM_ANSWERS", "true").lower() == "true"
+        self.query_log = None
+        self.prewarmer = None
+        
+        # Multi-book search: every library document is a shard searched in parallel, merged, then reranked once
+        self.multi_book = os.getenv("RAG_MULTI_BOOK", "false").lower() == "true"
+        self.shard_workers = int(os.getenv("RAG_SHARD_WORKERS", "8"))
+        self.shard_set = None
+        
         self.index = None
+        self.full_vectors = None
+        self.page_index = None
+        self.passage_store = None
         self.chunks = []
         self.model = None
-        self._setup_gemini()
-        print("📚 Checking for existing processed data...")
-        self._load_existing_index()
+        self.llm = None
+        # Offline tools (benchmarks, bulk ingestion) skip the Gemini client and the on-disk index
+        if load_llm:
+            self._setup_gemini()
+        if load_existing_index:
+            print("📚 Checking for existing processed data...")
+            if self.library_dir:
+                self._load_library()
+                if self.multi_book:
+                    self._load_shards()
+            else:
+                if self.multi_book:
+                    print("⚠️ RAG_MULTI_BOOK needs RAG_LIBRARY_DIR; searching the single loaded document")
+                self._load_existing_index()
         print("✅ RAG Engine initialization complete\n")
     
     def _setup_gemini(self):
@@ -69,50 +194,66 @@ class RAGEngine:
         
         try:
             self.model_name = "gemini-2.0-flash"
-            genai.configure(api_key=api_key)
+            endpoint = os.getenv("GEMINI_API_ENDPOINT")
+            if endpoint:
+                # Point the client at a local stand-in (see app.fake_gemini)
+                genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+                print(f"🧪 Using Gemini endpoint: {endpoint}")
+            else:
+                genai.configure(api_key=api_key)
             self.model = genai.GenerativeModel(self.model_name)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize Gemini model: {str(e)}")
+        
+        # Every Gemini call goes through one long-lived client (shared executor, deadlines, retries, hedging, limits)
+        self.refine_timeout = float(os.getenv("RAG_LLM_REFINE_TIMEOUT", "15"))
+        self.answer_timeout = float(os.getenv("RAG_LLM_ANSWER_TIMEOUT", "40"))
+        self.llm = LLMClient(
+            self._call_gemini,
+            max_concurrency=int(os.getenv("RAG_LLM_MAX_CONCURRENCY", "8")),
+            rate_per_second=float(os.getenv("RAG_LLM_RATE_LIMIT", "0")),
+            max_retries=int(os.getenv("RAG_LLM_MAX_RETRIES", "2")),
+            hedge_percentile=float(os.getenv("RAG_LLM_HEDGE_PERCENTILE", "0")),
+        )
+    
+    def _call_gemini(self, prompt: str, timeout: float):
+        """Single Gemini request, bounded by a transport-level timeout."""
+        return self.model.generate_content(prompt, request_options={"timeout": timeout})
     
     def _load_pdf_text(self, path: str) -> Tuple[str, List[int]]:
         """Load and parse PDF text, returning text and page mapping."""
         try:
             doc = fitz.open(path)
-            pages_text = []
-            page_numbers = []
-            
-            for page_num, page in enumerate(doc, 1):
-                page_text = page.get_text()
-                pages_text.append(page_text)
-                # Track which page each character belongs to
-                page_numbers.extend([page_num] * len(page_text))
-                # Add page break markers for easier tracking
-                if page_num < len(doc):
-                    pages_text.append(f"\n\n--- PAGE {page_num} END ---\n\n")
-                    page_numbers.extend([page_num] * len(f"\n\n--- PAGE {page_num} END ---\n\n"))
-            
-            text = "".join(pages_text)
+            page_texts = [page.get_text() for page in doc]
             print(f"✅ Loaded with PyMuPDF: {len(doc)} pages.")
-            return text, page_numbers
         except Exception as e:
             print(f"⚠️ PyMuPDF failed ({e}), falling back to PyPDF2...")
             reader = PdfReader(path)
-            pages_text = []
-            page_numbers = []
-            
-            for page_num, page in enumerate(reader.pages, 1):
-                page_text = page.extract_text() or ""
-                pages_text.append(page_text)
-                # Track which page each character belongs to
-                page_numbers.extend([page_num] * len(page_text))
-                # Add page break markers for easier tracking
-                if page_num < len(reader.pages):
-                    pages_text.append(f"\n\n--- PAGE {page_num} END ---\n\n")
-                    page_numbers.extend([page_num] * len(f"\n\n--- PAGE {page_num} END ---\n\n"))
-            
-            text = "".join(pages_text)
+            page_texts = [page.extract_text() or "" for page in reader.pages]
             print(f"✅ Loaded with PyPDF2: {len(reader.pages)} pages.")
-            return text, page_numbers
+        
+        if self.boilerplate_enabled:
+            # Running headers, footers and copyright lines repeat on every page; drop them before chunking
+            page_texts, stats = strip_boilerplate(
+                page_texts, min_pages=self.boilerplate_min_pages, min_fraction=self.boilerplate_min_fraction
+            )
+            self.ingest_stats.update(stats)
+            print(f"🧹 Removed {stats['boilerplate_lines_removed']} boilerplate lines "
+                  f"({stats['boilerplate_chars_removed']} of {stats['text_chars_before']} characters)")
+        
+        pages_text = []
+        page_numbers = []
+        for page_num, page_text in enumerate(page_texts, 1):
+            pages_text.append(page_text)
+            # Track which page each character belongs to
+            page_numbers.extend([page_num] * len(page_text))
+            # Add page break markers for easier tracking
+            if page_num < len(page_texts):
+                pages_text.append(f"\n\n--- PAGE {page_num} END ---\n\n")
+                page_numbers.extend([page_num] * len(f"\n\n--- PAGE {page_num} END ---\n\n"))
+        
+        text = "".join(pages_text)
+        return text, page_numbers
 
     def _chunk_text_with_pages(self, text: str, page_numbers: List[int], max_tokens: int = 200, overlap_ratio: float = 0.2) -> List[Dict]:
         """Semantically chunk text into overlapping segments with page tracking."""
@@ -213,17 +354,78 @@ class RAGEngine:
         except Exception as e:
             raise RuntimeError(f"Failed to chunk text: {str(e)}")
     
+    def _artifact_path(self, name: str) -> str:
+        """Path of an index artifact file inside the current data directory."""
+        return os.path.join(self.data_dir, name)
+    
+    def _load_library(self):
+        """Pick the active document from a library of pre-built artifacts and load it without re-embedding."""
+        entries = scan_library(self.library_dir)
+        if not entries:
+            print(f"⚠️ No index artifacts found in library {self.library_dir}")
+            return False
+        print(f"📚 Found {len(entries)} documents in library {self.library_dir}")
+        
+        # RAG_ACTIVE_DOCUMENT selects by content hash or file name; otherwise use the newest artifacts
+        active = os.getenv("RAG_ACTIVE_DOCUMENT")
+        selected = [e for e in entries if active in (e.get('content_hash'), e.get('document'))] if active else []
+        entry = selected[0] if selected else max(entries, key=lambda e: e.get('created_at', ''))
+        self.data_dir = entry['path']
+        return self._load_existing_index()
+    
+    def _load_shards(self):
+        """Load every compatible library document as a search shard."""
+        shards = []
+        dim = self.embedder.get_sentence_embedding_dimension()
+        for entry in scan_library(self.library_dir):
+            try:
+                # Hits are merged by raw distance, so every shard must use the same encoding and metric
+                check_compatible(entry, self.embedding_model_name, dim, index_encoding=self.index_encoding)
+                shard = Shard.load(entry['path'], tokenizer=self.reranker.tokenizer)
+                check_same_metric(shards, shard)
+                shards.append(shard)
+            except Exception as e:
+                print(f"⚠️ Skipping library document {entry.get('document')}: {str(e)}")
+        self.shard_set = ShardSet(shards, max_workers=min(self.shard_workers, max(1, len(shards))))
+        self._load_shard_term_stats()
+        print(f"📚 Multi-book search over {len(shards)} documents "
+              f"({sum(len(shard.chunks) for shard in shards)} chunks)")
+    
+    def _load_shard_term_stats(self):
+        """Per-shard and summed term document frequencies for key-term expansion over every document."""
+        if self.refinement_mode == "rocchio_terms" and len(self.shard_set):
+            df, _ = self.shard_set.term_statistics()
+            print(f"✅ Computed document frequencies for {len(df)} terms across {len(self.shard_set)} documents")
+    
+    def _register_shard(self):
+        """Make the document just processed searchable alongside the other books."""
+        if self.shard_set is not None:
+            self.shard_set.add(Shard.load(self.data_dir, tokenizer=self.reranker.tokenizer))
+            self._load_shard_term_stats()
+            print(f"📚 Multi-book search now covers {len(self.shard_set)} documents")
+    
     def _load_existing_index(self):
         """Load existing index and chunks if they exist."""
         try:
-            index_path = "large_context_index.faiss"
-            chunks_path = "chunks.json"
+            index_path = self._artifact_path("large_context_index.faiss")
+            chunks_path = self._artifact_path("chunks.json")
             
             if os.path.exists(index_path) and os.path.exists(chunks_path):
                 print("📚 Found existing index and chunks files")
+                manifest = read_manifest(self.data_dir)
+                if manifest is not None:
+                    # Refuse artifacts embedded with a different model or dimension
+                    check_compatible(manifest, self.embedding_model_name, self.embedder.get_sentence_embedding_dimension())
+                    print(f"📋 Artifacts for {manifest.get('document')} ({manifest.get('content_hash')}), "
+                          f"built {manifest.get('created_at')}")
+                self.manifest = manifest
                 self.index = faiss.read_index(index_path)
                 with open(chunks_path, 'r') as f:
                     self.chunks = json.load(f)
+                self._load_full_vectors()
+                self._load_page_index()
+                self._load_passage_store()
+                self._load_term_stats()
                 print(f"✅ Loaded existing index with {self.index.ntotal} vectors and {len(self.chunks)} chunks")
                 return True
             else:
@@ -233,70 +435,110 @@ class RAGEngine:
             print(f"⚠️ Error loading existing index: {str(e)}")
             return False
     
+    def _load_full_vectors(self):
+        """Memory-map the full-precision embeddings used for exact re-scoring and fine page search."""
+        self.full_vectors = None
+        vectors_path = self._artifact_path("embeddings.npy")
+        if os.path.exists(vectors_path):
+            # Pages are only read from disk when rows are actually touched
+            self.full_vectors = np.load(vectors_path, mmap_mode='r')
+            print(f"✅ Memory-mapped {self.full_vectors.shape[0]} full-precision vectors")
+    
+    def _load_page_index(self):
+        """Load page-level centroid vectors for coarse-to-fine retrieval."""
+        self.page_index = None
+        page_index_path = self._artifact_path("page_index.npz")
+        if os.path.exists(page_index_path):
+            self.page_index = PageIndex.load(page_index_path)
+            print(f"✅ Loaded page index with {len(self.page_index)} page centroids")
+    
+    def _load_passage_store(self):
+        """Load reranker token ids cached at ingestion, if they match the current chunks and reranker tokenizer."""
+        self.passage_store = None
+        store_path = self._artifact_path("chunk_tokens.npz")
+        if os.path.exists(store_path):
+            store = PassageStore.load(store_path)
+            if store.matches(self.reranker.tokenizer, len(self.chunks)):
+                self.passage_store = store
+                print(f"✅ Loaded pre-tokenized passages for {len(store)} chunks")
+            else:
+                print(f"⚠️ Pre-tokenized passages (tokenizer: {store.tokenizer_name or 'unknown'}) do not match "
+                      f"the chunks or reranker tokenizer, reranker will tokenize per query")
+    
+    def _load_term_stats(self):
+        """Compute term document frequencies for key-term expansion up front, not on the first query."""
+        self._term_stats = None
+        if self.refinement_mode == "rocchio_terms":
+            self._term_frequencies()
+            print(f"✅ Computed document frequencies for {len(self._term_stats[1])} terms")
+    
+    def _search_index(self, q_emb: np.ndarray, k: int, shard: Shard = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Search the vector index (of the loaded document or a shard), coarse-to-fine over pages for large documents."""
+        shard = shard or self
+        if shard.page_index is not None and len(shard.chunks) >= self.hierarchical_min_chunks:
+            # Coarse: closest page centroids; fine: only the chunks on those pages
+            candidate_ids = shard.page_index.candidate_chunks(q_emb[0], self.coarse_pages)
+            if len(candidate_ids) >= k:
+                result = fine_search(shard.index, q_emb, candidate_ids, k, full_vectors=shard.full_vectors)
+                if result is not None:
+                    return result
+        rescore_vectors = shard.full_vectors if self.exact_rescore else None
+        return search_index(shard.index, q_emb, k, full_vectors=rescore_vectors, rescore_factor=self.rescore_factor)
+    
+    def _check_documents(self, documents: List[str] = None):
+        """Raise ValueError for a document filter that cannot be applied."""
+        if not documents:
+            return
+        if self.shard_set is None:
+            raise ValueError("Filtering by document needs multi-book search (RAG_MULTI_BOOK with RAG_LIBRARY_DIR)")
+        self.shard_set.select(documents)
+    
+    def _retrieve(self, q_emb: np.ndarray, k: int, documents: List[str] = None):
+        """
+        Dense search for the top k chunks.
+        
+        Returns (source, indices, distances): source is the engine itself for single-document
+        search, or the merged hits of every selected shard in multi-book mode; indices address
+        source.chunks.
+        """
+        if self.shard_set is not None and len(self.shard_set):
+            merged = self.shard_set.search(lambda shard, q, n: self._search_index(q, n, shard=shard), q_emb, k, documents)
+            return merged, list(range(len(merged.chunks))), merged.distances
+        D, I = self._search_index(q_emb, k)
+        indices = [int(idx) for idx in I[0] if idx >= 0]
+        distances = [float(dist) for idx, dist in zip(I[0], D[0]) if idx >= 0]
+        return self, indices, distances
+    
     def _build_index(self, chunks: List[Dict], progress_callback=None):
         """Build FAISS index from chunks with page metadata."""
         try:
-            # Extract text for embedding while preserving metadata
-            chunk_texts = []
+            # Count tokens exactly in one batched pass and truncate at the embedder's real limit
+            chunk_texts, token_counts = count_and_truncate(
+                self.tokenizer, [chunk_data['text'] for chunk_data in chunks], self.embedder.max_seq_length
+            )
             safe_chunks = []
+            for chunk_data, embedding_text in zip(chunks, chunk_texts):
+                safe_chunks.append({
+                    'text': chunk_data['text'],  # Keep original text
+                    'pages': chunk_data['pages'],
+                    'embedding_text': embedding_text  # Track what was used for embedding
+                })
             
-            for chunk_data in chunks:
-                chunk_text = chunk_data['text']
-                # Additional safety check: truncate any chunks that are still too long
-                # Since we're using BGE-small-en-v1.5 with max_seq_length=384, be conservative
-                # Roughly 4 characters per token for English text
-                max_chars = 1536  # Conservative estimate for 384 tokens
-                if len(chunk_text) > max_chars:
-                    # Truncate to safe length
-                    truncated = chunk_text[:max_chars]
-                    # Try to end at a sentence boundary
-                    last_period = truncated.rfind('.')
-                    if last_period > 1200:  # Only truncate at sentence if we have enough content
-                        truncated = truncated[:last_period + 1]
-                    chunk_texts.append(truncated)
-                    # Update the chunk data with truncated text for embedding but keep original for storage
-                    safe_chunks.append({
-                        'text': chunk_data['text'],  # Keep original text
-                        'pages': chunk_data['pages'],
-                        'embedding_text': truncated  # Track what was used for embedding
-                    })
-                else:
-                    chunk_texts.append(chunk_text)
-                    safe_chunks.append({
-                        'text': chunk_text,
-                        'pages': chunk_data['pages'],
-                        'embedding_text': chunk_text
-                    })
-            
-            print(f"🔍 Processing {len(chunk_texts)} chunks for embedding...")
-            
-            # Process chunks in batches to show progress
-            batch_size = 64  # Increased batch size for faster processing
-            all_embeddings = []
             total_chunks = len(chunk_texts)
+            print(f"🔍 Processing {total_chunks} chunks ({sum(token_counts)} tokens) for embedding...")
             
-            for i in range(0, total_chunks, batch_size):
-                batch_texts = chunk_texts[i:i + batch_size]
-                batch_embeddings = self.embedder.encode(
-                    batch_texts, 
-                    convert_to_numpy=True, 
-                    show_progress_bar=False,
-                    batch_size=64  # Use optimized batch size
-                )
-                all_embeddings.append(batch_embeddings)
-                
-                # Update progress
-                processed = min(i + batch_size, total_chunks)
+            # Embed in length-bucketed batches sized by a token budget, then restore document order
+            def on_batch(batch_number, total_batches, processed):
                 progress = 85 + int((processed / total_chunks) * 10)  # Progress from 85% to 95%
                 if progress_callback:
-                    progress_callback(progress, f"🧠 Processing batch {i//batch_size + 1}/{(total_chunks + batch_size - 1)//batch_size}...")
-                
-                print(f"✅ Processed batch {i//batch_size + 1}/{(total_chunks + batch_size - 1)//batch_size}")
+                    progress_callback(progress, f"🧠 Processing batch {batch_number}/{total_batches}...")
+                print(f"✅ Processed batch {batch_number}/{total_batches}")
             
-            # Combine all embeddings
-            embeddings = all_embeddings[0] if len(all_embeddings) == 1 else None
-            if embeddings is None:
-                embeddings = np.vstack(all_embeddings)
+            embeddings = encode_scheduled(
+                self.embedder, chunk_texts, token_counts,
+                token_budget=self.embed_token_budget,
+                on_batch=on_batch
+            )
             
             embeddings = embeddings.astype('float32')
             
@@ -305,14 +547,25 @@ class RAGEngine:
             
             faiss.normalize_L2(embeddings)
             
-            d = embeddings.shape[1]
-            self.index = faiss.IndexFlatL2(d)
-            self.index.add(embeddings)
+            self.index = build_index(embeddings, self.index_encoding)
+            print(f"🗜️ Built {self.index_encoding} index: {bytes_per_vector(self.index):.0f} bytes/vector")
             
             # Save both index and chunks with page metadata
-            faiss.write_index(self.index, "large_context_index.faiss")
-            with open("chunks.json", 'w') as f:
+            os.makedirs(self.data_dir, exist_ok=True)
+            faiss.write_index(self.index, self._artifact_path("large_context_index.faiss"))
+            # Keep full-precision vectors on disk for exact re-scoring and offline reports
+            np.save(self._artifact_path("embeddings.npy"), embeddings)
+            self._load_full_vectors()
+            with open(self._artifact_path("chunks.json"), 'w') as f:
                 json.dump(safe_chunks, f)  # Save chunks with page metadata
+            
+            # Page-level centroids for coarse-to-fine search over large documents
+            self.page_index = PageIndex.build(embeddings, safe_chunks)
+            self.page_index.save(self._artifact_path("page_index.npz"))
+            
+            # Tokenize passages once with the reranker's tokenizer so queries never re-tokenize them
+            self.passage_store = PassageStore.build(self.reranker.tokenizer, [chunk['text'] for chunk in safe_chunks])
+            self.passage_store.save(self._artifact_path("chunk_tokens.npz"))
             print("✅ FAISS index and chunks saved")
         except Exception as e:
             raise RuntimeError(f"Failed to build FAISS index: {str(e)}")
@@ -326,7 +579,7 @@ class RAGEngine:
         """Check if this PDF has already been processed."""
         try:
             pdf_hash = self._get_pdf_hash(pdf_path)
-            hash_path = "pdf_hash.txt"
+            hash_path = self._artifact_path("pdf_hash.txt")
             
             if os.path.exists(hash_path):
                 with open(hash_path, 'r') as f:
@@ -343,60 +596,129 @@ class RAGEngine:
     
     def process_pdf(self, pdf_path: str, progress_callback=None):
         """Process PDF and build the RAG index."""
-        try:
-            # Check if this PDF has already been processed
-            if self._check_existing_processing(pdf_path):
-                print("🔄 Loading existing index and chunks...")
-                if self._load_existing_index():
-                    print("✅ Successfully loaded existing index and chunks")
-                    return
-                else:
-                    print("⚠️ Failed to load existing index, will process PDF again")
+        # Bulk embedding uses every core; serving goes back to narrow settings afterwards
+        with workload("ingest"):
+            previous_data_dir = self.data_dir
+            try:
+                pdf_hash = self._get_pdf_hash(pdf_path)
+                if self.library_dir:
+                    # Each document in a library gets its own artifact directory keyed by content hash
+                    self.data_dir = os.path.join(self.library_dir, pdf_hash)
             
-            print("📄 Processing new PDF...")
-            # Load and parse PDF with page tracking
-            text, page_numbers = self._load_pdf_text(pdf_path)
+                # Check if this PDF has already been processed
+                if self._check_existing_processing(pdf_path):
+                    print("🔄 Loading existing index and chunks...")
+                    if self._load_existing_index():
+                        print("✅ Successfully loaded existing index and chunks")
+                        self._register_shard()
+                        self._index_swapped()
+                        return
+                    else:
+                        print("⚠️ Failed to load existing index, will process PDF again")
             
-            # Chunk the text with page metadata
-            self.chunks = self._chunk_text_with_pages(text, page_numbers, max_tokens=300)  # Increased for BGE-small
-            print(f"🔖 Split into {len(self.chunks)} chunks with page metadata")
+                print("📄 Processing new PDF...")
+                self.ingest_stats = {}
+                # Load and parse PDF with page tracking
+                text, page_numbers = self._load_pdf_text(pdf_path)
             
-            # Build the index with progress callback
-            self._build_index(self.chunks, progress_callback)
-            print("✅ FAISS index built successfully")
+                # Chunk the text with page metadata
+                self.chunks = self._chunk_text_with_pages(
+                    text, page_numbers, max_tokens=self.chunk_max_tokens, overlap_ratio=self.chunk_overlap_ratio
+                )
+                print(f"🔖 Split into {len(self.chunks)} chunks with page metadata")
             
-            # Save the PDF hash
-            pdf_hash = self._get_pdf_hash(pdf_path)
-            with open("pdf_hash.txt", 'w') as f:
-                f.write(pdf_hash)
-            print(f"💾 Saved PDF hash: {pdf_hash}")
+                if self.dedup_max_distance >= 0:
+                    # Repeated passages would be embedded, indexed and packed into prompts more than once
+                    self.chunks, stats = drop_near_duplicates(self.chunks, max_distance=self.dedup_max_distance)
+                    self.ingest_stats.update(stats)
+                    print(f"🧹 Dropped {stats['near_duplicate_chunks_removed']} near-duplicate chunks "
+                          f"({len(self.chunks)} left)")
             
-        except Exception as e:
-            raise RuntimeError(f"Failed to process PDF: {str(e)}")
+                # Build the index with progress callback
+                self._build_index(self.chunks, progress_callback)
+                print("✅ FAISS index built successfully")
+                self._report_ingest_savings()
+            
+                # Save the PDF hash
+                with open(self._artifact_path("pdf_hash.txt"), 'w') as f:
+                    f.write(pdf_hash)
+                print(f"💾 Saved PDF hash: {pdf_hash}")
+            
+                # Describe the artifacts so they can be loaded later without re-embedding
+                self.manifest = write_manifest(
+                    self.data_dir,
+                    document=os.path.basename(pdf_path),
+                    content_hash=pdf_hash,
+                    embedding_model=self.embedding_model_name,
+                    embedding_dim=int(self.index.d),
+                    max_seq_length=self.embedder.max_seq_length,
+                    reranker_model=self.reranker_model_name,
+                    chunk_max_tokens=self.chunk_max_tokens,
+                    chunk_overlap_ratio=self.chunk_overlap_ratio,
+                    index_encoding=self.index_encoding,
+                    num_chunks=len(self.chunks),
+                    strip_boilerplate=self.boilerplate_enabled,
+                    dedup_max_distance=self.dedup_max_distance,
+                    ingest_stats=self.ingest_stats,
+                )
+                # Keyed by document id, which comes from the manifest just written
+                self._load_term_stats()
+                self._register_shard()
+                self._index_swapped()
+            
+            except Exception as e:
+                if self.data_dir != previous_data_dir:
+                    # Keep serving the document that was loaded before this upload
+                    self.data_dir = previous_data_dir
+                    self._load_existing_index()
+                raise RuntimeError(f"Failed to process PDF: {str(e)}")
 
-    def _refine_question(self, question: str, history: list) -> str:
+    def _report_ingest_savings(self):
+        """Estimate how much boilerplate and duplicate removal shrank the index and prompts."""
+        stats = self.ingest_stats
+        if not stats:
+            return
+        removed_chars = stats.get('boilerplate_chars_removed', 0) + stats.get('chunk_chars_removed', 0)
+        total_chars = stats.get('text_chars_before') or sum(len(chunk['text']) for chunk in self.chunks) + removed_chars
+        stats['text_reduction'] = round(removed_chars / total_chars, 4) if total_chars else 0.0
+        # Removed duplicates are vectors that never enter the index
+        stats['index_bytes_saved'] = int(stats.get('near_duplicate_chunks_removed', 0) * bytes_per_vector(self.index))
+        # Boilerplate used to ride along in every context passage sent to the LLM
+        stats['prompt_chars_saved_per_chunk'] = round(stats.get('boilerplate_chars_removed', 0) / max(1, len(self.chunks)), 1)
+        print(f"📉 Ingestion clean-up removed {stats['text_reduction']:.1%} of the text, "
+              f"{stats['index_bytes_saved']} index bytes, ~{stats['prompt_chars_saved_per_chunk']} prompt characters per chunk")
+    
+    def document_id(self) -> str:
+        """Identifier of the loaded document, used to key per-document coalescing and caches."""
+        if self.manifest and self.manifest.get('content_hash'):
+            return self.manifest['content_hash']
+        return f"index-{id(self.index)}"
+    
+    def new_deadline(self) -> Deadline:
+        """Start the time budget for one request."""
+        return Deadline(self.request_budget)
+    
+    def _refine_question(self, question: str, history: list, deadline: Deadline = None, documents: List[str] = None) -> str:
         """Refine the user's question using retrieved context to guide reformulation."""
+        # First degradation: skip refinement when the budget cannot cover it plus the later stages
+        if deadline is not None and deadline.remaining() < self.answer_reserve + self.rerank_reserve + self.refine_reserve:
+            deadline.degrade("refinement", "skipped")
+            return question
         try:
             print(f"🔍 Starting question refinement for: {question[:100]}...")
             
             # Step 1: Take the raw user query and do a rough retrieval (truncate if too long)
-            query_text = question
-            if len(query_text) > 384:  # Safety truncation for BGE-small-en-v1.5
-                query_text = query_text[:384]
-            q_emb = self.embedder.encode([query_text], convert_to_numpy=True, batch_size=1)
+            q_emb = self._embed_query(question)
             
             # Step 2: Run rough retrieval to get top-k contexts (even with vague query)
             k_rough = 5  # Get top 5 hits for reformulation
-            D, I = self.index.search(q_emb, k_rough)
+            source, rough_indices, _ = self._retrieve(q_emb, k_rough, documents)
             
             # Step 3: Gather the retrieved contexts
             rough_contexts = []
-            for idx in I[0]:
-                if idx < len(self.chunks):  # Safety check
-                    chunk_data = self.chunks[idx]
-                    # Handle both old format (strings) and new format (dicts)
-                    chunk_text = chunk_data if isinstance(chunk_data, str) else chunk_data['text']
-                    rough_contexts.append(chunk_text)
+            for idx in rough_indices:
+                if idx < len(source.chunks):  # Safety check
+                    rough_contexts.append(self._chunk_text(idx, source))
             
             # Combine contexts for reformulation
             combined_context = "\n\n".join(rough_contexts)
@@ -458,7 +780,11 @@ class RAGEngine:
             )
             
             print(f"🤖 Calling Gemini for question refinement...")
-            response = self.model.generate_content(prompt)
+            refine_timeout = self.refine_timeout
+            if deadline is not None:
+                # Leave enough budget for retrieval, reranking and the answer
+                refine_timeout = min(refine_timeout, deadline.remaining() - self.answer_reserve - self.rerank_reserve)
+            response = self.llm.generate(prompt, timeout=refine_timeout)
             if not response or not response.text:
                 print("⚠️ Warning: Failed to refine question, using original.")
                 return question
@@ -477,99 +803,235 @@ class RAGEngine:
             print(f"⚠️ Warning: Error during question refinement: {str(e)}. Using original question.")
             return question
 
+    def _embed_query(self, text: str) -> np.ndarray:
+        """Embed a query, truncated for BGE-small-en-v1.5; repeated queries come from the embedding cache."""
+        if len(text) > 384:
+            text = text[:384]
+        q_emb = self.embedding_cache.get(text)
+        if q_emb is None:
+            q_emb = self.embedder.encode([text], convert_to_numpy=True, batch_size=1)
+            self.embedding_cache.put(text, q_emb)
+        return q_emb
+    
+    def _chunk_text(self, idx: int, source=None) -> str:
+        chunk_data = (source or self).chunks[idx]
+        # Handle both old format (strings) and new format (dicts)
+        return chunk_data if isinstance(chunk_data, str) else chunk_data['text']
+    
+    def _term_frequencies(self) -> Dict[str, int]:
+        """Document frequency of every term in the loaded document, computed once per document (at load when expansion uses it)."""
+        document_id = self.document_id()
+        if self._term_stats is None or self._term_stats[0] != document_id:
+            self._term_stats = (document_id, document_frequencies([self._chunk_text(i) for i in range(len(self.chunks))]))
+        return self._term_stats[1]
+    
+    def _expand_locally(self, question: str, documents: List[str] = None) -> Tuple[str, np.ndarray]:
+        """Pseudo-relevance feedback: move the query vector toward its top hits, optionally adding their key terms."""
+        start_time = time.time()
+        q_emb = self._embed_query(question)
+        source, hits, _ = self._retrieve(q_emb, self.rocchio_docs, documents)
+        hits = [idx for idx in hits if idx < len(source.chunks)]
+        if not hits:
+            return question, q_emb
+        
+        query_text = question
+        if self.refinement_mode == "rocchio_terms":
+            if isinstance(source, MergedCandidates):
+                # IDF over every searched document, not just the one loaded last
+                df, num_docs = self.shard_set.term_statistics(documents)
+            else:
+                df, num_docs = self._term_frequencies(), len(self.chunks)
+            expansion = key_terms(question, [self._chunk_text(idx, source) for idx in hits], df, num_docs,
+                                  n_terms=self.expansion_terms)
+            if expansion:
+                query_text = f"{question} ({', '.join(expansion)})"
+                q_emb = self._embed_query(query_text)
+        
+        query_vector = rocchio(q_emb, stored_vectors(source, hits), beta=self.rocchio_beta)
+        print(f"🎯 Expanded query locally ({self.refinement_mode}, {len(hits)} feedback chunks) "
+              f"in {(time.time() - start_time) * 1000:.0f} ms: {query_text}")
+        return query_text, query_vector
+    
+    def _refine_query(self, question: str, history: list, deadline: Deadline = None, documents: List[str] = None) -> Tuple[str, Optional[np.ndarray]]:
+        """
+        Refine the question for retrieval according to the refinement mode.
+        
+        Returns the query text (used for reranking and the answer prompt) and, for the local
+        modes, the query vector to search with; None means "embed the text".
+        """
+        if self.refinement_mode == "llm":
+            return self._refine_question(question, history, deadline=deadline, documents=documents), None
+        try:
+            return self._expand_locally(question, documents)
+        except Exception as e:
+            print(f"⚠️ Warning: Error during local query expansion: {str(e)}. Using original question.")
+            return question, None
+
     def _post_process_latex(self, text: str) -> str:
-        """Minimal post-processing to clean up text without interfering with LaTeX."""
-        # Just clean up any obvious issues without heavy LaTeX manipulation
-        # The frontend AlternativeLatexRenderer already handles LaTeX properly
+        """Normalize markdown/LaTeX once on the server (see app.latex_normalize), so clients render it as is."""
+        return normalize_latex(text)
+
+    def _score_candidates(self, query: str, chunk_indices: List[int], query_ids: List[int] = None, source=None) -> List[float]:
+        """Score query-chunk pairs with the base reranker (chunks of the loaded document, or of source)."""
+        source = source or self
+        if source.passage_store is not None:
+            # Assemble inputs from token ids cached at ingestion - no passage tokenization per query
+            return self._score_pretokenized(query, chunk_indices, query_ids=query_ids, source=source)
+        scores = self.reranker.compute_score([[query, self._truncate_passage(query, idx, source)] for idx in chunk_indices])
+        # Handle both single score and list of scores
+        return scores if isinstance(scores, list) else [scores]
+    
+    def _score_pretokenized(self, query: str, chunk_indices: List[int], batch_size: int = 32, query_ids: List[int] = None, source=None) -> List[float]:
+        """Score query-passage pairs with the reranker model using the pre-tokenized passage store."""
+        source = source or self
+        tokenizer = self.reranker.tokenizer
+        if query_ids is None:
+            query_ids = tokenizer.encode(query, add_special_tokens=False)
+        pair_inputs = build_pair_inputs(
+            tokenizer, query_ids, [source.passage_store[idx] for idx in chunk_indices], max_length=self.reranker_max_length
+        )
         
-        # Fix any double-escaped backslashes that might cause issues
-        text = re.sub(r'\\\\([a-zA-Z]+)', r'\\\1', text)
+        scores = []
+        with torch.no_grad():
+            for start in range(0, len(pair_inputs), batch_size):
+                batch = tokenizer.pad({'input_ids': pair_inputs[start:start + batch_size]}, padding=True, return_tensors='pt')
+                batch = {key: value.to(self.reranker.device) for key, value in batch.items()}
+                logits = self.reranker.model(**batch, return_dict=True).logits.view(-1).float()
+                scores.extend(logits.cpu().tolist())
+        return scores
+    
+    def _truncate_passage(self, query: str, idx: int, source=None) -> str:
+        """Character-based passage truncation for indexes built before the passage store existed."""
+        # Reserve tokens for query, special tokens, and safety margin
+        query_tokens = len(self.reranker.tokenizer.encode(query, add_special_tokens=False))
+        max_passage_tokens = self.reranker_max_length - query_tokens - 50
+        # Convert tokens to approximate characters (rough estimate: 4 chars per token)
+        max_passage_chars = max(100, max_passage_tokens * 4)  # Ensure minimum of 100 chars
         
-        return text
+        chunk_text = self._chunk_text(idx, source)
+        if len(chunk_text) > max_passage_chars:
+            # Truncate and try to end at sentence boundary
+            truncated = chunk_text[:max_passage_chars]
+            last_period = truncated.rfind('.')
+            last_space = truncated.rfind(' ')
+            
+            # Use sentence boundary if available and reasonable
+            if last_period > max_passage_chars * 0.7:
+                chunk_text = truncated[:last_period + 1]
+            elif last_space > max_passage_chars * 0.8:
+                chunk_text = truncated[:last_space]
+            else:
+                chunk_text = truncated
+        return chunk_text
 
-    def _rerank_chunks(self, query: str, chunk_indices: List[int], top_k: int = None) -> List[int]:
+    def _rerank_chunks(self, query: str, chunk_indices: List[int], top_k: int = None, distances: List[float] = None, stats: dict = None, deadline: Deadline = None, source=None, known_scores: Dict[int, float] = None) -> List[int]:
         """
-        Rerank retrieved chunks using FlagReranker for better relevance.
+        Rerank retrieved chunks with a cascade: dense-score pruning, then the BGE FlagReranker
+        on the survivors in small batches, stopping early once the top-k set is stable.
         
         Args:
             query: The search query
-            chunk_indices: List of chunk indices to rerank
+            chunk_indices: List of chunk indices to rerank, in dense retrieval order
             top_k: Number of top chunks to return (if None, returns all reranked)
+            distances: FAISS distances aligned with chunk_indices (enables stage 1 pruning)
+            stats: Optional dict filled with how many candidates each stage removed
+            deadline: Optional request deadline; scoring stops between batches once it gets tight
+            source: Where chunk_indices point (default: the loaded document; merged shard hits in multi-book mode)
+            known_scores: Reranker scores already computed for this exact query, reused instead of re-scoring
         
         Returns:
             List of reranked chunk indices
         """
         if not chunk_indices:
             return chunk_indices
-            
-        print(f"🔄 Reranking {len(chunk_indices)} chunks using BGE FlagReranker...")
-        
-        # Calculate safe passage length based on reranker's max sequence length (512 tokens)
-        # Reserve tokens for query, special tokens, and safety margin
-        query_tokens = len(self.tokenizer.encode(query, add_special_tokens=False))
-        # BGE reranker uses special tokens and separators, reserve ~50 tokens for safety
-        max_passage_tokens = 512 - query_tokens - 50
-        # Convert tokens to approximate characters (rough estimate: 4 chars per token)
-        max_passage_chars = max(100, max_passage_tokens * 4)  # Ensure minimum of 100 chars
         
-        # Prepare query-chunk pairs for FlagReranker
-        passages = []
-        valid_indices = []
+        source = source or self
+        if distances is None:
+            distances = [None] * len(chunk_indices)
+        candidates = [(idx, dist) for idx, dist in zip(chunk_indices, distances) if 0 <= idx < len(source.chunks)]
+        if not candidates:
+            return chunk_indices
+        keep = top_k or len(candidates)
         
-        for idx in chunk_indices:
-            if idx < len(self.chunks):
-                chunk_data = self.chunks[idx]
-                # Handle both old format (strings) and new format (dicts)
-                chunk_text = chunk_data if isinstance(chunk_data, str) else chunk_data['text']
-                
-                # Smart truncation based on actual token limits
-                if len(chunk_text) > max_passage_chars:
-                    # Truncate and try to end at sentence boundary
-                    truncated = chunk_text[:max_passage_chars]
-                    last_period = truncated.rfind('.')
-                    last_space = truncated.rfind(' ')
-                    
-                    # Use sentence boundary if available and reasonable
-                    if last_period > max_passage_chars * 0.7:
-                        chunk_text = truncated[:last_period + 1]
-                    elif last_space > max_passage_chars * 0.8:
-                        chunk_text = truncated[:last_space]
-                    else:
-                        chunk_text = truncated
-                
-                passages.append(chunk_text)
-                valid_indices.append(idx)
+        # Stage 1: drop candidates whose dense distance is clearly worse than the best hit
+        stage1_pruned = 0
+        if self.cascade_enabled and candidates[0][1] is not None:
+            best = min(dist for _, dist in candidates)
+            survivors = [c for c in candidates if c[1] <= best + self.cascade_distance_margin]
+            # Never prune below top_k, and cap how many reach the base reranker
+            if len(survivors) < keep:
+                survivors = candidates[:keep]
+            survivors = survivors[:max(keep, self.cascade_max_survivors)]
+            stage1_pruned = len(candidates) - len(survivors)
+            candidates = survivors
         
-        if not passages:
-            return chunk_indices
+        valid_indices = [idx for idx, _ in candidates]
+        print(f"🔄 Reranking {len(valid_indices)} chunks using BGE FlagReranker ({stage1_pruned} pruned by dense margin)...")
         
-        # Get reranking scores using FlagReranker
+        # Stage 2: score survivors in dense order, stopping once the top-k set stops changing
+        batch_size = self.cascade_batch_size if self.cascade_enabled else len(valid_indices)
+        known_scores = known_scores or {}
+        scored_indices = []
+        reused = 0
+        stable_batches = 0
+        previous_top = None
         try:
-            scores = self.reranker.compute_score([[query, passage] for passage in passages])
+            query_ids = self.reranker.tokenizer.encode(query, add_special_tokens=False) if source.passage_store is not None else None
+            end = 0
+            while end < len(valid_indices):
+                # The first batch fills the top-k, so the very next batch can already confirm it
+                start, end = end, end + (max(batch_size, keep) if end == 0 else batch_size)
+                batch = valid_indices[start:end]
+                fresh = [idx for idx in batch if idx not in known_scores]
+                fresh_scores = dict(zip(fresh, self._score_candidates(query, fresh, query_ids=query_ids, source=source))) if fresh else {}
+                reused += len(batch) - len(fresh)
+                scored_indices.extend((idx, known_scores[idx] if idx in known_scores else fresh_scores[idx]) for idx in batch)
+                if deadline is not None and end < len(valid_indices) and deadline.remaining() < self.answer_reserve:
+                    deadline.degrade("reranking", "truncated", f"scored {len(scored_indices)}/{len(valid_indices)}")
+                    break
+                if len(scored_indices) < keep:
+                    continue
+                current_top = {idx for idx, _ in sorted(scored_indices, key=lambda x: x[1], reverse=True)[:keep]}
+                stable_batches = stable_batches + 1 if current_top == previous_top else 0
+                previous_top = current_top
+                if self.cascade_enabled and stable_batches >= self.cascade_patience:
+                    break
         except Exception as e:
             print(f"⚠️ Warning: Reranker failed ({str(e)}), falling back to original order")
             return chunk_indices[:top_k] if top_k else chunk_indices
         
-        # Handle both single score and list of scores
-        if not isinstance(scores, list):
-            scores = [scores]
+        stage2_skipped = len(valid_indices) - len(scored_indices)
+        if stats is not None:
+            stats.update({
+                'candidates': len(chunk_indices),
+                'stage1_pruned': stage1_pruned,
+                'stage2_skipped': stage2_skipped,
+                'scored': len(scored_indices),
+                'scores_reused': reused,
+                'scores': list(scored_indices),
+            })
         
         # Sort indices by scores (descending)
-        scored_indices = list(zip(valid_indices, scores))
         scored_indices.sort(key=lambda x: x[1], reverse=True)
         
-        # Extract reranked indices
-        reranked_indices = [idx for idx, score in scored_indices]
+        # Extract reranked indices; anything left unscored follows in dense order
+        scored_set = {idx for idx, _ in scored_indices}
+        reranked_indices = [idx for idx, score in scored_indices] + [idx for idx in valid_indices if idx not in scored_set]
         
         # Return top_k if specified
         if top_k and top_k < len(reranked_indices):
             reranked_indices = reranked_indices[:top_k]
         
-        print(f"✅ Reranking complete. Top scores: {[f'{score:.3f}' for _, score in scored_indices[:5]]}")
+        print(f"✅ Reranking complete. Scored {len(scored_indices)}/{len(chunk_indices)} candidates "
+              f"(stage 1 pruned {stage1_pruned}, early stop skipped {stage2_skipped}). "
+              f"Top scores: {[f'{score:.3f}' for _, score in scored_indices[:5]]}")
         return reranked_indices
 
-    def _get_contexts(self, refined_question: str, k: int = 10, window_size: int = 5):
-        """Get relevant contexts from the vector database with reranking."""
+    def _get_contexts(self, refined_question: str, k: int = 10, window_size: int = 5, rerank_stats: dict = None, deadline: Deadline = None, query_vector: np.ndarray = None, documents: List[str] = None, trace: dict = None, conversation_id: str = None):
+        """
+        Get relevant contexts from the vector database with reranking; fills and records trace if given.
+        With a conversation_id, follow-ups close to the previous turn reuse its warm candidate pool.
+        """
         print(f"🔍 Getting contexts for refined question: {refined_question[:100]}...")
         
         # Embed the refined question (truncate if too long)
@@ -577,17 +1039,98 @@ class RAGEngine:
         if len(query_text) > 384:  # Safety truncation for long queries with BGE-small-en-v1.5
             query_text = query_text[:384]
         
-        print(f"🔮 Encoding query for embedding search...")
-        q_emb = self.embedder.encode([query_text], convert_to_numpy=True, batch_size=1)
+        # Identical refined questions over the same document reuse the finished retrieval
+        cache_key = (self.document_id(), self.refinement_mode, query_text, k, window_size, tuple(sorted(documents or [])))
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            contexts, window_indices, pages_used, reranked = cached
+            print(f"⚡ Retrieval cache hit: {len(contexts)} context chunks")
+            if trace is not None:
+                # Cached queries are part of production traffic too; replay re-runs them in full
+                trace.update({
+                    'refined_question': refined_question,
+                    'vector': query_vector if query_vector is not None else self._embed_query(query_text),
+                    'k': k,
+                    'window_size': window_size,
+                    'reranked': list(reranked),
+                    'cached': True,
+                    'search_ms': 0.0,
+                    'rerank_ms': 0.0,
+                })
+                self._record_trace(trace, window_indices, pages_used, contexts, deadline)
+            return list(contexts), list(window_indices), list(pages_used)
+        degradations_before = len(deadline.degradations) if deadline is not None else 0
+        
+        if query_vector is not None:
+            # Local refinement already produced the vector to search with
+            q_emb = query_vector
+        else:
+            print(f"🔮 Encoding query for embedding search...")
+            q_emb = self._embed_query(query_text)
         
         # Search FAISS for more chunks initially (for reranking)
-        initial_k = min(k * 3, 30)  # Get 3x more chunks for reranking, but cap at 30
+        initial_k = min(k * 3, self.max_rerank_candidates)  # Get 3x more chunks for reranking, but cap it
+        skip_rerank = False
+        if deadline is not None:
+            spare = deadline.remaining() - self.answer_reserve
+            if spare < self.rerank_reserve / 4:
+                # Second degradation: skip reranking entirely and trust the dense order
+                deadline.degrade("reranking", "skipped")
+                skip_rerank = True
+                initial_k = k
+            elif spare < self.rerank_reserve:
+                # ...or only rerank as many candidates as we keep
+                deadline.degrade("reranking", "shrunk", f"{initial_k} -> {k} candidates")
+                initial_k = k
+            if deadline.remaining() < self.answer_reserve and window_size > 1:
+                # Third degradation: a smaller context window for a faster answer
+                deadline.degrade("context", "reduced", f"window {window_size} -> 1")
+                window_size = 1
         print(f"🔍 Searching FAISS index for top {initial_k} chunks for reranking...")
-        D, I = self.index.search(q_emb, initial_k)
+        search_start = time.time()
+        warm, pool_drift = self._warm_pool(conversation_id, q_emb, documents)
+        if warm is not None:
+            source, initial_indices, initial_distances = self._retrieve_warm(warm, q_emb, initial_k)
+            print(f"♻️ Reusing conversation pool (drift {pool_drift:.3f}): {len(initial_indices)} candidates")
+        else:
+            source, initial_indices, initial_distances = self._retrieve(q_emb, initial_k, documents)
+        search_ms = (time.time() - search_start) * 1000
         
-        # Rerank the retrieved chunks to improve relevance
-        initial_indices = I[0].tolist()
-        reranked_indices = self._rerank_chunks(query_text, initial_indices, top_k=k)
+        # Rerank the retrieved chunks to improve relevance (once, over the merged hits in multi-book mode)
+        if (trace is not None or conversation_id) and rerank_stats is None:
+            rerank_stats = {}
+        rerank_start = time.time()
+        if skip_rerank:
+            reranked_indices = initial_indices[:k]
+        else:
+            # Scores are only reusable for the very same query text
+            known_scores = warm.scores if warm is not None and warm.query == query_text else None
+            reranked_indices = self._rerank_chunks(query_text, initial_indices, top_k=k, distances=initial_distances,
+                                                   stats=rerank_stats, deadline=deadline, source=source, known_scores=known_scores)
+        if conversation_id and source is self:
+            self._store_warm_pool(conversation_id, q_emb, query_text, reranked_indices, rerank_stats, k)
+        if trace is not None:
+            trace.update({
+                'refined_question': refined_question,
+                'vector': q_emb,
+                'k': k,
+                'window_size': window_size,
+                'initial_k': initial_k,
+                'candidates': self._trace_ids(source, initial_indices),
+                'distances': [round(dist, 5) for dist in initial_distances],
+                'rerank_scores': [[self._trace_ids(source, [idx])[0], round(float(score), 4)]
+                                  for idx, score in rerank_stats.get('scores', [])],
+                'reranked': self._trace_ids(source, reranked_indices),
+                'warm_pool_drift': None if warm is None else round(pool_drift, 5),
+                'search_ms': round(search_ms, 2),
+                'rerank_ms': round((time.time() - rerank_start) * 1000, 2),
+            })
+        if isinstance(source, MergedCandidates):
+            contexts, window_indices, pages_used = self._merged_contexts(source, reranked_indices, window_size)
+            self._record_trace(trace, window_indices, pages_used, contexts, deadline)
+            self._cache_retrieval(cache_key, contexts, window_indices, pages_used, self._trace_ids(source, reranked_indices),
+                                  deadline, degradations_before)
+            return contexts, window_indices, pages_used
         
         # Track pages from ONLY the top 5 reranked chunks
         top_5_reranked = reranked_indices[:5]  # Get only top 5 chunks
@@ -626,9 +1169,113 @@ class RAGEngine:
         
         print(f"✅ Retrieved {len(contexts)} context chunks")
         print(f"📄 Pages from top 5 most relevant chunks: {pages_used}")
+        self._record_trace(trace, window_indices, pages_used, contexts, deadline)
+        self._cache_retrieval(cache_key, contexts, window_indices, pages_used, self._trace_ids(source, reranked_indices),
+                              deadline, degradations_before)
         return contexts, window_indices, pages_used
+    
+    def _cache_retrieval(self, cache_key: tuple, contexts: list, window_indices, pages_used: list, reranked: list, deadline: Deadline = None, degradations_before: int = 0):
+        """Cache a retrieval (with the reranked chunk ids, for traces of later hits) unless the deadline degraded it."""
+        if deadline is not None and len(deadline.degradations) > degradations_before:
+            return
+        self.retrieval_cache.put(cache_key, (list(contexts), list(window_indices), list(pages_used), list(reranked)))
+    
+    def _warm_pool(self, conversation_id: str, q_emb: np.ndarray, documents: List[str] = None) -> Tuple[Optional[WarmPool], Optional[float]]:
+        """The conversation's previous candidate pool if the query has not drifted from it (single-document search only)."""
+        if not conversation_id or self.conversation_pools is None or documents or self.shard_set is not None:
+            return None, None
+        return self.conversation_pools.lookup(conversation_id, self.document_id(), q_emb)
+    
+    def _retrieve_warm(self, warm: WarmPool, q_emb: np.ndarray, k: int):
+        """Warm pool plus the top hits of a small fresh search, ordered by exact distance to the new query."""
+        _, fresh_indices, _ = self._retrieve(q_emb, self.conversation_delta_k)
+        candidates = list(dict.fromkeys(list(warm.candidates) + fresh_indices))
+        vectors = stored_vectors(self, candidates)
+        distances = np.sum((vectors - np.asarray(q_emb, dtype='float32').reshape(1, -1)) ** 2, axis=1)
+        order = np.argsort(distances)[:max(k, self.conversation_delta_k)]
+        return self, [candidates[i] for i in order], [float(distances[i]) for i in order]
+    
+    def _store_warm_pool(self, conversation_id: str, q_emb: np.ndarray, query_text: str, reranked_indices: List[int], rerank_stats: dict, k: int):
+        """Keep this turn's best candidates and their reranker scores for the conversation's next question."""
+        if self.conversation_pools is None:
+            return
+        scores = dict(rerank_stats.get('scores', [])) if rerank_stats else {}
+        ranked = sorted(scores, key=scores.get, reverse=True) if scores else list(reranked_indices)
+        pool_size = max(k, self.conversation_pool_size)
+        self.conversation_pools.store(conversation_id, WarmPool(self.document_id(), np.asarray(q_emb, dtype='float32'),
+                                                                query_text, ranked[:pool_size], scores))
+    
+    def _start_trace(self, question: str, documents: List[str] = None) -> Optional[dict]:
+        """A retrieval trace for this request, or None when tracing is off or the request is not sampled."""
+        if self.tracer is None:
+            return None
+        return self.tracer.start(question, document_id=self.document_id(), documents=documents,
+                                 refinement_mode=self.refinement_mode, index_encoding=self.index_encoding,
+                                 chunk_max_tokens=self.chunk_max_tokens, num_chunks=len(self.chunks))
+    
+    def _trace_ids(self, source, indices: List[int]) -> list:
+        """Chunk identifiers that stay meaningful offline: indices, or [document, index] for merged hits."""
+        if isinstance(source, MergedCandidates):
+            return [[source.origins[idx][0].document_id, source.origins[idx][1]] for idx in indices]
+        return [int(idx) for idx in indices]
+    
+    def _record_trace(self, trace: Optional[dict], window_indices, pages_used: list, contexts: list, deadline: Deadline = None):
+        """Finish a trace with what was selected and append it to the trace log."""
+        if trace is None:
+            return
+        trace.update({
+            'window_indices': sorted(list(idx) if isinstance(idx, tuple) else idx for idx in window_indices),
+            'pages': pages_used,
+            'prompt_chars': sum(len(context) for context in contexts),
+        })
+        if deadline is not None:
+            trace['degradations'] = deadline.degradations
+        if self.tracer is not None:
+            try:
+                self.tracer.write(trace)
+            except Exception as e:
+                print(f"⚠️ Warning: Failed to write retrieval trace: {str(e)}")
 
-    def _generate_answer(self, original_question: str, refined_question: str, contexts: list, history: list, pages_used: list = None):
+    def _merged_contexts(self, merged: MergedCandidates, reranked_indices: List[int], window_size: int):
+        """Windowed contexts for hits from several documents, grouped by document and labelled with its name."""
+        window_keys = []
+        seen = set()
+        for position in reranked_indices:
+            for shard, idx in merged.window(position, window_size):
+                if (shard.document_id, idx) not in seen:
+                    seen.add((shard.document_id, idx))
+                    window_keys.append((shard, idx))
+        
+        # Keep each document's chunks together and in their original order, most relevant document first
+        document_order = {}
+        for shard, _ in window_keys:
+            document_order.setdefault(shard.document_id, len(document_order))
+        window_keys.sort(key=lambda key: (document_order[key[0].document_id], key[1]))
+        
+        contexts = []
+        previous_document = None
+        for shard, idx in window_keys:
+            chunk_data = shard.chunks[idx]
+            text = chunk_data if isinstance(chunk_data, str) else chunk_data['text']
+            if shard.document_id != previous_document:
+                text = f"[From {shard.name}]\n{text}"
+                previous_document = shard.document_id
+            contexts.append(text)
+        
+        # Cite pages together with their book
+        pages_used = []
+        for position in reranked_indices[:5]:
+            chunk = merged.chunks[position]
+            for page in chunk.get('pages', []):
+                label = f"{chunk['document']} p. {page}"
+                if label not in pages_used:
+                    pages_used.append(label)
+        
+        print(f"✅ Retrieved {len(contexts)} context chunks from {len(document_order)} documents")
+        print(f"📄 Pages from top 5 most relevant chunks: {pages_used}")
+        return contexts, {(shard.document_id, idx) for shard, idx in window_keys}, pages_used
+
+    def _generate_answer(self, original_question: str, refined_question: str, contexts: list, history: list, pages_used: list = None, deadline: Deadline = None):
         """Generate the final answer using the LLM."""
         print(f"✨ Generating answer for question: {original_question[:100]}...")
         if pages_used:
@@ -674,6 +1321,10 @@ class RAGEngine:
             
         # Build the prompt
         context = "\n\n".join(contexts)
+        if deadline is not None and deadline.remaining() < self.answer_reserve and len(context) > self.reduced_context_chars:
+            # A shorter prompt is the last lever left for a late request
+            deadline.degrade("context", "reduced", f"{len(context)} -> {self.reduced_context_chars} chars")
+            context = context[:self.reduced_context_chars]
         
         history_length = len(history_str)
         question_length = len(refined_question)
@@ -718,14 +1369,11 @@ class RAGEngine:
         try:
             start_time = time.time()
             
-            # Use a thread executor with timeout for the Gemini call
-            with ThreadPoolExecutor() as executor:
-                future = executor.submit(self.model.generate_content, prompt)
-                try:
-                    response = future.result(timeout=40)  # 40 second timeout
-                except FuturesTimeoutError:
-                    future.cancel()
-                    raise TimeoutError("Gemini API call timed out after 40 seconds")
+            # The shared LLM client releases us at the deadline even if the request is still running
+            answer_timeout = self.answer_timeout
+            if deadline is not None:
+                answer_timeout = max(1.0, min(answer_timeout, deadline.remaining()))
+            response = self.llm.generate(prompt, timeout=answer_timeout)
 
             end_time = time.time()
             print(f"⏱️ Gemini call took {end_time - start_time:.2f} seconds")
@@ -736,7 +1384,7 @@ class RAGEngine:
         except Exception as e:
             print(f"❌ Gemini API error: {str(e)}")
             # Return a fallback response instead of crashing
-            return f"I apologize, but I encountered an issue generating a response. This might be due to the conversation becoming too long or a timeout. Please try asking your question again, and I'll do my best to help. Error details: {str(e)}"
+            return f"{FALLBACK_ANSWER} This might be due to the conversation becoming too long or a timeout. Please try asking your question again, and I'll do my best to help. Error details: {str(e)}"
         
         # Clean up excessive spacing in the response
         answer = response.text.strip()
@@ -753,24 +1401,111 @@ class RAGEngine:
         print(f"✅ Generated answer with {len(answer)} characters")
         return answer
 
-    def answer_question(self, question: str, k: int = 10, window_size: int = 5, history: list = None) -> str:
+    def answer_question(self, question: str, k: int = 10, window_size: int = 5, history: list = None, deadline: Deadline = None, documents: List[str] = None, conversation_id: str = None) -> str:
         """Answer a question using the RAG pipeline with a sentence window and conversation history."""
         if not self.index or not self.chunks:
             raise ValueError("No PDF has been processed yet. Please upload a PDF first.")
+        self._check_documents(documents)
         if history is None:
             history = []
+        # Popular first-turn questions are answered from the answer cache
+        cached = self.cached_answer(question, history, documents)
+        if cached is not None:
+            print(f"⚡ Answer cache hit for: {question[:100]}")
+            return cached
         try:
             # Step 1: Refine the question for better retrieval
-            refined_question = self._refine_question(question, history)
+            refined_question, query_vector = self._refine_query(question, history, deadline=deadline, documents=documents)
             
             # Step 2: Get relevant contexts
-            contexts, window_indices, pages_used = self._get_contexts(refined_question, k, window_size)
+            contexts, window_indices, pages_used = self._get_contexts(refined_question, k, window_size, deadline=deadline,
+                                                                      query_vector=query_vector, documents=documents,
+                                                                      trace=self._start_trace(question, documents),
+                                                                      conversation_id=conversation_id)
             
             # Step 3: Generate the answer
             print(f"🔍 Generating answer for question")
-            answer = self._generate_answer(question, refined_question, contexts, history, pages_used)
+            answer = self._generate_answer(question, refined_question, contexts, history, pages_used, deadline=deadline)
+            self.store_answer(question, history, documents, answer, deadline)
             
             return answer
         except Exception as e:
             raise RuntimeError(f"Failed to answer question: {str(e)}")
+    
+    def _answer_key(self, question: str, documents: List[str] = None) -> tuple:
+        return (self.document_id(), normalize_question(question), tuple(sorted(documents or [])))
+    
+    def cached_answer(self, question: str, history: list = None, documents: List[str] = None) -> Optional[str]:
+        """A cached answer to a first-turn question, if any (follow-ups depend on their history)."""
+        if history:
+            return None
+        return self.answer_cache.get(self._answer_key(question, documents))
+    
+    def store_answer(self, question: str, history: list, documents: List[str], answer: str, deadline: Deadline = None):
+        """Cache a first-turn answer unless it is a fallback or the deadline degraded it."""
+        if history or answer.startswith(FALLBACK_ANSWER) or (deadline is not None and deadline.degradations):
+            return
+        self.answer_cache.put(self._answer_key(question, documents), answer)
+    
+    def record_query(self, question: str, history: list = None, documents: List[str] = None):
+        """Count a live first-turn question in the per-document query log used for prewarming."""
+        if self.query_log is None or history or documents:
+            return
+        try:
+            self.query_log.record(self.document_id(), question)
+        except Exception as e:
+            print(f"⚠️ Warning: Failed to record query: {str(e)}")
+    
+    def save_query_log(self):
+        """Write out questions recorded since the last periodic save (called on shutdown)."""
+        if self.query_log is not None:
+            self.query_log.save()
+    
+    def enable_prewarm(self):
+        """Log frequent questions and re-ask them in the background now and after every index swap."""
+        log_path = os.getenv("RAG_QUERY_LOG", os.path.join(self.library_dir or self.data_dir, "query_log.json"))
+        self.query_log = QueryLog(log_path, max_questions=int(os.getenv("RAG_QUERY_LOG_SIZE", "500")))
+        self.prewarmer = Prewarmer(
+            self._prewarm_question,
+            self.query_log,
+            top_n=int(os.getenv("RAG_PREWARM_TOP", "50")),
+            interval=float(os.getenv("RAG_PREWARM_INTERVAL", "1.0")),
+            idle_seconds=float(os.getenv("RAG_PREWARM_IDLE_SECONDS", "2.0")),
+        )
+        self._start_prewarm()
+    
+    @contextmanager
+    def live_request(self):
+        """Mark live traffic, so prewarming backs off, and keep the serving thread on the query thread budget."""
+        # An upload may be running with the ingest budget; this thread's torch/FAISS pools stay narrow
+        use_thread_workload("query")
+        with (self.prewarmer.live_request() if self.prewarmer is not None else nullcontext()):
+            yield
+    
+    def _index_swapped(self):
+        """A new document is loaded: drop conversation pools of the old one and refill the caches."""
+        if self.conversation_pools is not None:
+            self.conversation_pools.clear()
+        self._start_prewarm()
+    
+    def _start_prewarm(self):
+        if self.prewarmer is None or self.index is None:
+            return
+        self.prewarmer.start(self.document_id(), warmup_fn=self._warm_models)
+    
+    def _warm_models(self):
+        """One embedder and reranker forward pass, so the first live request does not pay for lazy initialization."""
+        self.embedder.encode(["warm up"], convert_to_numpy=True, batch_size=1)
+        if self.chunks:
+            self._score_candidates("warm up", [0])
+    
+    def _prewarm_question(self, question: str):
+        """Answer a logged question to refill the caches; without Gemini only embeddings and retrieval are warmed."""
+        if self.prewarm_answers and self.llm is not None:
+            self.answer_question(question, deadline=self.new_deadline())
+            return
+        refined_question, query_vector = question, None
+        if self.refinement_mode != "llm":
+            refined_question, query_vector = self._refine_query(question, [])
+        self._get_contexts(refined_question, query_vector=query_vector)
 
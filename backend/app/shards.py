@@ -0,0 +1,187 @@
+import heapq
+import json
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from .artifacts import read_manifest
+from .page_index import PageIndex
+from .passage_store import PassageStore
+from .query_expansion import document_frequencies
+
+
+def stored_vectors(source, chunk_indices: List[int]) -> np.ndarray:
+    """Stored vectors of chunks: the memory-mapped full-precision copy, or decoded from the index."""
+    if source.full_vectors is not None:
+        return np.asarray(source.full_vectors[chunk_indices], dtype='float32')
+    return np.vstack([source.index.reconstruct(int(idx)) for idx in chunk_indices])
+
+
+class Shard:
+    """Search state of one library document: its index, chunks and optional side artifacts."""
+
+    def __init__(self, path: str, manifest: Dict, index, chunks: List, full_vectors=None,
+                 page_index: Optional[PageIndex] = None, passage_store: Optional[PassageStore] = None):
+        self.path = path
+        self.manifest = manifest or {}
+        self.index = index
+        self.chunks = chunks
+        self.full_vectors = full_vectors
+        self.page_index = page_index
+        self.passage_store = passage_store
+        self._term_frequencies = None
+
+    def term_frequencies(self) -> Counter:
+        """Document frequency of every term over this document's chunks, computed once."""
+        if self._term_frequencies is None:
+            self._term_frequencies = document_frequencies(
+                [chunk if isinstance(chunk, str) else chunk['text'] for chunk in self.chunks]
+            )
+        return self._term_frequencies
+
+    @property
+    def document_id(self) -> str:
+        return self.manifest.get('content_hash') or os.path.basename(self.path)
+
+    @property
+    def name(self) -> str:
+        return self.manifest.get('document') or self.document_id
+
+    @classmethod
+    def load(cls, path: str, tokenizer=None) -> "Shard":
+        """
+        Load one artifact directory; embeddings are memory-mapped, not read into RAM.
+
+        Pre-tokenized passages are only kept if they were produced by the given reranker tokenizer.
+        """
+        index = faiss.read_index(os.path.join(path, "large_context_index.faiss"))
+        with open(os.path.join(path, "chunks.json"), 'r') as f:
+            chunks = json.load(f)
+        vectors_path = os.path.join(path, "embeddings.npy")
+        full_vectors = np.load(vectors_path, mmap_mode='r') if os.path.exists(vectors_path) else None
+        page_index_path = os.path.join(path, "page_index.npz")
+        page_index = PageIndex.load(page_index_path) if os.path.exists(page_index_path) else None
+        store_path = os.path.join(path, "chunk_tokens.npz")
+        passage_store = PassageStore.load(store_path) if os.path.exists(store_path) else None
+        if passage_store is not None and not passage_store.matches(tokenizer, len(chunks)):
+            passage_store = None
+        return cls(path, read_manifest(path), index, chunks, full_vectors, page_index, passage_store)
+
+    def matches(self, selector: str) -> bool:
+        return selector in (self.document_id, self.name)
+
+
+def check_same_metric(shards: List[Shard], shard: Shard):
+    """Raise ValueError if a shard's index measures distance differently from the others."""
+    for other in shards:
+        if other.index.metric_type != shard.index.metric_type:
+            raise ValueError(f"{shard.name} uses FAISS metric {shard.index.metric_type}, "
+                             f"but {other.name} uses {other.index.metric_type}; their distances cannot be merged")
+
+
+class MergedCandidates:
+    """
+    Top hits gathered from several shards, addressable by position like a single document.
+
+    Exposes chunks, passage_store and full_vectors for the merged positions, so reranking
+    and query expansion work on it exactly as on one document.
+    """
+
+    def __init__(self, hits: List[Tuple[float, Shard, int]]):
+        self.origins = [(shard, idx) for _, shard, idx in hits]
+        self.distances = [dist for dist, _, _ in hits]
+        self.chunks = []
+        for shard, idx in self.origins:
+            chunk = shard.chunks[idx]
+            if isinstance(chunk, str):
+                chunk = {'text': chunk, 'pages': []}
+            self.chunks.append({**chunk, 'document': shard.name})
+        if all(shard.passage_store is not None for shard, _ in self.origins):
+            self.passage_store = [shard.passage_store[idx] for shard, idx in self.origins]
+        else:
+            self.passage_store = None
+        self._vectors = None
+
+    @property
+    def full_vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            if self.origins:
+                self._vectors = np.vstack([stored_vectors(shard, [idx]) for shard, idx in self.origins])
+            else:
+                self._vectors = np.zeros((0, 0), dtype='float32')
+        return self._vectors
+
+    def window(self, position: int, window_size: int) -> List[Tuple[Shard, int]]:
+        """Neighbouring chunks of a hit within its own document."""
+        shard, idx = self.origins[position]
+        start = max(0, idx - window_size)
+        end = min(len(shard.chunks), idx + window_size + 1)
+        return [(shard, i) for i in range(start, end)]
+
+
+class ShardSet:
+    """Several per-document indexes searched in parallel and merged by distance."""
+
+    def __init__(self, shards: List[Shard], max_workers: int = 8):
+        self.shards = shards
+        # FAISS releases the GIL during search, so shards are searched concurrently
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="shard-search")
+        # Summed term statistics per selection of documents, for key-term expansion across shards
+        self._term_stats: Dict[Tuple[str, ...], Tuple[Counter, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def add(self, shard: Shard):
+        """Add or replace (by document id) a shard; it must measure distance like the others."""
+        others = [s for s in self.shards if s.document_id != shard.document_id]
+        check_same_metric(others, shard)
+        self.shards = others + [shard]
+        with self._lock:
+            self._term_stats.clear()
+
+    def term_statistics(self, documents: Optional[List[str]] = None) -> Tuple[Counter, int]:
+        """Document frequencies summed over the selected shards, and their total number of chunks."""
+        shards = self.select(documents)
+        key = tuple(sorted(shard.document_id for shard in shards))
+        with self._lock:
+            cached = self._term_stats.get(key)
+        if cached is not None:
+            return cached
+        df = Counter()
+        for shard in shards:
+            df.update(shard.term_frequencies())
+        stats = (df, sum(len(shard.chunks) for shard in shards))
+        with self._lock:
+            self._term_stats[key] = stats
+        return stats
+
+    def select(self, documents: Optional[List[str]] = None) -> List[Shard]:
+        """Shards matching any of the given content hashes or file names (all when None)."""
+        if not documents:
+            return list(self.shards)
+        selected = [shard for shard in self.shards if any(shard.matches(d) for d in documents)]
+        if not selected:
+            raise ValueError(f"None of the requested documents are loaded: {', '.join(documents)}")
+        return selected
+
+    def search(self, search_fn: Callable[[Shard, np.ndarray, int], Tuple[np.ndarray, np.ndarray]],
+               q_emb: np.ndarray, k: int, documents: Optional[List[str]] = None) -> MergedCandidates:
+        """Scatter the query to every selected shard, then keep the k closest hits overall."""
+        shards = self.select(documents)
+        futures = [(shard, self.executor.submit(search_fn, shard, q_emb, k)) for shard in shards]
+        hits = []
+        for shard, future in futures:
+            D, I = future.result()
+            hits.extend((float(dist), shard, int(idx)) for idx, dist in zip(I[0], D[0]) if 0 <= idx < len(shard.chunks))
+        return MergedCandidates(heapq.nsmallest(k, hits, key=lambda hit: hit[0]))
+
+    def names(self) -> List[Dict]:
+        return [{'document': shard.name, 'content_hash': shard.document_id, 'chunks': len(shard.chunks)}
+                for shard in self.shards]
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import json
+import re
+from typing import AsyncIterator, Awaitable, Callable, Dict
+
+
+def normalize_question(question: str) -> str:
+    """Lower-cased question with whitespace collapsed and trailing punctuation removed."""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+
+def question_key(document_id: str, question: str, history: list, *extra) -> str:
+    """
+    Key identifying identical work: same document, normalized question and history.
+
+    Questions are compared case-insensitively with whitespace collapsed and trailing
+    punctuation removed; history is reduced to a digest of its roles and contents.
+    """
+    normalized = normalize_question(question)
+    turns = []
+    for msg in history or []:
+        role = msg.get('role', '') if isinstance(msg, dict) else getattr(msg, 'role', '')
+        content = msg.get('content', '') if isinstance(msg, dict) else getattr(msg, 'content', '')
+        turns.append([role, content])
+    history_digest = hashlib.sha1(json.dumps(turns).encode()).hexdigest()
+    return "|".join([str(document_id), normalized, history_digest, *map(str, extra)])
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight execution."""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        """Run fn for the first caller with this key; later callers await the same result."""
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            # A separate task, so one caller disconnecting does not cancel the work for everyone
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+
+class _Channel:
+    """One running event stream whose events are buffered and fanned out to every subscriber."""
+
+    def __init__(self, stream: AsyncIterator[str]):
+        self.events = []
+        self.done = False
+        self.condition = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(stream))
+
+    async def _pump(self, stream: AsyncIterator[str]):
+        try:
+            async for event in stream:
+                async with self.condition:
+                    self.events.append(event)
+                    self.condition.notify_all()
+        finally:
+            async with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """Replay the events so far, then follow the stream until it ends."""
+        position = 0
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: position < len(self.events) or self.done)
+                new_events = self.events[position:]
+                finished = self.done
+            for event in new_events:
+                yield event
+            position += len(new_events)
+            if finished and position >= len(self.events):
+                return
+
+
+class StreamFlight:
+    """Concurrent streaming requests with the same key subscribe to one running stream."""
+
+    def __init__(self):
+        self._inflight: Dict[str, _Channel] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def subscribe(self, key: str, make_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        channel = self._inflight.get(key)
+        if channel is None:
+            self.leaders += 1
+            channel = _Channel(make_stream())
+            self._inflight[key] = channel
+            channel.task.add_done_callback(lambda _, key=key, channel=channel: self._forget(key, channel))
+        else:
+            self.coalesced += 1
+        return channel.subscribe()
+
+    def _forget(self, key: str, channel: _Channel):
+        if self._inflight.get(key) is channel:
+            del self._inflight[key]
+        if not channel.task.cancelled():
+            channel.task.exception()
@@ -0,0 +1,135 @@
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+import faiss
+import torch
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # optional: only used to size numpy's BLAS pool
+    threadpool_limits = None
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """CPU quota (in cores) imposed by cgroups v2 or v1, or None if unlimited."""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    for base in ("/sys/fs/cgroup/cpu", "/sys/fs/cgroup/cpu,cpuacct"):
+        try:
+            with open(os.path.join(base, "cpu.cfs_quota_us")) as f:
+                quota = int(f.read())
+            with open(os.path.join(base, "cpu.cfs_period_us")) as f:
+                period = int(f.read())
+            if quota > 0 and period > 0:
+                return quota / period
+            return None
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def available_cpus() -> int:
+    """Cores this process may actually use: CPU affinity capped by any cgroup quota."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return max(1, cpus)
+
+
+def workload_threads(workload: str) -> int:
+    """
+    Intra-op threads for a workload.
+
+    ingest: wide - one bulk job should use every available core
+    query:  narrow - many concurrent requests share the cores
+    """
+    cpus = available_cpus()
+    if workload == "ingest":
+        return int(os.getenv("RAG_INGEST_THREADS", str(cpus)))
+    if workload == "query":
+        return int(os.getenv("RAG_QUERY_THREADS", str(max(1, cpus // 4))))
+    raise ValueError(f"Unknown workload '{workload}', expected 'ingest' or 'query'")
+
+
+_lock = threading.Lock()
+_blas_limits = None
+current_workload = None
+
+# Ingest blocks running right now; the process goes back to the query workload when the last ends
+_active_ingests = 0
+_ingest_lock = threading.Lock()
+_thread_state = threading.local()
+
+
+def apply_workload(workload: str) -> int:
+    """Set torch, FAISS, BLAS and tokenizer parallelism for a workload. Returns the thread count."""
+    global _blas_limits, current_workload
+    threads = workload_threads(workload)
+    with _lock:
+        torch.set_num_threads(threads)
+        faiss.omp_set_num_threads(threads)
+        # Rust tokenizers read this on every batch; batched tokenization only pays off for bulk work
+        os.environ["TOKENIZERS_PARALLELISM"] = "true" if workload == "ingest" and threads > 1 else "false"
+        if threadpool_limits is not None:
+            if _blas_limits is not None:
+                _blas_limits.restore_original_limits()
+            _blas_limits = threadpool_limits(limits=threads, user_api="blas")
+        current_workload = workload
+    _thread_state.workload = workload
+    print(f"🧵 Threading for {workload} workload: {threads} threads ({available_cpus()} CPUs available)")
+    return threads
+
+
+def use_thread_workload(workload: str):
+    """
+    Size the OpenMP pools (torch, FAISS) used by the calling thread for a workload.
+
+    OpenMP thread counts are per calling thread, so a request worker keeps the query
+    budget even while an upload runs on another thread with the ingest budget.
+    BLAS limits and tokenizer parallelism stay process-wide.
+    """
+    if getattr(_thread_state, 'workload', None) == workload:
+        return
+    threads = workload_threads(workload)
+    torch.set_num_threads(threads)
+    faiss.omp_set_num_threads(threads)
+    _thread_state.workload = workload
+
+
+@contextmanager
+def workload(name: str):
+    """
+    Run a block (an ingest) with a workload's threading settings.
+
+    Overlapping blocks are reference counted: the process switches to the workload when
+    the first starts and back to the query workload when the last one ends, whatever
+    order they finish in.
+    """
+    global _active_ingests
+    with _ingest_lock:
+        _active_ingests += 1
+        if _active_ingests == 1:
+            apply_workload(name)
+    use_thread_workload(name)
+    try:
+        yield
+    finally:
+        with _ingest_lock:
+            _active_ingests -= 1
+            if _active_ingests == 0:
+                apply_workload("query")
+        use_thread_workload("query")
@@ -0,0 +1,189 @@
+"""
+Replay captured retrieval traces against other engine settings or index snapshots, offline.
+
+Usage (from the backend directory):
+    python -m app.trace_replay traces/retrieval.trace --set k=5 --set max_rerank_candidates=50
+    python -m app.trace_replay traces/retrieval.trace --data-dir snapshots/chunk200 --out replay.json
+    python -m app.trace_replay traces/retrieval.trace --set index_encoding=sq8 --set refinement_mode=rocchio
+
+Traces are captured by the server with RAG_TRACE_SAMPLE_RATE. Every trace is replayed
+from its refined question and recorded query vector, so no Gemini call is made; only the
+local refinement modes (rocchio, rocchio_terms) can be replayed from the raw question.
+Traces of retrieval-cache hits are marked cached and replayed in full like the others.
+Each trace is run twice on the same engine, once as loaded and once with the --set
+overrides, and compared with what production selected: latency, overlap of the
+reranked chunks and cited pages, and prompt size.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from .rag import RAGEngine
+from .traces import read_traces
+from .prewarm import LRUCache
+from .vector_store import build_index, INDEX_ENCODINGS
+
+# Settings that can be overridden; k and window_size are per-call arguments, the rest engine attributes
+CALL_SETTINGS = ("k", "window_size")
+ENGINE_SETTINGS = (
+    "max_rerank_candidates", "cascade_enabled", "cascade_distance_margin", "cascade_max_survivors",
+    "cascade_batch_size", "cascade_patience", "exact_rescore", "rescore_factor", "hierarchical_min_chunks",
+    "coarse_pages", "index_encoding", "refinement_mode", "rocchio_docs", "rocchio_beta", "expansion_terms",
+)
+
+
+def parse_overrides(pairs: list, engine: RAGEngine) -> dict:
+    """Parse key=value pairs, converting values to the type of the current setting."""
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        if key in CALL_SETTINGS:
+            overrides[key] = int(value)
+        elif key in ENGINE_SETTINGS:
+            current = getattr(engine, key)
+            if isinstance(current, bool):
+                overrides[key] = value.lower() in ("1", "true", "yes")
+            else:
+                overrides[key] = type(current)(value)
+        else:
+            raise SystemExit(f"Unknown setting '{key}'. Supported: {', '.join(CALL_SETTINGS + ENGINE_SETTINGS)}")
+    if overrides.get("index_encoding") and overrides["index_encoding"] not in INDEX_ENCODINGS:
+        raise SystemExit(f"index_encoding must be one of {', '.join(INDEX_ENCODINGS)}")
+    if overrides.get("refinement_mode") == "llm":
+        raise SystemExit("Replay is offline; refinement_mode can only be rocchio or rocchio_terms")
+    return overrides
+
+
+def _key(chunk_id) -> tuple:
+    return tuple(chunk_id) if isinstance(chunk_id, list) else (chunk_id,)
+
+
+def overlap(replayed: list, recorded: list) -> float:
+    """Fraction of the recorded items the replay also selected."""
+    if not recorded:
+        return 1.0
+    return len({_key(x) for x in replayed} & {_key(x) for x in recorded}) / len(recorded)
+
+
+def replay_one(engine: RAGEngine, record: dict, vector, settings: dict) -> dict:
+    """Re-run retrieval for one trace with the given settings, returning the new trace."""
+    k = settings.get("k", record['k'])
+    window_size = settings.get("window_size", record['window_size'])
+    refined_question = record['refined_question']
+    query_vector = vector
+
+    start = time.perf_counter()
+    if settings.get("refinement_mode") in ("rocchio", "rocchio_terms"):
+        # Local refinement can be replayed from the raw question
+        refined_question, query_vector = engine._expand_locally(record['question'], record.get('documents'))
+    elif query_vector is None:
+        query_vector = engine._embed_query(refined_question)
+    trace = {}
+    engine._get_contexts(refined_question, k=k, window_size=window_size, query_vector=query_vector,
+                         documents=record.get('documents'), trace=trace)
+    trace['total_ms'] = (time.perf_counter() - start) * 1000
+    return trace
+
+
+def summarize(rows: list, label: str) -> dict:
+    def mean(key):
+        values = [row[key] for row in rows if row.get(key) is not None]
+        return round(float(np.mean(values)), 3) if values else None
+
+    def p95(key):
+        values = [row[key] for row in rows if row.get(key) is not None]
+        return round(float(np.percentile(values, 95)), 3) if values else None
+
+    return {
+        'label': label,
+        'traces': len(rows),
+        'latency_ms_mean': mean('total_ms'),
+        'latency_ms_p95': p95('total_ms'),
+        'chunk_overlap': mean('chunk_overlap'),
+        'page_overlap': mean('page_overlap'),
+        'prompt_chars_mean': mean('prompt_chars'),
+        'prompt_chars_change': mean('prompt_chars_change'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay retrieval traces offline against other settings")
+    parser.add_argument("trace_log", help="Binary trace log written with RAG_TRACE_SAMPLE_RATE")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="Setting to change for the candidate run (repeatable)")
+    parser.add_argument("--data-dir", help="Index snapshot (artifact directory) to replay against")
+    parser.add_argument("--limit", type=int, help="Replay at most this many traces")
+    parser.add_argument("--out", help="Write per-trace results and the summary to this JSON file")
+    args = parser.parse_args()
+
+    engine = RAGEngine(load_llm=False, data_dir=args.data_dir)
+    if engine.index is None:
+        raise SystemExit("No processed index found to replay against")
+    engine.tracer = None  # Replays must not append to a trace log
+    engine.retrieval_cache = LRUCache(0)  # Every run must really search and rerank
+    overrides = parse_overrides(args.overrides, engine)
+    # Chunk ids are only comparable when the snapshot was chunked exactly like production
+    same_chunks_expected = len(engine.chunks)
+
+    baseline_settings = {key: getattr(engine, key) for key in ENGINE_SETTINGS}
+    baseline_index = engine.index
+    candidate_index = None
+    if overrides.get("index_encoding") and overrides["index_encoding"] != engine.index_encoding:
+        if engine.full_vectors is None:
+            raise SystemExit("Re-encoding the index needs embeddings.npy in the snapshot")
+        print(f"🗜️ Building {overrides['index_encoding']} index for the candidate run...")
+        candidate_index = build_index(np.asarray(engine.full_vectors, dtype='float32'), overrides["index_encoding"])
+
+    runs = {'baseline': [], 'candidate': []} if overrides else {'baseline': []}
+    for number, (record, vector) in enumerate(read_traces(args.trace_log)):
+        if args.limit and number >= args.limit:
+            break
+        if 'refined_question' not in record:
+            continue
+        for label in runs:
+            settings = overrides if label == 'candidate' else {}
+            for key in ENGINE_SETTINGS:
+                setattr(engine, key, settings.get(key, baseline_settings[key]))
+            engine.index = candidate_index if (label == 'candidate' and candidate_index is not None) else baseline_index
+            trace = replay_one(engine, record, vector, settings)
+
+            comparable = record.get('num_chunks') == same_chunks_expected and record.get('documents') is None
+            row = {
+                'question': record['question'],
+                'total_ms': trace['total_ms'],
+                'recorded_ms': (record.get('search_ms') or 0) + (record.get('rerank_ms') or 0),
+                'recorded_cached': bool(record.get('cached')),
+                'chunk_overlap': overlap(trace['reranked'], record['reranked']) if comparable else None,
+                'page_overlap': overlap(trace['pages'], record['pages']),
+                'prompt_chars': trace['prompt_chars'],
+                'prompt_chars_change': (trace['prompt_chars'] - record['prompt_chars']) / max(1, record['prompt_chars']),
+            }
+            runs[label].append(row)
+
+    for key in ENGINE_SETTINGS:
+        setattr(engine, key, baseline_settings[key])
+    engine.index = baseline_index
+
+    if not runs['baseline']:
+        raise SystemExit(f"No replayable traces in {args.trace_log}")
+    summaries = {label: summarize(rows, label) for label, rows in runs.items()}
+    recorded_ms = [row['recorded_ms'] for row in runs['baseline']]
+    cached = sum(1 for row in runs['baseline'] if row['recorded_cached'])
+    print(f"\n📊 Replayed {len(runs['baseline'])} traces (recorded retrieval mean {np.mean(recorded_ms):.1f} ms, "
+          f"{cached} served from the retrieval cache in production)")
+    if overrides:
+        print(f"   candidate overrides: {overrides}")
+    for summary in summaries.values():
+        chunk = f"{summary['chunk_overlap']:.3f}" if summary['chunk_overlap'] is not None else "n/a (different chunking)"
+        print(f"   {summary['label']:<9} latency mean {summary['latency_ms_mean']:.1f} ms, p95 {summary['latency_ms_p95']:.1f} ms, "
+              f"chunk overlap {chunk}, page overlap {summary['page_overlap']:.3f}, "
+              f"prompt {summary['prompt_chars_mean']:.0f} chars ({summary['prompt_chars_change']:+.1%} vs recorded)")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({'overrides': overrides, 'data_dir': args.data_dir, 'summary': summaries, 'runs': runs}, f, indent=2)
+        print(f"💾 Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
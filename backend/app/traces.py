@@ -0,0 +1,73 @@
+import json
+import os
+import random
+import struct
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+# Record header: magic, JSON length in bytes, vector length in float32 values
+_MAGIC = b"RTR1"
+_HEADER = struct.Struct("<4sII")
+
+
+def encode_record(record: Dict, vector: Optional[np.ndarray] = None) -> bytes:
+    """One length-prefixed record: header, JSON payload, raw float32 query vector."""
+    payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+    vector_bytes = b"" if vector is None else np.asarray(vector, dtype="<f4").reshape(-1).tobytes()
+    return _HEADER.pack(_MAGIC, len(payload), len(vector_bytes) // 4) + payload + vector_bytes
+
+
+def read_traces(path: str) -> Iterator[Tuple[Dict, Optional[np.ndarray]]]:
+    """Yield (record, query vector) pairs; a partially written last record is ignored."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            magic, payload_len, vector_len = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise ValueError(f"Corrupt trace log {path} at byte {f.tell() - _HEADER.size}")
+            payload = f.read(payload_len)
+            vector_bytes = f.read(vector_len * 4)
+            if len(payload) < payload_len or len(vector_bytes) < vector_len * 4:
+                return
+            vector = np.frombuffer(vector_bytes, dtype="<f4").reshape(1, -1) if vector_len else None
+            yield json.loads(payload), vector
+
+
+class TraceWriter:
+    """
+    Sampled retrieval traces appended to a binary log.
+
+    Each record is written with a single O_APPEND write, so concurrent requests (and
+    several worker processes sharing the file) never interleave partial records.
+    """
+
+    def __init__(self, path: str, sample_rate: float):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.written = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def start(self, question: str, **fields) -> Optional[Dict]:
+        """A new trace for this request, or None when it is not sampled."""
+        if random.random() >= self.sample_rate:
+            return None
+        return {'timestamp': time.time(), 'question': question, **fields}
+
+    def write(self, trace: Dict):
+        """Append a finished trace; its 'vector' entry is stored as raw float32."""
+        trace = dict(trace)
+        vector = trace.pop('vector', None)
+        data = encode_record(trace, vector)
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            self.written += 1
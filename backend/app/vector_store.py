@@ -0,0 +1,100 @@
+import math
+import faiss
+import numpy as np
+from typing import Optional, Tuple
+
+# Supported on-disk encodings for the chunk vector index
+# flat: exact float32 vectors (4 * d bytes per vector)
+# fp16: half-precision scalar quantizer (2 * d bytes per vector)
+# sq8:  8-bit scalar quantizer (d bytes per vector)
+# pq:   product quantizer (pq_subquantizers bytes per vector)
+INDEX_ENCODINGS = ("flat", "fp16", "sq8", "pq")
+
+
+def _pq_subquantizers(d: int, requested: Optional[int] = None) -> int:
+    """Pick the largest divisor of d that does not exceed the requested sub-quantizer count."""
+    m = requested or max(1, d // 8)
+    m = min(m, d)
+    while d % m:
+        m -= 1
+    return m
+
+
+def build_index(embeddings: np.ndarray, encoding: str = "flat", pq_subquantizers: Optional[int] = None) -> faiss.Index:
+    """Build an L2 index over normalized embeddings using the requested encoding."""
+    encoding = (encoding or "flat").lower()
+    if encoding not in INDEX_ENCODINGS:
+        raise ValueError(f"Unknown index encoding '{encoding}', expected one of {INDEX_ENCODINGS}")
+
+    n, d = embeddings.shape
+
+    if encoding == "pq":
+        # k-means wants ~39 training points per centroid; shrink the codebook
+        # for small corpora and fall back to sq8 when even that is not possible
+        nbits = min(8, int(math.log2(n / 39))) if n >= 39 else 0
+        if nbits < 4:
+            print(f"⚠️ Only {n} vectors, too few to train PQ - falling back to sq8")
+            encoding = "sq8"
+        else:
+            m = _pq_subquantizers(d, pq_subquantizers)
+            index = faiss.IndexPQ(d, m, nbits, faiss.METRIC_L2)
+
+    if encoding == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif encoding == "fp16":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif encoding == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def bytes_per_vector(index: faiss.Index) -> float:
+    """Return the stored code size per vector for an index."""
+    if isinstance(index, faiss.IndexFlatCodes):
+        return float(index.code_size)
+    if index.ntotal == 0:
+        return 0.0
+    return faiss.serialize_index(index).nbytes / index.ntotal
+
+
+def search_index(index: faiss.Index, queries: np.ndarray, k: int, full_vectors: Optional[np.ndarray] = None,
+                 rescore_factor: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search an index, optionally re-scoring the top candidates against full-precision vectors.
+
+    Args:
+        index: The (possibly compressed) FAISS index
+        queries: Query vectors, shape (nq, d)
+        k: Number of results to return per query
+        full_vectors: Full-precision vectors aligned with the index ids (may be an mmap'd array)
+        rescore_factor: How many more candidates than k to fetch from the index before re-scoring
+
+    Returns:
+        Distances and ids with the same layout as faiss.Index.search
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    if full_vectors is None or isinstance(index, faiss.IndexFlat):
+        return index.search(queries, k)
+
+    candidate_k = min(index.ntotal, max(k, k * rescore_factor))
+    _, candidates = index.search(queries, candidate_k)
+
+    distances = np.full((len(queries), k), np.inf, dtype='float32')
+    ids = np.full((len(queries), k), -1, dtype='int64')
+
+    for row, query in enumerate(queries):
+        # Sorting the ids keeps reads from an mmap'd file sequential
+        candidate_ids = np.sort(candidates[row][candidates[row] >= 0])
+        if len(candidate_ids) == 0:
+            continue
+        vectors = np.asarray(full_vectors[candidate_ids], dtype='float32')
+        exact = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(exact)[:k]
+        distances[row, :len(order)] = exact[order]
+        ids[row, :len(order)] = candidate_ids[order]
+
+    return distances, ids
@@ -0,0 +1,20 @@
+import pytest
+
+from app.artifacts import ARTIFACT_FORMAT_VERSION, check_compatible
+
+
+def manifest(**fields):
+    return {'format_version': ARTIFACT_FORMAT_VERSION, 'embedding_model': "bge", 'embedding_dim': 384, **fields}
+
+
+def test_index_encoding_must_match_when_requested():
+    check_compatible(manifest(index_encoding="sq8"), "bge", 384)
+    check_compatible(manifest(index_encoding="sq8"), "bge", 384, index_encoding="sq8")
+    with pytest.raises(ValueError):
+        check_compatible(manifest(index_encoding="pq"), "bge", 384, index_encoding="flat")
+
+
+def test_manifests_without_an_encoding_are_flat():
+    check_compatible(manifest(), "bge", 384, index_encoding="flat")
+    with pytest.raises(ValueError):
+        check_compatible(manifest(), "bge", 384, index_encoding="sq8")
@@ -0,0 +1,115 @@
+from app.dedup import drop_near_duplicates, near_duplicates, simhash, strip_boilerplate
+
+GAS = ("The internal energy of an ideal gas depends only on its temperature, so in an isothermal "
+       "expansion all the heat absorbed is converted into work done on the surroundings. For a reversible "
+       "process the work is the integral of pressure over volume, which for an ideal gas gives nRT times "
+       "the logarithm of the volume ratio. Real gases deviate from this result at high pressure, where "
+       "intermolecular forces and the finite size of molecules both matter.")
+CELLS = ("Mitosis is the process by which a eukaryotic cell divides its duplicated chromosomes into two "
+         "identical nuclei before cytokinesis splits the cytoplasm. Each daughter cell receives one copy of "
+         "every chromosome, and checkpoints halt the cycle when the spindle is not attached correctly.")
+
+
+def bit_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def make_pages(n=10):
+    pages = []
+    for i in range(1, n + 1):
+        pages.append("\n".join([
+            f"Chapter 2. Thermodynamics {100 + i}",
+            f"Example 2.{i}",
+            f"The internal energy of sample {i} changes as heat flows in.",
+            "x",
+            "=",
+            "2",
+            f"(2.{10 + i})",
+            f"Figure 2.{i}: Pressure against volume for cycle {i}.",
+            "Copyright 2020 Example Press. All rights reserved.",
+            str(100 + i),
+        ]))
+    return pages
+
+
+def test_running_headers_page_numbers_and_copyright_are_removed():
+    cleaned, stats = strip_boilerplate(make_pages())
+    for page in cleaned:
+        assert "Chapter 2. Thermodynamics" not in page
+        assert "Copyright" not in page
+        assert not page.rstrip().endswith(("101", "102", "110"))
+    assert stats['boilerplate_lines_removed'] == 30
+
+
+def test_math_fragments_and_numbered_captions_are_kept():
+    pages = make_pages()
+    cleaned, _ = strip_boilerplate(pages)
+    for i, page in enumerate(cleaned, 1):
+        lines = page.splitlines()
+        assert ["x", "=", "2"] == [line for line in lines if line in ("x", "=", "2")]
+        assert f"Example 2.{i}" in lines
+        assert f"(2.{10 + i})" in lines
+        assert f"Figure 2.{i}: Pressure against volume for cycle {i}." in lines
+        assert f"The internal energy of sample {i} changes as heat flows in." in lines
+
+
+def test_repeated_first_sentence_with_different_numbers_is_kept():
+    pages = [f"Consider a mass of {i} kg on a spring.\nIts period depends on the stiffness k{i}.\n"
+             f"Solve for the amplitude A{i}.\nThe answer follows from energy conservation with E = {i} J."
+             for i in range(10)]
+    cleaned, stats = strip_boilerplate(pages)
+    assert cleaned == pages
+    assert stats['boilerplate_lines_removed'] == 0
+
+
+def test_simhash_ignores_case_spacing_and_punctuation():
+    reflowed = GAS.upper().replace(". ", ".\n").replace(",", " ,")
+    assert simhash(GAS) == simhash(reflowed)
+    assert 0 <= simhash(GAS) < 2 ** 64
+
+
+def test_simhash_keeps_near_duplicates_close_and_distinct_passages_apart():
+    edited = GAS.replace("surroundings", "environment")
+    assert bit_distance(simhash(GAS), simhash(edited)) <= 6
+    assert bit_distance(simhash(GAS), simhash(CELLS)) >= 20
+
+
+def test_near_duplicates_point_at_the_earliest_kept_signature():
+    # Three bits apart, one in each of three 16-bit bands: the fourth band collides exactly
+    close = (1 << 0) | (1 << 16) | (1 << 32)
+    assert near_duplicates([0, close, 0], max_distance=3) == {1: 0, 2: 0}
+
+
+def test_band_collision_alone_does_not_make_a_duplicate():
+    # Same lowest band, but 48 bits apart elsewhere
+    assert near_duplicates([0, 0xFFFFFFFFFFFF0000], max_distance=3) == {}
+    # Four bits apart is over the limit even though three bands collide
+    assert near_duplicates([0, 0b1111], max_distance=3) == {}
+
+
+def test_duplicates_are_not_used_as_originals():
+    # 0b111111 is within 3 bits of the duplicate 0b111 but 6 bits from the kept chunk
+    assert near_duplicates([0, 0b111, 0b111111], max_distance=3) == {1: 0}
+
+
+def test_drop_near_duplicates_merges_pages_into_the_kept_chunk():
+    chunks = [
+        {'text': GAS, 'pages': [3]},
+        {'text': CELLS, 'pages': [4]},
+        {'text': GAS.upper(), 'pages': [12, 2]},
+        {'text': CELLS.replace(". ", ".\n"), 'pages': [4, 40]},
+    ]
+    kept, stats = drop_near_duplicates(chunks, max_distance=3)
+    assert [chunk['text'] for chunk in kept] == [GAS, CELLS]
+    assert [chunk['pages'] for chunk in kept] == [[2, 3, 12], [4, 40]]
+    assert stats['chunks_before_dedup'] == 4
+    assert stats['near_duplicate_chunks_removed'] == 2
+    assert stats['chunk_chars_removed'] == len(GAS) + len(CELLS)
+    assert chunks[0]['pages'] == [3]
+
+
+def test_drop_near_duplicates_keeps_distinct_chunks():
+    chunks = [{'text': GAS, 'pages': [1]}, {'text': CELLS, 'pages': [1]}]
+    kept, stats = drop_near_duplicates(chunks, max_distance=3)
+    assert kept == chunks
+    assert stats['near_duplicate_chunks_removed'] == 0
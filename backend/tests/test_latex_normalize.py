@@ -0,0 +1,64 @@
+import pytest
+
+from app.latex_normalize import LatexNormalizer, normalize_latex
+
+ANSWER = (
+    "The operator is $A = \\begin{pmatrix}1 & 2 \\\\ 3 & 4\\end{pmatrix}$ in this basis, "
+    "so \\(E_n^{1}\\) follows from \\[ H = \\begin{bmatrix}a \\& b\\end{bmatrix} \\] and "
+    "$E = mc^2$.\n\n\n\nA bare \\begin{pmatrix}x \\\\ y\\end{pmatrix} is display math, "
+    "as is $\\begin{bmatrix}0 & 1\\end{bmatrix}$ while $x^2$ stays inline.\n"
+    "```\n$A = \\begin{pmatrix}1\\end{pmatrix}$\n```\n"
+)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("$A = \\begin{pmatrix}1 & 2\\end{pmatrix}$", "$$A = \\begin{pmatrix}1 & 2\\end{pmatrix}$$"),
+    ("so $\\begin{pmatrix}1 & 2\\end{pmatrix}$ is", "so $$\\begin{pmatrix}1 & 2\\end{pmatrix}$$ is"),
+    ("\\(B = \\begin{bmatrix}1\\end{bmatrix} + C\\)", "$$B = \\begin{bmatrix}1\\end{bmatrix} + C$$"),
+    ("a \\begin{pmatrix}1\\end{pmatrix} b", "a $$\\begin{pmatrix}1\\end{pmatrix}$$ b"),
+    ("$E = mc^2$ and $x$", "$E = mc^2$ and $x$"),
+    ("costs $5\n\nthen $x$", "costs $5\n\nthen $x$"),
+    ("$a$$b$", "$a$$b$"),
+])
+def test_inline_math_holding_a_matrix_becomes_display_math(text, expected):
+    assert normalize_latex(text) == expected
+
+
+def test_code_fences_are_left_alone():
+    text = "```\n$A = \\begin{pmatrix}1\\end{pmatrix}$\n```"
+    assert normalize_latex(text) == text
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 16, 64])
+def test_streamed_output_matches_one_shot(chunk_size):
+    normalizer = LatexNormalizer()
+    streamed = "".join(normalizer.feed(ANSWER[i:i + chunk_size]) for i in range(0, len(ANSWER), chunk_size))
+    streamed += normalizer.finish()
+    assert streamed == normalize_latex(ANSWER)
+    assert "$$A = \\begin{pmatrix}" in streamed and "\\end{pmatrix}$$ in this basis" in streamed
+
+
+def test_stray_dollar_before_a_paragraph_break_does_not_leak_math_state():
+    text = "costs $5\n\nthen $x^2$ and $A=\\begin{pmatrix}1\\end{pmatrix}$ done"
+    assert normalize_latex(text) == "costs $5\n\nthen $x^2$ and $$A=\\begin{pmatrix}1\\end{pmatrix}$$ done"
+
+    normalizer = LatexNormalizer()
+    out = normalizer.feed("costs $5 for this\n\nthen ")
+    assert out == "costs $5 for this\n\nthen "
+    assert normalizer.math is None and not normalizer.upgraded and normalizer.held is None
+
+
+def test_bare_matrix_after_a_stray_dollar_is_still_wrapped():
+    text = "costs $5 and \\begin{pmatrix}1\\end{pmatrix}\n\nthen \\begin{bmatrix}2\\end{bmatrix} ok"
+    assert normalize_latex(text) == (
+        "costs $5 and $$\\begin{pmatrix}1\\end{pmatrix}$$\n\nthen $$\\begin{bmatrix}2\\end{bmatrix}$$ ok"
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 11])
+def test_stray_dollar_streamed_matches_one_shot(chunk_size):
+    text = "Price $5, see\n\n\n$B = \\begin{pmatrix}0\\end{pmatrix}$ and $y$ too"
+    normalizer = LatexNormalizer()
+    streamed = "".join(normalizer.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size))
+    streamed += normalizer.finish()
+    assert streamed == normalize_latex(text) == "Price $5, see\n\n$$B = \\begin{pmatrix}0\\end{pmatrix}$$ and $y$ too"
@@ -0,0 +1,33 @@
+import socket
+import time
+
+import pytest
+
+from app.llm_client import LLMClient, LLMDeadlineExceeded
+
+
+def test_transport_timeout_is_retried():
+    calls = []
+
+    def generate(prompt, timeout):
+        calls.append(prompt)
+        if len(calls) == 1:
+            raise socket.timeout("read timed out")
+        return "answer"
+
+    client = LLMClient(generate, max_retries=2, backoff_base=0.01)
+    assert client.generate("question", timeout=5) == "answer"
+    assert len(calls) == 2
+    assert client.stats()['retries'] == 1
+
+
+def test_deadline_is_not_retried():
+    def generate(prompt, timeout):
+        time.sleep(0.5)
+        return "late"
+
+    client = LLMClient(generate, max_retries=2, backoff_base=0.01)
+    with pytest.raises(LLMDeadlineExceeded):
+        client.generate("question", timeout=0.1)
+    stats = client.stats()
+    assert stats['timeouts'] == 1 and stats['retries'] == 0
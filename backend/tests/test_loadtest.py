@@ -0,0 +1,18 @@
+from app.loadtest import cache_effects, unique_question, vary_pdf
+
+
+def test_cache_effects_are_measured_over_the_run_only():
+    before = {'caches': {'answer': {'hits': 10, 'misses': 5}},
+              'coalescing': {'ask': {'executions': 4, 'coalesced': 1}}}
+    after = {'caches': {'answer': {'hits': 40, 'misses': 15}},
+             'coalescing': {'ask': {'executions': 10, 'coalesced': 3}}}
+    records = [{'op': 'ask_stream', 'cached': True}, {'op': 'ask_stream'}, {'op': 'ask_stream', 'error': 'x'}]
+
+    effects = cache_effects(before, after, records)
+
+    assert effects == {'ask_stream_cached_fraction': 0.5, 'answer_cache_hit_rate': 0.75, 'ask_coalesced_fraction': 0.25}
+
+
+def test_variants_do_not_repeat():
+    assert unique_question("What is entropy?", 1) != unique_question("What is entropy?", 2)
+    assert vary_pdf(b"%PDF-1.4", 1).startswith(b"%PDF-1.4") and vary_pdf(b"%PDF", 1) != vary_pdf(b"%PDF", 2)
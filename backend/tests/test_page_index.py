@@ -0,0 +1,35 @@
+import faiss
+import numpy as np
+
+from app.page_index import fine_search
+
+
+def make_index(n=200, d=16, seed=0):
+    vectors = np.random.default_rng(seed).random((n, d), dtype='float32')
+    index = faiss.IndexFlatL2(d)
+    index.add(vectors)
+    return index, vectors
+
+
+def test_fine_search_without_full_vectors_matches_exact_search_over_candidates():
+    index, vectors = make_index()
+    query = vectors[7] + 0.01
+    candidates = np.array([3, 7, 42, 99, 150], dtype='int64')
+
+    distances, ids = fine_search(index, query, candidates, k=3)
+    expected, expected_ids = fine_search(index, query, candidates, k=3, full_vectors=vectors)
+
+    assert ids[0][0] == 7
+    assert set(ids[0]) <= set(candidates)
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(distances, expected, rtol=1e-5)
+
+
+def test_fine_search_reports_indexes_that_cannot_reconstruct():
+    _, vectors = make_index()
+    quantizer = faiss.IndexFlatL2(vectors.shape[1])
+    index = faiss.IndexIVFFlat(quantizer, vectors.shape[1], 4)
+    index.train(vectors)
+    index.add(vectors)
+
+    assert fine_search(index, vectors[0], np.array([0, 1, 2], dtype='int64'), k=2) is None
@@ -0,0 +1,43 @@
+import numpy as np
+
+from app.passage_store import PassageStore, build_pair_inputs
+
+
+class CountingTokenizer:
+    """Whitespace tokenizer with XLM-RoBERTa style pair tokens: <s> a </s></s> b </s>."""
+
+    def __init__(self):
+        self.pair_calls = 0
+        self.vocab = {}
+
+    def encode(self, text, add_special_tokens=True):
+        return [self.vocab.setdefault(word, 10 + len(self.vocab)) for word in text.split()]
+
+    def __call__(self, first, second):
+        self.pair_calls += 1
+        return {'input_ids': [0] + self.encode(first) + [2, 2] + self.encode(second) + [2]}
+
+
+def test_pair_template_is_derived_once_per_tokenizer():
+    tokenizer = CountingTokenizer()
+    passages = [np.array([5, 6, 7], dtype='int32')]
+    for _ in range(3):
+        inputs = build_pair_inputs(tokenizer, [3, 4], passages, max_length=16)
+    assert inputs == [[0, 3, 4, 2, 2, 5, 6, 7, 2]]
+    assert tokenizer.pair_calls == 1
+
+
+class NamedTokenizer:
+    def __init__(self, name_or_path):
+        self.name_or_path = name_or_path
+
+
+def test_passage_store_only_matches_the_tokenizer_it_was_built_with(tmp_path):
+    store = PassageStore(np.arange(5, dtype='int32'), np.array([0, 2, 5], dtype='int64'), "BAAI/bge-reranker-base")
+    store.save(str(tmp_path / "chunk_tokens.npz"))
+    loaded = PassageStore.load(str(tmp_path / "chunk_tokens.npz"))
+
+    assert loaded.matches(NamedTokenizer("BAAI/bge-reranker-base"), 2)
+    assert not loaded.matches(NamedTokenizer("BAAI/bge-reranker-large"), 2)
+    assert not loaded.matches(NamedTokenizer("BAAI/bge-reranker-base"), 3)
+    assert not loaded.matches(None, 2)
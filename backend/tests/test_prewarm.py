@@ -0,0 +1,33 @@
+import json
+import os
+import threading
+
+from app.prewarm import QueryLog
+
+
+def test_query_log_saves_atomically_from_concurrent_writers(tmp_path):
+    path = str(tmp_path / "query_log.json")
+    logs = [QueryLog(path, save_interval=3600) for _ in range(4)]
+    for number, log in enumerate(logs):
+        log.record("doc", f"What is question {number}?")
+
+    threads = [threading.Thread(target=log.save) for log in logs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert len(saved["doc"]) == 1
+    assert os.listdir(tmp_path) == ["query_log.json"]
+
+
+def test_query_log_save_keeps_questions_recorded_between_periodic_saves(tmp_path):
+    path = str(tmp_path / "query_log.json")
+    log = QueryLog(path, save_interval=3600)
+    log.record("doc", "What is entropy?")
+    log.record("doc", "What is enthalpy?")
+    log.save()
+
+    assert QueryLog(path).top("doc", 5) == ["What is enthalpy?", "What is entropy?"]
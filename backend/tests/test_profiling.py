@@ -0,0 +1,20 @@
+from app.profiling import CaptureRegistry
+
+
+def test_only_recent_finished_captures_are_kept():
+    registry = CaptureRegistry(max_finished=2)
+    ids = []
+    for _ in range(4):
+        capture = registry.arm(count=1, mode="cprofile")
+        ids.append(capture['id'])
+        claimed = registry.claim("/ask")
+        registry.release(claimed)
+
+    assert [registry.get(capture_id) is not None for capture_id in ids] == [False, False, True, True]
+
+
+def test_unfinished_captures_are_never_evicted():
+    registry = CaptureRegistry(max_finished=0)
+    pending = registry.arm(count=1, mode="cprofile")
+    registry.arm(count=1, mode="cprofile")
+    assert registry.get(pending['id']) is pending
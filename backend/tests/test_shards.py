@@ -0,0 +1,42 @@
+import faiss
+import pytest
+
+from app.shards import Shard, ShardSet
+
+
+def make_shard(name, texts):
+    return Shard(name, {'content_hash': name, 'document': f"{name}.pdf"}, None, [{'text': t, 'pages': [1]} for t in texts])
+
+
+def test_term_statistics_sum_over_searched_shards():
+    physics = make_shard("physics", ["entropy rises in closed systems", "entropy and enthalpy"])
+    biology = make_shard("biology", ["cells divide by mitosis", "entropy in living cells"])
+    shard_set = ShardSet([physics, biology], max_workers=1)
+
+    df, num_docs = shard_set.term_statistics()
+    assert num_docs == 4
+    assert df["entropy"] == 3
+    assert df["mitosis"] == 1
+
+    df, num_docs = shard_set.term_statistics(["physics"])
+    assert num_docs == 2
+    assert df["entropy"] == 2
+    assert "mitosis" not in df
+
+
+def test_term_statistics_refresh_when_a_shard_is_replaced():
+    shard_set = ShardSet([make_shard("physics", ["entropy rises"])], max_workers=1)
+    assert shard_set.term_statistics()[0]["entropy"] == 1
+    shard_set.add(make_shard("physics", ["enthalpy only", "enthalpy again"]))
+    df, num_docs = shard_set.term_statistics()
+    assert num_docs == 2 and "entropy" not in df
+
+
+def test_shards_with_another_metric_cannot_be_merged():
+    l2 = Shard("l2", {'content_hash': "l2"}, faiss.IndexFlatL2(4), [])
+    inner = Shard("ip", {'content_hash': "ip"}, faiss.IndexFlatIP(4), [])
+    shard_set = ShardSet([l2], max_workers=1)
+    with pytest.raises(ValueError):
+        shard_set.add(inner)
+    shard_set.add(Shard("l2b", {'content_hash': "l2b"}, faiss.IndexFlatL2(4), []))
+    assert len(shard_set) == 2
@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("faiss")
+
+from app import threading_config  # noqa: E402
+
+
+@pytest.fixture
+def applied(monkeypatch):
+    calls = []
+    monkeypatch.setattr(threading_config, "apply_workload", lambda name: calls.append(name))
+    monkeypatch.setattr(threading_config, "use_thread_workload", lambda name: None)
+    return calls
+
+
+def test_overlapping_ingests_return_to_query_when_the_last_one_ends(applied):
+    first = threading_config.workload("ingest")
+    second = threading_config.workload("ingest")
+    first.__enter__()
+    second.__enter__()
+    first.__exit__(None, None, None)
+    assert applied == ["ingest"]
+    second.__exit__(None, None, None)
+    assert applied == ["ingest", "query"]
+
+
+def test_ingests_overlapping_on_threads_end_on_query(applied):
+    started = threading.Barrier(2)
+
+    def ingest():
+        with threading_config.workload("ingest"):
+            started.wait()
+
+    threads = [threading.Thread(target=ingest) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert applied == ["ingest", "query"]
@@ -1,14 +1,19 @@
-import React from 'react';
+import React, { useMemo } from 'react';
 import ReactMarkdown from 'react-markdown';
 import remarkMath from 'remark-math';
 import rehypeKatex from 'rehype-katex';
 import remarkGfm from 'remark-gfm';
 
+// Answer format produced by the backend normalizer (app/latex_normalize.py) that needs no preprocessing here
+export const NORMALIZED_FORMAT_VERSION = 2;
+
 interface AlternativeLatexRendererProps {
   text: string;
+  // Set when the text is already normalized markdown/LaTeX from the backend
+  normalized?: boolean;
 }
 
-const AlternativeLatexRenderer: React.FC<AlternativeLatexRendererProps> = ({ text }) => {
+const AlternativeLatexRenderer: React.FC<AlternativeLatexRendererProps> = ({ text, normalized = false }) => {
   // Pre-process the text to fix common LaTeX issues
   const preprocessText = (rawText: string): string => {
     let processedText = rawText;
@@ -142,7 +147,9 @@ const AlternativeLatexRenderer: React.FC<AlternativeLatexRendererProps> = ({ tex
     return processedText;
   };
 
-  const processedText = preprocessText(text);
+  // Backend answers arrive normalized; only other text (e.g. user messages) runs the regex chain, once per change
+  // eslint-disable-next-line react-hooks/exhaustive-deps -- preprocessText only depends on its argument
+  const processedText = useMemo(() => (normalized ? text : preprocessText(text)), [text, normalized]);
   
   return (
     <div className="text-gray-100 leading-normal">
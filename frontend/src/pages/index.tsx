@@ -1,11 +1,13 @@
 import { useState, useRef, useEffect } from 'react';
 import { useDropzone } from 'react-dropzone';
 import { ClipLoader } from 'react-spinners';
-import AlternativeLatexRenderer from '../components/AlternativeLatexRenderer';
+import AlternativeLatexRenderer, { NORMALIZED_FORMAT_VERSION } from '../components/AlternativeLatexRenderer';
 
 // API configuration
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL || 'http://localhost:8000';
 
+const newConversationId = () => `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+
 export default function Home() {
   const [file, setFile] = useState<File | null>(null);
   const [uploading, setUploading] = useState(false);
@@ -16,7 +18,9 @@ export default function Home() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
   const [pdfUploaded, setPdfUploaded] = useState(false);
-  const [messages, setMessages] = useState<{ role: 'user' | 'assistant'; content: string }[]>([]);
+  const [messages, setMessages] = useState<{ role: 'user' | 'assistant'; content: string; formatVersion?: number }[]>([]);
+  // Lets the backend reuse retrieval candidates across follow-up questions of one chat
+  const [conversationId, setConversationId] = useState(newConversationId);
   const [progressStatus, setProgressStatus] = useState('');
   const [progressMessage, setProgressMessage] = useState('');
   const chatBottomRef = useRef<HTMLDivElement>(null);
@@ -87,6 +91,7 @@ export default function Home() {
               if (data.status === 'complete') {
                 setPdfUploaded(true);
                 setMessages([]);
+                setConversationId(newConversationId());
                 setUploading(false);
                 return;
               } else if (data.status === 'error') {
@@ -132,7 +137,8 @@ export default function Home() {
         },
         body: JSON.stringify({
           question: currentQuestion,
-          history
+          history,
+          conversation_id: conversationId
         })
       });
 
@@ -148,6 +154,7 @@ export default function Home() {
 
       const decoder = new TextDecoder();
       let finalAnswer = '';
+      let formatVersion: number | undefined;
       let buffer = '';
 
       try {
@@ -171,6 +178,7 @@ export default function Home() {
                   
                   if (data.status === 'complete') {
                     finalAnswer = data.answer;
+                    formatVersion = data.format_version;
                     setProgressStatus('');
                     setProgressMessage('');
                   } else if (data.status === 'error') {
@@ -191,7 +199,7 @@ export default function Home() {
       }
 
       if (finalAnswer) {
-        setMessages([...newMessages, { role: 'assistant' as const, content: finalAnswer }]);
+        setMessages([...newMessages, { role: 'assistant' as const, content: finalAnswer, formatVersion }]);
       } else {
         throw new Error('No answer received from server');
       }
@@ -208,7 +216,7 @@ export default function Home() {
   };
 
   // Chat bubble component
-  const ChatBubble = ({ role, content }: { role: 'user' | 'assistant'; content: string }) => (
+  const ChatBubble = ({ role, content, formatVersion }: { role: 'user' | 'assistant'; content: string; formatVersion?: number }) => (
     <div className={`flex ${role === 'user' ? 'justify-end' : 'justify-start'} mb-4 w-full`}>
       <div
         className={
@@ -218,7 +226,7 @@ export default function Home() {
         }
         style={role === 'assistant' ? { maxWidth: '100%' } : {}}
       >
-        <AlternativeLatexRenderer text={content} />
+        <AlternativeLatexRenderer text={content} normalized={formatVersion === NORMALIZED_FORMAT_VERSION} />
       </div>
     </div>
   );
@@ -336,7 +344,7 @@ export default function Home() {
               </div>
             )}
             {messages.map((msg, idx) => (
-              <ChatBubble key={idx} role={msg.role} content={msg.content} />
+              <ChatBubble key={idx} role={msg.role} content={msg.content} formatVersion={msg.formatVersion} />
             ))}
             {loading && (
               <div className="flex justify-start mb-4">
@@ -377,6 +385,7 @@ export default function Home() {
                       setPdfUploaded(false);
                       setFile(null);
                       setMessages([]);
+                      setConversationId(newConversationId());
                       setQuestion('');
                       setError('');
                     }}
@@ -387,6 +396,7 @@ export default function Home() {
                   <button
                     onClick={() => {
                       setMessages([]);
+                      setConversationId(newConversationId());
                       setQuestion('');
                       setError('');
                     }}